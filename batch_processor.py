@@ -0,0 +1,406 @@
+"""
+Procesamiento de archivos del ecógrafo en un pool de procesos administrado.
+
+Cada archivo se procesa de forma aislada en un worker (extracción, selección de template,
+imágenes y render); un error en un archivo no afecta al resto del lote. El pool es único
+para toda la aplicación, así el trabajo pesado nunca corre en el event loop de FastAPI.
+
+Con en_memoria el worker devuelve el informe como bytes ('contenido') en lugar de escribirlo
+en el directorio de trabajo ('save_path'). Cada lote reserva de un presupuesto de memoria
+(RENDER_SPILL_MB) lo que puede ocupar cada informe antes de encolarlo; si no hay lugar, o si el
+informe supera lo reservado, el worker lo escribe en disco y los bytes nunca llegan al proceso
+principal.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import Tuple, Dict, Any, Optional
+
+from fastapi import HTTPException
+
+from report_generator import procesar_ruta, generar_en_memoria
+from doc_converter import convertir_doc_a_docx
+from template_manager import template_store, tipo_por_nombre
+from report_cache import report_cache
+from image_pipeline import image_cache
+from metrics import (Cronometro, iniciar_cronometro, cronometro_actual, etapa, formato_de, registrar_informe,
+                     TIPO_CACHE)
+
+logger = logging.getLogger(__name__)
+
+# Cantidad máxima de archivos procesándose a la vez (configurable por entorno)
+BATCH_MAX_WORKERS = max(1, int(os.getenv('BATCH_MAX_WORKERS', min(4, os.cpu_count() or 1))))
+# Archivos admitidos entre los que están en proceso y los que esperan un worker
+BATCH_MAX_INFLIGHT = max(1, int(os.getenv('BATCH_MAX_INFLIGHT', BATCH_MAX_WORKERS * 25)))
+# Segundos sugeridos al cliente en Retry-After cuando la cola está llena
+BATCH_RETRY_AFTER = int(os.getenv('BATCH_RETRY_AFTER', 30))
+# MB de informes de un lote que pueden estar en memoria a la vez hasta agregarlos al ZIP; el resto va a disco
+RENDER_SPILL_MB = float(os.getenv('RENDER_SPILL_MB', 64))
+# Lo que se reserva por informe de un lote: el doble del archivo subido (el informe lleva sus
+# imágenes), y al menos esto
+RESERVA_MINIMA_INFORME = 1024 * 1024
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+# Última foto de las estadísticas del cache de templates de cada worker, por pid
+_estadisticas_templates: Dict[int, Dict[str, int]] = {}
+# Ídem para el cache de imágenes transcodificadas
+_estadisticas_imagenes: Dict[int, Dict[str, int]] = {}
+
+
+def _inicializar_worker() -> None:
+    '''
+    Se ejecuta una vez al arrancar cada worker: deja los templates parseados en memoria.
+    '''
+    template_store.precargar()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    '''
+    Devuelve el pool de procesos compartido, creándolo la primera vez.
+    '''
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn evita heredar locks/hilos del servidor al hacer fork
+            context = multiprocessing.get_context('spawn')
+            _executor = ProcessPoolExecutor(max_workers=BATCH_MAX_WORKERS, mp_context=context,
+                                            initializer=_inicializar_worker)
+            logger.info(f"Process pool started with {BATCH_MAX_WORKERS} workers")
+        return _executor
+
+
+def _descartar_si_roto() -> None:
+    '''
+    Descarta el pool si quedó roto (un worker murió) para que el próximo pedido cree uno nuevo.
+    '''
+    global _executor
+    with _executor_lock:
+        executor = _executor
+        if executor is None or not getattr(executor, '_broken', False):
+            return
+        _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_executor() -> None:
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+        logger.info("Process pool stopped")
+
+
+class ControlAdmision:
+    '''
+    Cuenta los archivos en curso (en proceso o esperando worker) y rechaza
+    nuevos pedidos cuando se supera la capacidad.
+    '''
+
+    def __init__(self, capacidad: int):
+        self.capacidad = capacidad
+        self.en_curso = 0
+        self._lock = threading.Lock()
+
+    def reservar(self, cantidad: int) -> bool:
+        with self._lock:
+            if self.en_curso + cantidad > self.capacidad and self.en_curso > 0:
+                return False
+            self.en_curso += cantidad
+            return True
+
+    def liberar(self, cantidad: int) -> None:
+        with self._lock:
+            self.en_curso = max(0, self.en_curso - cantidad)
+
+
+admision = ControlAdmision(BATCH_MAX_INFLIGHT)
+
+
+def rechazar_por_capacidad() -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=f"Servidor ocupado: hay {admision.en_curso} archivos en proceso. Reintente más tarde.",
+        headers={"Retry-After": str(BATCH_RETRY_AFTER)}
+    )
+
+
+def preparar_entrada(input_path: str, tmpdir: str) -> str:
+    '''
+    Paso previo al pool que corre en el proceso principal: los .doc se convierten con el
+    servicio de LibreOffice, así los workers reciben siempre .docx o .pdf.
+    '''
+    if input_path.lower().endswith('.doc'):
+        with etapa('doc_conversion'):
+            return convertir_doc_a_docx(input_path, tmpdir)
+    return input_path
+
+
+def _procesar_en_worker(input_path: str, tmpdir: str, filename: str, enviado: float,
+                        parser: Optional[str] = None, en_memoria: bool = False,
+                        max_en_memoria: Optional[int] = None) -> Dict[str, Any]:
+    '''
+    Punto de entrada de cada worker. Nunca propaga excepciones: devuelve el error como datos
+    para que el resultado se pueda serializar de vuelta al proceso principal.
+    Junto con el resultado vuelven las estadísticas de los caches de templates e imágenes y las
+    etapas medidas.
+    '''
+    cronometro = iniciar_cronometro(formato_de(filename))
+    cronometro.etapas.append(('queue_wait', max(0.0, time.time() - enviado)))
+    try:
+        if en_memoria:
+            nombre, contenido = generar_en_memoria(input_path, tmpdir, filename, parser)
+            resultado = {'filename': filename, 'save_path': None, 'nombre': nombre, 'contenido': contenido,
+                         'error': None}
+            if max_en_memoria is not None and len(contenido) > max_en_memoria:
+                # Más grande que lo reservado en el lote: se escribe acá y vuelve solo la ruta
+                save_path = os.path.join(tmpdir, nombre)
+                with open(save_path, 'wb') as f:
+                    f.write(contenido)
+                resultado.update(save_path=save_path, contenido=None)
+        else:
+            save_path = procesar_ruta(input_path, tmpdir, filename, parser)
+            resultado = {'filename': filename, 'save_path': save_path, 'nombre': os.path.basename(save_path),
+                         'error': None}
+    except HTTPException as e:
+        resultado = {'filename': filename, 'save_path': None, 'error': str(e),
+                     'status_code': e.status_code, 'detail': e.detail}
+    except Exception as e:
+        resultado = {'filename': filename, 'save_path': None, 'error': str(e)}
+    if cronometro.degradado:
+        resultado['degradado'] = cronometro.degradado
+    resultado['worker'] = {'pid': os.getpid(), 'templates': template_store.estadisticas(),
+                           'imagenes': image_cache.estadisticas(), 'etapas': cronometro.exportar()}
+    return resultado
+
+
+def _registrar_resultado(resultado: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Guarda lo que el worker mandó junto con el resultado y registra las métricas del informe.
+    Si quien espera el resultado tiene un cronómetro activo (upload, conversión, cache), las
+    etapas del worker se suman a ese; si no, se registran solas.
+    '''
+    worker = resultado.pop('worker', None)
+    cronometro = cronometro_actual()
+    duracion = cronometro.duracion() if cronometro is not None else None
+    if cronometro is None:
+        cronometro = Cronometro(formato_de(resultado.get('filename')))
+    if worker:
+        _estadisticas_templates[worker['pid']] = worker['templates']
+        _estadisticas_imagenes[worker['pid']] = worker['imagenes']
+        cronometro.agregar(worker['etapas'])
+    if resultado.get('cache'):
+        estado = 'cache'
+        # El informe cacheado no pasó por un worker que detecte el tipo
+        cronometro.tipo = cronometro.tipo or tipo_por_nombre(resultado['filename']) or TIPO_CACHE
+    else:
+        estado = 'ok' if resultado['error'] is None else 'error'
+    registrar_informe(cronometro, estado, duracion)
+    return resultado
+
+
+def estadisticas_templates() -> Dict[str, int]:
+    '''
+    Suma las estadísticas del cache de templates (hits, reloads, loads) de todos los workers.
+    '''
+    total = {'hits': 0, 'reloads': 0, 'loads': 0}
+    for estadisticas in list(_estadisticas_templates.values()):
+        for key in total:
+            total[key] += estadisticas.get(key, 0)
+    return total
+
+
+def estadisticas_imagenes() -> Dict[str, Any]:
+    '''
+    Suma las estadísticas del cache de imágenes de todos los workers, con la tasa de aciertos.
+    '''
+    total = {'hits': 0, 'misses': 0, 'evictions': 0, 'entradas': 0, 'bytes': 0}
+    for estadisticas in list(_estadisticas_imagenes.values()):
+        for key in total:
+            total[key] += estadisticas.get(key, 0)
+    consultas = total['hits'] + total['misses']
+    total['hit_rate'] = round(total['hits'] / consultas, 4) if consultas else 0.0
+    return total
+
+
+def _resultado_worker_roto(filename: str, e: Exception) -> Dict[str, Any]:
+    logger.error(f"Worker terminated while processing {filename}: {e}")
+    return {'filename': filename, 'save_path': None,
+            'error': f"El proceso de trabajo terminó inesperadamente: {e}"}
+
+
+def enviar(input_path: str, tmpdir: str, filename: str, parser: Optional[str] = None,
+           en_memoria: bool = False, max_en_memoria: Optional[int] = None) -> Future:
+    '''
+    Encola un archivo en el pool compartido y devuelve el Future con su resultado.
+    parser elige cómo leer un .docx (ver parsed_study.PARSERS_DOCX); None usa DOCX_PARSER.
+    Con en_memoria el informe vuelve en 'contenido' y no se escribe en tmpdir, salvo que
+    supere max_en_memoria bytes.
+    '''
+    argumentos = (input_path, tmpdir, filename, time.time(), parser, en_memoria, max_en_memoria)
+    try:
+        return get_executor().submit(_procesar_en_worker, *argumentos)
+    except BrokenProcessPool:
+        _descartar_si_roto()
+        return get_executor().submit(_procesar_en_worker, *argumentos)
+
+
+def _guardar_en_cache(clave: str, future: Future, salida: Future) -> None:
+    '''
+    Callback del Future del pool: guarda el informe en el cache y recién después resuelve
+    `salida`, así un pedido que llega justo al terminar este ya lo encuentra cacheado.
+    '''
+    try:
+        resultado = future.result()
+    except BaseException as e:
+        salida.set_exception(e)
+        return
+    try:
+        if resultado.get('degradado'):
+            # Un fallback (p. ej. el LLM no respondió) no se cachea: el próximo pedido reintenta
+            logger.info(f"Not caching degraded report for {resultado['filename']}: {resultado['degradado']}")
+        elif resultado['error'] is None and resultado.get('contenido') is not None:
+            report_cache.guardar_contenido(clave, resultado['nombre'], resultado['contenido'])
+        elif resultado['error'] is None:
+            report_cache.guardar(clave, resultado['save_path'])
+    except Exception as e:
+        logger.warning(f"Could not store report in cache: {e}")
+    salida.set_result(resultado)
+
+
+def enviar_archivo(input_path: str, tmpdir: str, filename: str, clave: Optional[str] = None,
+                   parser: Optional[str] = None, en_memoria: bool = False,
+                   max_en_memoria: Optional[int] = None) -> Future:
+    '''
+    Como enviar, pero para el archivo tal como se subió: si su informe ya está en el cache
+    devuelve un Future resuelto sin tocar el pool; si no, convierte el .doc, lo encola y
+    guarda el informe en el cache al terminar. Corre en el proceso principal y bloquea.
+    '''
+    with etapa('report_cache'):
+        if clave is None:
+            clave = report_cache.clave(input_path, parser=parser)
+        tamano = report_cache.tamano(clave) if en_memoria and max_en_memoria is not None else None
+        if en_memoria and (tamano is None or tamano <= max_en_memoria):
+            cacheado = report_cache.obtener_contenido(clave)
+            if cacheado is not None:
+                cacheado = {'save_path': None, 'nombre': cacheado[0], 'contenido': cacheado[1]}
+        else:
+            save_path = report_cache.obtener(clave, tmpdir)
+            if save_path is not None:
+                cacheado = {'save_path': save_path, 'nombre': os.path.basename(save_path)}
+            else:
+                cacheado = None
+    if cacheado is not None:
+        logger.info(f"Report cache hit for {filename}")
+        future = Future()
+        future.set_result({'filename': filename, **cacheado, 'error': None, 'cache': True})
+        return future
+    try:
+        input_path = preparar_entrada(input_path, tmpdir)
+    except Exception:
+        registrar_informe(cronometro_actual() or Cronometro(formato_de(filename)), 'error')
+        raise
+    salida = Future()
+    enviar(input_path, tmpdir, filename, parser, en_memoria, max_en_memoria).add_done_callback(lambda f: _guardar_en_cache(clave, f, salida))
+    return salida
+
+
+def esperar_resultado(future: Future, filename: str) -> Dict[str, Any]:
+    '''
+    Espera (bloqueando) el resultado de un Future devuelto por enviar.
+    '''
+    try:
+        return _registrar_resultado(future.result())
+    except BrokenProcessPool as e:
+        _descartar_si_roto()
+        return _resultado_worker_roto(filename, e)
+
+
+async def esperar_resultado_async(future: Future, filename: str) -> Dict[str, Any]:
+    '''
+    Igual que esperar_resultado pero sin bloquear el event loop.
+    '''
+    try:
+        return _registrar_resultado(await asyncio.wrap_future(future))
+    except BrokenProcessPool as e:
+        _descartar_si_roto()
+        return _resultado_worker_roto(filename, e)
+
+
+def procesar_archivo(input_path: str, tmpdir: str, filename: str, parser: Optional[str] = None,
+                     clave: Optional[str] = None) -> Tuple[str, bytes]:
+    '''
+    Procesa un único archivo tal como se subió (usando el cache de informes) y devuelve
+    (nombre, contenido) del informe generado en memoria, relanzando el HTTPException original
+    si el worker falló.
+    '''
+    future = enviar_archivo(input_path, tmpdir, filename, clave, parser, en_memoria=True)
+    resultado = esperar_resultado(future, filename)
+    if resultado['error'] is None:
+        return resultado['nombre'], resultado['contenido']
+    if 'status_code' in resultado:
+        raise HTTPException(status_code=resultado['status_code'], detail=resultado['detail'])
+    raise HTTPException(status_code=500, detail={"error": "Error interno del servidor procesando el archivo",
+                                                 "filename": filename, "details": resultado['error']})
+
+
+class InformesEnMemoria:
+    '''
+    Presupuesto de memoria de un lote para sus informes, desde que se encolan hasta que se
+    agregan al ZIP. Cada archivo reserva lugar antes de ir al worker (reservar); si no hay, o
+    si el informe resulta más grande que lo reservado, el worker lo escribe en su directorio
+    de trabajo y el resultado trae 'save_path' en lugar de 'contenido'. Así los informes de un
+    lote en el proceso principal nunca ocupan más que max_bytes.
+    '''
+
+    def __init__(self, max_bytes: int = int(RENDER_SPILL_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self.en_memoria = 0
+        self.a_disco = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def estimar(tamano_subido: int) -> int:
+        return max(RESERVA_MINIMA_INFORME, 2 * tamano_subido)
+
+    def reservar(self, estimado: int) -> Optional[int]:
+        '''
+        Reserva estimado bytes para un informe que se va a encolar. Devuelve el máximo con el
+        que puede volver en memoria (max_en_memoria de enviar), o None si no hay lugar.
+        '''
+        with self._lock:
+            if self.en_memoria + estimado > self.max_bytes:
+                return None
+            self.en_memoria += estimado
+            return estimado
+
+    def ajustar(self, resultado: Dict[str, Any], reservado: Optional[int]) -> None:
+        '''
+        Al volver el resultado, la reserva pasa a ser lo que ocupa el informe: nada si quedó en
+        disco o falló.
+        '''
+        contenido = resultado.get('contenido')
+        ocupado = len(contenido) if contenido is not None else 0
+        with self._lock:
+            self.en_memoria += ocupado - (reservado or 0)
+            if resultado['error'] is None and contenido is None:
+                self.a_disco += 1
+
+    def liberar(self, resultado: Dict[str, Any]) -> None:
+        '''
+        Descuenta el informe ya agregado al ZIP y suelta sus bytes (los duplicados del lote
+        comparten el mismo resultado y solo usan su nombre).
+        '''
+        contenido = resultado.get('contenido')
+        if contenido is None:
+            return
+        resultado['contenido'] = None
+        with self._lock:
+            self.en_memoria -= len(contenido)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Benchmark sin red del circuito de extracción con LLM (cache, single-flight y concurrencia)
+usando el backend stub con latencia simulada.
+
+Uso: python bench_llm_extraction.py [archivos] [repetidos] [latencia]
+"""
+
+import os
+import sys
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_extraction import ExtractorLLM, BackendStub, CacheLLM
+
+
+def _respuesta(text):
+    return {"LVEF": {"value": 60, "unit": "%"}}
+
+
+def correr(extractor, textos):
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(extractor.extraer, textos))
+    return time.perf_counter() - inicio
+
+
+def main():
+    archivos = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    repetidos = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    latencia = float(sys.argv[3]) if len(sys.argv) > 3 else 0.5
+
+    # archivos distintos más algunos repetidos, como un lote real
+    textos = [f"Patient {i} LVIDd 48 mm EF {50 + i} %" for i in range(archivos)]
+    textos += textos[:repetidos]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_path = os.path.join(tmpdir, "llm.sqlite3")
+        backend = BackendStub(_respuesta, latencia=latencia)
+
+        sin_nada = ExtractorLLM(backend, "bench", cache=None, max_concurrentes=1)
+        t_serial = time.perf_counter()
+        for text in textos:
+            sin_nada.backend(text)
+        t_serial = time.perf_counter() - t_serial
+
+        frio = ExtractorLLM(backend, "bench", cache=CacheLLM(cache_path))
+        t_frio = correr(frio, textos)
+
+        caliente = ExtractorLLM(backend, "bench", cache=CacheLLM(cache_path))
+        t_caliente = correr(caliente, textos)
+
+    print(f"{len(textos)} textos ({repetidos} repetidos), latencia simulada {latencia}s")
+    print(f"  secuencial sin cache:      {t_serial:7.2f}s  ({len(textos)} llamadas)")
+    print(f"  cache frío + single-flight:{t_frio:7.2f}s  {frio.estadisticas}")
+    print(f"  cache caliente:            {t_caliente:7.2f}s  {caliente.estadisticas}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Benchmark del motor de reglas de mediciones contra la cadena original de funciones,
+sobre diccionarios crudos sintéticos como los que arma parse_nested_measurements.
+Verifica además que ambos den el mismo resultado.
+
+Uso: python bench_measurement_rules.py [estudios] [semilla]
+"""
+
+import sys
+import copy
+import time
+import random
+
+from aux_calculations import convert_to_int, conv_vel_a_m, text_mass_hypertrophy, text_diam_LV, text_atrium, remove_signs
+from patient_data_extraction import update_dictionary, dic_cleaning
+from measurement_rules import procesar_mediciones, CALCULOS, A_ENTERO, VELOCIDADES_CM_S
+
+UN_SOLO_VALOR = {'LVd Mass Index(2D-ASE)', 'RWT(2D)'}
+
+
+def cadena_original(data, gender):
+    data = update_dictionary(data)
+    data = dic_cleaning(data)
+    data = convert_to_int(data)
+    data = conv_vel_a_m(data)
+    data['Gender'] = gender
+    data = text_mass_hypertrophy(data)
+    data = text_diam_LV(data)
+    data = text_atrium(data)
+    return remove_signs(data)
+
+
+def _numero(rng):
+    return f"{rng.uniform(0.2, 120):.{rng.choice([0, 1, 2])}f}"
+
+
+def estudio_sintetico(rng):
+    '''
+    {clave: [textos]} con mediciones que se redondean, velocidades, cálculos incrustados
+    en la lista de otra medición y otras claves del equipo.
+    '''
+    claves = sorted(A_ENTERO | VELOCIDADES_CM_S) + ['LVd Mass Index(2D-ASE)', 'RWT(2D)', 'LVEF', 'TAPSE', 'MV Dec T']
+    data = {}
+    for clave in rng.sample(claves, rng.randint(10, len(claves))):
+        # la masa y el RWT vienen con un solo valor: la cadena original no acepta listas ahí
+        repeticiones = 1 if clave in UN_SOLO_VALOR else rng.choice([1, 1, 1, 2, 3])
+        data[clave] = [_numero(rng) for _ in range(repeticiones)]
+    for clave in rng.sample(sorted(data), 3):
+        calculo = rng.choice(sorted(CALCULOS - UN_SOLO_VALOR))
+        data[clave] += [calculo, _numero(rng)]
+    return data
+
+
+def main():
+    estudios = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rng = random.Random(int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    entradas = [(estudio_sintetico(rng), rng.choice(['Male', 'Female'])) for _ in range(estudios)]
+
+    originales = [(copy.deepcopy(data), gender) for data, gender in entradas]
+    inicio = time.perf_counter()
+    esperado = [cadena_original(data, gender) for data, gender in originales]
+    t_original = time.perf_counter() - inicio
+
+    reglas = [(copy.deepcopy(data), gender) for data, gender in entradas]
+    inicio = time.perf_counter()
+    obtenido = [procesar_mediciones(data, gender) for data, gender in reglas]
+    t_reglas = time.perf_counter() - inicio
+
+    distintos = sum(1 for a, b in zip(esperado, obtenido) if a != b)
+    print(f"{estudios} estudios sintéticos")
+    print(f"  cadena original: {t_original * 1000 / estudios:7.3f} ms/estudio")
+    print(f"  motor de reglas: {t_reglas * 1000 / estudios:7.3f} ms/estudio")
+    print(f"  resultados distintos: {distintos}")
+    return 1 if distintos else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
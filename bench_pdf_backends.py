@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Benchmark de los backends de analyze_pdf_content (pdfium y pdfplumber) sobre un conjunto
+de PDFs del ecógrafo. Verifica además que ambos devuelvan las mismas páginas.
+
+Uso: python bench_pdf_backends.py <carpeta o PDFs...> [--repeticiones N]
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+from pdf_processor import analyze_pdf_content, find_pdf_files, BACKENDS_PDF
+
+
+def _medir(pdfs, backend, repeticiones):
+    resultados = {}
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for pdf in pdfs:
+            resultados[pdf] = analyze_pdf_content(str(pdf), backend)
+    return resultados, time.perf_counter() - inicio
+
+
+def main():
+    argumentos = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    argumentos.add_argument('rutas', nargs='+', help='carpetas con PDFs o archivos PDF')
+    argumentos.add_argument('--repeticiones', type=int, default=3)
+    args = argumentos.parse_args()
+
+    pdfs = []
+    for ruta in map(Path, args.rutas):
+        pdfs.extend(sorted(find_pdf_files(str(ruta))) if ruta.is_dir() else [ruta])
+    if not pdfs:
+        print("No se encontraron PDFs")
+        return 1
+
+    tiempos = {}
+    paginas = {}
+    for backend in BACKENDS_PDF:
+        paginas[backend], tiempos[backend] = _medir(pdfs, backend, args.repeticiones)
+
+    total_paginas = sum(len(paginas[BACKENDS_PDF[0]][pdf]) for pdf in pdfs) * args.repeticiones
+    print(f"{len(pdfs)} PDFs, {total_paginas // args.repeticiones} páginas, {args.repeticiones} repeticiones")
+    for backend in BACKENDS_PDF:
+        print(f"  {backend:>10}: {tiempos[backend] * 1000 / total_paginas:7.2f} ms/página")
+
+    distintas = 0
+    for pdf in pdfs:
+        for a, b in zip(*(paginas[backend][pdf] for backend in BACKENDS_PDF)):
+            if a != b:
+                distintas += 1
+                campos = [campo for campo in a if a[campo] != b.get(campo)]
+                print(f"  distinta: {pdf.name} página {a['page_number']} ({', '.join(campos)})")
+    print(f"  páginas distintas: {distintas}")
+    return 1 if distintas else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,289 @@
+"""
+Servicio persistente de conversión .doc -> .docx con LibreOffice.
+
+El binario soffice se busca una sola vez y se mantiene un pool de instancias headless
+escuchando en un pipe UNO; cada conversión reutiliza una instancia ya iniciada en lugar
+de arrancar LibreOffice en frío. Las llamadas UNO las hace un proceso puente (uno_bridge.py)
+por instancia, que corre con un intérprete que puede importar `uno` (UNO_PYTHON): el python
+del servidor no lo necesita. Si no hay ninguno, cada conversión arranca un `soffice
+--convert-to` nuevo (no persistente) con el perfil ya inicializado de su worker.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import lru_cache
+from typing import Optional, List
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Instancias de LibreOffice que se mantienen vivas
+SOFFICE_WORKERS = max(1, int(os.getenv('SOFFICE_WORKERS', 2)))
+# Tiempo máximo por conversión, en segundos
+SOFFICE_TIMEOUT = float(os.getenv('SOFFICE_TIMEOUT', 60))
+
+SOFFICE_PATHS = [
+    'soffice',  # En PATH
+    '/usr/bin/soffice',
+    '/usr/local/bin/soffice',
+    '/opt/homebrew/bin/soffice',
+    '/Applications/LibreOffice.app/Contents/MacOS/soffice'  # macOS
+]
+
+# Intérpretes donde se busca el módulo uno; UNO_PYTHON fija uno en particular
+UNO_PYTHON_PATHS = [
+    sys.executable,
+    '/usr/bin/python3',  # Debian/Ubuntu con python3-uno
+    '/usr/lib/libreoffice/program/python',
+    '/Applications/LibreOffice.app/Contents/Resources/python'  # macOS
+]
+
+PUENTE_UNO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uno_bridge.py')
+
+
+@lru_cache(maxsize=1)
+def encontrar_soffice() -> Optional[str]:
+    '''
+    Busca LibreOffice/soffice en las ubicaciones conocidas. El resultado queda cacheado
+    para que la búsqueda (que ejecuta `soffice --version`) se haga una sola vez.
+    '''
+    for path in SOFFICE_PATHS:
+        candidate = shutil.which(path) or (path if os.path.isfile(path) else None)
+        if not candidate:
+            continue
+        try:
+            result = subprocess.run([candidate, '--version'], capture_output=True, text=True, timeout=10)
+            if result.returncode == 0:
+                logger.info(f"LibreOffice found at {candidate}: {result.stdout.strip()}")
+                return candidate
+        except (OSError, subprocess.TimeoutExpired):
+            continue
+    logger.warning("LibreOffice/soffice not found, .doc conversion disabled")
+    return None
+
+
+@lru_cache(maxsize=1)
+def encontrar_python_uno() -> Optional[str]:
+    '''
+    Busca (una sola vez) un intérprete que pueda importar `uno` para correr uno_bridge.py.
+    '''
+    candidatos = [os.getenv('UNO_PYTHON')] if os.getenv('UNO_PYTHON') else UNO_PYTHON_PATHS
+    for path in candidatos:
+        if not path or not os.path.isfile(path):
+            continue
+        try:
+            result = subprocess.run([path, '-c', 'import uno'], capture_output=True, timeout=30)
+            if result.returncode == 0:
+                logger.info(f"UNO bridge interpreter: {path}")
+                return path
+        except (OSError, subprocess.TimeoutExpired):
+            continue
+    logger.warning("No Python interpreter with the uno module found: every .doc conversion starts a new soffice")
+    return None
+
+
+class SofficeWorker:
+    '''
+    Una instancia de LibreOffice con perfil propio. Con python_uno el proceso queda vivo
+    escuchando en un pipe con nombre único, junto con su proceso puente; sin él solo se
+    reutiliza el perfil.
+    '''
+
+    def __init__(self, soffice: str, indice: int, python_uno: Optional[str] = None):
+        self.soffice = soffice
+        self.indice = indice
+        self.python_uno = python_uno
+        self.nombre_pipe = f"eco_soffice_{os.getpid()}_{indice}"
+        self.profile_dir = os.path.join(tempfile.gettempdir(), self.nombre_pipe)
+        self.profile_url = 'file://' + self.profile_dir.replace(os.sep, '/')
+        self.proceso: Optional[subprocess.Popen] = None
+        self.puente: Optional[subprocess.Popen] = None
+        # Hilo dedicado para poder cortar una conversión colgada por timeout
+        self._hilo = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.nombre_pipe)
+
+    @property
+    def persistente(self) -> bool:
+        return self.python_uno is not None
+
+    def iniciar(self) -> None:
+        if not self.persistente:
+            return
+        self.proceso = subprocess.Popen(
+            [self.soffice, f'-env:UserInstallation={self.profile_url}', '--headless', '--invisible',
+             '--nologo', '--norestore', '--nodefault', '--nolockcheck',
+             f'--accept=pipe,name={self.nombre_pipe};urp;StarOffice.ComponentContext'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        self.puente = subprocess.Popen(
+            [self.python_uno, PUENTE_UNO, self.nombre_pipe],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1
+        )
+        logger.info(f"Started LibreOffice worker {self.indice} (pid {self.proceso.pid}, bridge pid {self.puente.pid})")
+
+    def vivo(self) -> bool:
+        if not self.persistente:
+            return True
+        return all(p is not None and p.poll() is None for p in (self.proceso, self.puente))
+
+    def detener(self) -> None:
+        for proceso in (self.puente, self.proceso):
+            if proceso is not None and proceso.poll() is None:
+                proceso.kill()
+                try:
+                    proceso.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    pass
+        self.proceso = None
+        self.puente = None
+
+    def reiniciar(self) -> None:
+        logger.warning(f"Restarting LibreOffice worker {self.indice}")
+        self.detener()
+        self.iniciar()
+
+    def convertir(self, input_path: str, output_path: str, timeout: float) -> None:
+        if not self.vivo():
+            self.reiniciar()
+        if self.persistente:
+            future = self._hilo.submit(self._convertir_puente, input_path, output_path, timeout)
+            try:
+                future.result(timeout=timeout)
+            except FutureTimeoutError:
+                # Matar los procesos libera la lectura bloqueada en el hilo del worker
+                self.reiniciar()
+                raise Exception(f"LibreOffice superó el tiempo máximo de {timeout:.0f}s")
+        else:
+            self._convertir_subprocess(input_path, output_path, timeout)
+
+    def _convertir_puente(self, input_path: str, output_path: str, timeout: float) -> None:
+        puente = self.puente
+        pedido = {'entrada': os.path.abspath(input_path), 'salida': os.path.abspath(output_path), 'timeout': timeout}
+        try:
+            puente.stdin.write(json.dumps(pedido) + '\n')
+            puente.stdin.flush()
+            linea = puente.stdout.readline()
+        except (OSError, ValueError):
+            linea = ''
+        if not linea:
+            raise Exception("El proceso puente de LibreOffice terminó inesperadamente")
+        respuesta = json.loads(linea)
+        if 'error' in respuesta:
+            raise Exception(f"LibreOffice falló: {respuesta['error']}")
+
+    def _convertir_subprocess(self, input_path: str, output_path: str, timeout: float) -> None:
+        cmd = [
+            self.soffice,
+            f'-env:UserInstallation={self.profile_url}',
+            '--headless',
+            '--convert-to', 'docx',
+            '--outdir', os.path.dirname(output_path),
+            input_path
+        ]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            raise Exception(f"LibreOffice superó el tiempo máximo de {timeout:.0f}s")
+        if result.returncode != 0:
+            raise Exception(f"LibreOffice falló: {result.stderr}")
+
+
+class ServicioConversion:
+    '''
+    Pool de SofficeWorker. Cada conversión toma un worker libre, y si el worker
+    murió o la conversión se colgó, se reinicia antes de devolverlo al pool.
+    '''
+
+    def __init__(self, soffice: str, cantidad: int = SOFFICE_WORKERS, python_uno: Optional[str] = None):
+        self.python_uno = python_uno
+        self.workers: List[SofficeWorker] = [SofficeWorker(soffice, i, python_uno) for i in range(cantidad)]
+        self._libres: "queue.Queue[SofficeWorker]" = queue.Queue()
+        for worker in self.workers:
+            worker.iniciar()
+            self._libres.put(worker)
+
+    def convertir(self, input_path: str, output_path: str, timeout: float = SOFFICE_TIMEOUT) -> None:
+        worker = self._libres.get()
+        try:
+            worker.convertir(input_path, output_path, timeout)
+        except Exception:
+            if not worker.vivo():
+                worker.reiniciar()
+            raise
+        finally:
+            self._libres.put(worker)
+
+    def detener(self) -> None:
+        for worker in self.workers:
+            worker.detener()
+            shutil.rmtree(worker.profile_dir, ignore_errors=True)
+
+
+_servicio: Optional[ServicioConversion] = None
+_servicio_lock = threading.Lock()
+
+
+def iniciar_servicio_conversion() -> Optional[ServicioConversion]:
+    '''
+    Inicia (una sola vez) el pool de LibreOffice. Devuelve None si soffice no está instalado.
+    '''
+    global _servicio
+    with _servicio_lock:
+        if _servicio is None:
+            soffice = encontrar_soffice()
+            if soffice is None:
+                return None
+            _servicio = ServicioConversion(soffice, python_uno=encontrar_python_uno())
+            modo = "persistent UNO" if _servicio.python_uno else "soffice --convert-to per conversion"
+            logger.info(f"LibreOffice conversion service ready ({SOFFICE_WORKERS} workers, {modo})")
+        return _servicio
+
+
+def detener_servicio_conversion() -> None:
+    global _servicio
+    with _servicio_lock:
+        servicio, _servicio = _servicio, None
+    if servicio is not None:
+        servicio.detener()
+
+
+def convertir_doc_a_docx(input_path: str, tmpdir: str) -> str:
+    '''
+    Convierte un .doc a .docx dentro de tmpdir usando el servicio de LibreOffice
+    y devuelve la ruta del .docx generado.
+    '''
+    try:
+        # Generar nombre para archivo convertido
+        converted_filename = os.path.splitext(os.path.basename(input_path))[0] + '.docx'
+        converted_path = os.path.join(tmpdir, converted_filename)
+
+        servicio = iniciar_servicio_conversion()
+        if servicio is None:
+            raise Exception("No se encontró LibreOffice/soffice en el sistema")
+
+        servicio.convertir(input_path, converted_path)
+
+        # Verificar que el archivo se creó correctamente
+        if not os.path.exists(converted_path):
+            raise Exception('El archivo .docx convertido no se creó')
+
+        size = os.path.getsize(converted_path)
+        logger.info(f"Converted {os.path.basename(input_path)} to .docx ({size} bytes)")
+
+        if size == 0:
+            raise Exception('El archivo .docx convertido está vacío')
+
+        return converted_path
+
+    except Exception as e:
+        logger.error(f".doc conversion failed for {os.path.basename(input_path)}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error convirtiendo archivo .doc a .docx: {str(e)}")
@@ -0,0 +1,106 @@
+"""
+Índice de las tablas de un .docx armado en una sola pasada.
+
+python-docx recalcula `row.cells`, `cell.text` y `cell.tables` en cada acceso, y los reportes
+de estrés tienen muchas tablas anidadas que se recorrían varias veces (búsqueda de la tabla de
+mediciones, de la de motilidad, datos del paciente, selección de template). El índice recorre
+el documento una vez y guarda, por tabla, el texto de cada celda, sus tablas anidadas y las
+palabras marcadoras que contiene; después cada búsqueda es una consulta a un diccionario.
+
+Las tablas indexadas exponen `rows`, `cells`, `text` y `tables` como las de python-docx, así las
+funciones de extracción existentes las recorren sin cambios.
+"""
+
+from typing import Dict, List, Optional
+
+# Palabras que identifican tablas: 'measure' (mediciones) y 'wms' (motilidad parietal)
+MARCADORES = ('measure', 'wms')
+
+
+class CeldaIndexada:
+    __slots__ = ('text', 'tables')
+
+    def __init__(self, text: str, tables: List['TablaIndexada']):
+        self.text = text
+        self.tables = tables
+
+
+class FilaIndexada:
+    __slots__ = ('cells',)
+
+    def __init__(self, cells: List[CeldaIndexada]):
+        self.cells = cells
+
+
+class TablaIndexada:
+    '''
+    Vista de solo lectura de una tabla con todo ya calculado. Las celdas combinadas
+    (gridSpan / vMerge) son el mismo objeto repetido, igual que en python-docx.
+    '''
+
+    def __init__(self, rows: List[FilaIndexada]):
+        self.rows = rows
+        textos = [cell.text.lower() for row in self.rows for cell in row.cells]
+        self.marcadores = {marcador for marcador in MARCADORES if any(marcador in texto for texto in textos)}
+        self.tiene_anidadas = any(cell.tables for row in self.rows for cell in row.cells)
+
+    @classmethod
+    def desde_docx(cls, table) -> 'TablaIndexada':
+        '''
+        Indexa una docx.table.Table. Cada <w:tc> se lee una sola vez aunque abarque varias celdas.
+        '''
+        celdas = {}
+        rows = []
+        for row in table.rows:
+            cells = []
+            for cell in row.cells:
+                celda = celdas.get(cell._tc)
+                if celda is None:
+                    celda = celdas[cell._tc] = CeldaIndexada(cell.text, [cls.desde_docx(t) for t in cell.tables])
+                cells.append(celda)
+            rows.append(FilaIndexada(cells))
+        return cls(rows)
+
+
+class DocxTableIndex:
+    '''
+    Tablas de primer nivel del documento (con sus anidadas) y la primera tabla que contiene
+    cada marcador. Se arma desde un docx.Document (desde_documento, la implementación de
+    referencia) o leyendo word/document.xml directamente (desde_xml, ver docx_xml_parser).
+    '''
+
+    def __init__(self, tablas: List[TablaIndexada]):
+        self.tablas = tablas
+        self._por_marcador: Dict[str, int] = {}
+        for i, tabla in enumerate(self.tablas):
+            for marcador in tabla.marcadores:
+                self._por_marcador.setdefault(marcador, i)
+
+    @classmethod
+    def desde_documento(cls, doc) -> 'DocxTableIndex':
+        return cls([TablaIndexada.desde_docx(table) for table in doc.tables])
+
+    @classmethod
+    def desde_xml(cls, path: str) -> 'DocxTableIndex':
+        from docx_xml_parser import leer_tablas
+        return cls(leer_tablas(path))
+
+    def indice_con(self, marcador: str) -> Optional[int]:
+        '''
+        Posición de la primera tabla con el marcador, o None.
+        '''
+        return self._por_marcador.get(marcador.lower())
+
+    def tabla_con(self, marcador: str) -> Optional[TablaIndexada]:
+        indice = self.indice_con(marcador)
+        return self.tablas[indice] if indice is not None else None
+
+
+def indice_de(doc) -> DocxTableIndex:
+    '''
+    Índice de tablas de doc: el que ya tiene un ParsedStudy, o uno nuevo para un docx.Document.
+    '''
+    indice = getattr(doc, 'table_index', None)
+    if isinstance(indice, DocxTableIndex):
+        return indice
+    return DocxTableIndex.desde_documento(doc)
@@ -0,0 +1,186 @@
+"""
+Lectura directa de word/document.xml con lxml iterparse, sin crear objetos de python-docx.
+
+Produce las mismas tablas indexadas (rows / cells / text / tables) que DocxTableIndex arma
+desde python-docx, con las mismas reglas:
+- tablas: <w:tbl> hijas directas de <w:body> o de una <w:tc>
+- texto de una celda: sus <w:p> directos unidos con "\\n"; de cada párrafo, los <w:r> directos
+  y los de <w:hyperlink>, traduciendo w:tab, w:br, w:cr, w:noBreakHyphen y w:ptab
+- celdas de una fila: cada <w:tc> repetida según gridSpan, corridas gridBefore columnas de la
+  grilla; vMerge="continue" toma la celda de arriba
+
+python-docx sigue siendo la implementación de referencia (DOCX_PARSER=docx). Estas reglas son
+las de python-docx 1.2, la versión de requirements.txt; la 0.8 no leía <w:hyperlink> ni gridBefore.
+"""
+
+import posixpath
+import zipfile
+from typing import List, Tuple, Optional
+
+from lxml import etree
+
+from docx_table_index import TablaIndexada, FilaIndexada, CeldaIndexada
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+BODY, TBL, TR, TC, P = W + 'body', W + 'tbl', W + 'tr', W + 'tc', W + 'p'
+R, HYPERLINK = W + 'r', W + 'hyperlink'
+TRPR, GRID_BEFORE, TCPR, GRID_SPAN, VMERGE = W + 'trPr', W + 'gridBefore', W + 'tcPr', W + 'gridSpan', W + 'vMerge'
+T, TAB, BR, CR, NO_BREAK_HYPHEN, PTAB = W + 't', W + 'tab', W + 'br', W + 'cr', W + 'noBreakHyphen', W + 'ptab'
+VAL, TYPE = W + 'val', W + 'type'
+
+CONTENIDO_RUN = {TAB: '\t', CR: '\n', NO_BREAK_HYPHEN: '-', PTAB: '\t'}
+CONTENEDORES = (TBL, TR, TC, P)
+
+REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+
+class _Celda:
+    __slots__ = ('parrafos', 'tablas', 'span', 'vmerge')
+
+    def __init__(self):
+        self.parrafos: List[List[str]] = []
+        self.tablas: List['_Tabla'] = []
+        self.span = 1
+        self.vmerge: Optional[str] = None
+
+
+class _Fila:
+    __slots__ = ('celdas', 'grid_before')
+
+    def __init__(self):
+        self.celdas: List[_Celda] = []
+        self.grid_before = 0
+
+
+class _Tabla:
+    __slots__ = ('filas',)
+
+    def __init__(self):
+        self.filas: List[_Fila] = []
+
+
+def _a_indexada(tabla: _Tabla) -> TablaIndexada:
+    '''
+    Resuelve gridSpan y vMerge como _Row.cells de python-docx.
+    '''
+    rows = []
+    anteriores: List[Tuple[int, int, CeldaIndexada]] = []
+    for fila in tabla.filas:
+        actuales = []
+        cells = []
+        offset = fila.grid_before
+        for celda in fila.celdas:
+            arriba = None
+            if celda.vmerge == 'continue':
+                arriba = next(((repeticiones, indexada) for inicio, repeticiones, indexada in anteriores
+                               if inicio == offset), None)
+            if arriba is not None:
+                repeticiones, indexada = arriba
+            else:
+                texto = "\n".join("".join(partes) for partes in celda.parrafos)
+                indexada = CeldaIndexada(texto, [_a_indexada(anidada) for anidada in celda.tablas])
+                repeticiones = celda.span
+            actuales.append((offset, repeticiones, indexada))
+            cells.extend([indexada] * repeticiones)
+            offset += celda.span
+        rows.append(FilaIndexada(cells))
+        anteriores = actuales
+    return TablaIndexada(rows)
+
+
+def _texto_run(elem) -> str:
+    if elem.tag == T:
+        return elem.text or ''
+    if elem.tag == BR:
+        return '\n' if elem.get(TYPE, 'textWrapping') == 'textWrapping' else ''
+    return CONTENIDO_RUN[elem.tag]
+
+
+def leer_tablas(path: str) -> List[TablaIndexada]:
+    '''
+    Recorre word/document.xml en streaming y devuelve las tablas de primer nivel indexadas.
+    '''
+    tablas: List[_Tabla] = []
+    # (elemento, objeto) de cada tbl/tr/tc/p abierto; objeto None si python-docx no lo ve
+    pila = []
+    with zipfile.ZipFile(path) as paquete, paquete.open('word/document.xml') as xml:
+        for evento, elem in etree.iterparse(xml, events=('start', 'end')):
+            tag = elem.tag
+            if evento == 'start':
+                if tag not in CONTENEDORES:
+                    continue
+                padre = elem.getparent()
+                actual = pila[-1] if pila and pila[-1][0] is padre else (None, None)
+                obj = None
+                if tag == TBL:
+                    if padre.tag == BODY:
+                        obj = _Tabla()
+                        tablas.append(obj)
+                    elif actual[1] is not None and padre.tag == TC:
+                        obj = _Tabla()
+                        actual[1].tablas.append(obj)
+                elif tag == TR and actual[1] is not None and padre.tag == TBL:
+                    obj = _Fila()
+                    actual[1].filas.append(obj)
+                elif tag == TC and actual[1] is not None and padre.tag == TR:
+                    obj = _Celda()
+                    actual[1].celdas.append(obj)
+                elif tag == P and actual[1] is not None and padre.tag == TC:
+                    obj = []
+                    actual[1].parrafos.append(obj)
+                pila.append((elem, obj))
+                continue
+
+            # evento 'end'
+            if tag in CONTENEDORES:
+                pila.pop()
+                if tag in (TBL, P) and elem.getparent().tag == BODY:
+                    # Lo que cuelga del body ya se procesó: liberar memoria
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
+            elif tag in (T, TAB, BR, CR, NO_BREAK_HYPHEN, PTAB):
+                run = elem.getparent()
+                if run is None or run.tag != R or not pila:
+                    continue
+                contenedor = run.getparent()
+                if contenedor.tag == HYPERLINK:
+                    contenedor = contenedor.getparent()
+                elem_p, partes = pila[-1]
+                if contenedor is elem_p and partes is not None:
+                    partes.append(_texto_run(elem))
+            elif tag == GRID_BEFORE and pila and pila[-1][1] is not None:
+                tr_pr = elem.getparent()
+                if tr_pr.tag == TRPR and tr_pr.getparent() is pila[-1][0] and pila[-1][0].tag == TR:
+                    pila[-1][1].grid_before = int(elem.get(VAL, 0))
+            elif tag in (GRID_SPAN, VMERGE) and pila and pila[-1][1] is not None:
+                tc_pr = elem.getparent()
+                if tc_pr.tag == TCPR and tc_pr.getparent() is pila[-1][0] and pila[-1][0].tag == TC:
+                    if tag == GRID_SPAN:
+                        pila[-1][1].span = int(elem.get(VAL, 1))
+                    else:
+                        pila[-1][1].vmerge = elem.get(VAL, 'continue')
+    return [_a_indexada(tabla) for tabla in tablas]
+
+
+def leer_imagenes(path: str) -> List[Tuple[str, bytes]]:
+    '''
+    (target_ref, blob) de cada imagen embebida, en el orden de word/_rels/document.xml.rels,
+    igual que ParsedStudy.images con python-docx.
+    '''
+    imagenes = []
+    with zipfile.ZipFile(path) as paquete:
+        try:
+            rels = etree.fromstring(paquete.read('word/_rels/document.xml.rels'))
+        except KeyError:
+            return imagenes
+        for rel in rels.iter(REL_NS + 'Relationship'):
+            if 'image' not in rel.get('Type', '') or rel.get('TargetMode') == 'External':
+                continue
+            target = rel.get('Target')
+            if target.startswith('/'):
+                nombre = target.lstrip('/')
+            else:
+                nombre = posixpath.normpath(posixpath.join('word', target))
+            imagenes.append((target, paquete.read(nombre)))
+    return imagenes
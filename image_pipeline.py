@@ -0,0 +1,226 @@
+"""
+Preparación de las imágenes del estudio para el informe.
+
+Las imágenes se pasan a JPEG (calidad 85) en un pool de hilos: PIL libera el GIL al decodificar
+y codificar, así las imágenes de un estudio se procesan en paralelo. Un JPEG que Word ya puede
+mostrar tal cual (RGB o escala de grises, sin exceso de resolución) se usa sin recodificar, y las
+imágenes marcadas para conservar (los mapas polares PNG del stress) no se recodifican.
+
+Con IMAGE_TARGET_DPI > 0 (modo de tamaño de salida) cada imagen se reduce a esa resolución para
+el tamaño al que se inserta, decodificando los JPEG en modo draft (el decodificador escala 1/2,
+1/4 o 1/8 sin leer la imagen completa), y los mapas polares PNG se guardan con paleta si tienen
+hasta 256 colores, sin pérdida.
+
+Los resultados quedan en un cache LRU en memoria, por proceso, con clave en el hash de la imagen
+de origen más los parámetros de la transcodificación: las imágenes que se repiten entre estudios
+(logos, fondos de los mapas polares, vistas repetidas) no se vuelven a decodificar.
+
+Cada imagen se anota como una etapa del informe en curso: image_transcode, image_passthrough,
+image_png_optimize o image_cache_hit.
+"""
+
+import os
+import time
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional, Dict
+
+from PIL import Image, ImageChops
+
+from metrics import registrar_etapa
+
+# Hilos para transcodificar imágenes, por proceso
+IMAGE_WORKERS = max(1, int(os.getenv('IMAGE_WORKERS', min(4, os.cpu_count() or 1))))
+# Resolución de salida en puntos por pulgada del tamaño insertado; 0 deja la resolución original
+IMAGE_TARGET_DPI = max(0.0, float(os.getenv('IMAGE_TARGET_DPI', 0)))
+# Tamaño máximo del cache de imágenes transcodificadas en MB, por proceso; 0 lo desactiva
+IMAGE_CACHE_MAX_MB = float(os.getenv('IMAGE_CACHE_MAX_MB', 64))
+JPEG_QUALITY = 85
+# Modos de JPEG que se insertan sin recodificar
+MODOS_JPEG_DIRECTOS = ('RGB', 'L')
+# Modos de PNG que se pueden pasar a paleta sin pérdida
+MODOS_PALETA = ('RGB', 'L')
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+class CacheImagenes:
+    '''
+    LRU acotado por bytes: clave -> bytes para el informe. Una entrada vacía indica que la
+    imagen se usa tal cual (passthrough) y no ocupa más que su clave.
+    '''
+
+    # Lo que ocupa una entrada además de los datos (clave y estructura)
+    COSTO_ENTRADA = 128
+
+    def __init__(self, max_bytes: int = int(IMAGE_CACHE_MAX_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def activo(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def clave(blob: bytes, conservar: bool, objetivo: Optional[Tuple[int, int]]) -> str:
+        '''
+        Hash de la imagen de origen más los parámetros que definen su transcodificación.
+        '''
+        digest = hashlib.sha256(blob)
+        digest.update(f"|conservar:{conservar}|objetivo:{objetivo}|calidad:{JPEG_QUALITY}".encode())
+        return digest.hexdigest()
+
+    def obtener(self, clave: str) -> Optional[bytes]:
+        if not self.activo:
+            return None
+        with self._lock:
+            datos = self._entradas.get(clave)
+            if datos is None:
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.hits += 1
+            return datos
+
+    def guardar(self, clave: str, datos: bytes) -> None:
+        tamano = len(datos) + self.COSTO_ENTRADA
+        if not self.activo or tamano > self.max_bytes:
+            return
+        with self._lock:
+            if clave in self._entradas:
+                return
+            self._entradas[clave] = datos
+            self._bytes += tamano
+            while self._bytes > self.max_bytes:
+                _, descartada = self._entradas.popitem(last=False)
+                self._bytes -= len(descartada) + self.COSTO_ENTRADA
+                self.evictions += 1
+
+    def estadisticas(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entradas': len(self._entradas), 'bytes': self._bytes}
+
+
+image_cache = CacheImagenes()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='imagenes')
+        return _pool
+
+
+def pixeles_objetivo(tamano, dpi: float = IMAGE_TARGET_DPI) -> Optional[Tuple[int, int]]:
+    '''
+    Píxeles que necesita una imagen insertada con tamano (ancho, alto en docx.shared.Length)
+    a dpi puntos por pulgada, o None si no se reduce.
+    '''
+    if not dpi or tamano is None:
+        return None
+    ancho, alto = tamano
+    return max(1, round(ancho.inches * dpi)), max(1, round(alto.inches * dpi))
+
+
+def tamano_reducido(size: Tuple[int, int], objetivo: Optional[Tuple[int, int]]) -> Optional[Tuple[int, int]]:
+    '''
+    Tamaño al que hay que llevar la imagen (misma proporción, al menos el objetivo en los dos
+    ejes), o None si ya no es más grande que eso.
+    '''
+    if objetivo is None:
+        return None
+    escala = max(objetivo[0] / size[0], objetivo[1] / size[1])
+    if escala >= 1:
+        return None
+    return max(1, round(size[0] * escala)), max(1, round(size[1] * escala))
+
+
+def transcodificar(blob: bytes, objetivo: Optional[Tuple[int, int]] = None) -> Tuple[bytes, str]:
+    '''
+    Devuelve (bytes para el informe, etapa): el mismo blob si es un JPEG que se puede usar
+    directo, o el JPEG recodificado (y reducido a objetivo, si se indica).
+    '''
+    image = Image.open(BytesIO(blob))
+    reducido = tamano_reducido(image.size, objetivo)
+    if image.format == 'JPEG' and image.mode in MODOS_JPEG_DIRECTOS and reducido is None:
+        return blob, 'image_passthrough'
+    if reducido is not None and image.format == 'JPEG':
+        # El decodificador entrega la imagen ya escalada, sin pasar por la resolución completa
+        image.draft(None, reducido)
+    if image.format != 'JPEG':
+        image = image.convert("RGB")
+    if reducido is not None and image.size != reducido:
+        image = image.resize(reducido, Image.LANCZOS)
+    salida = BytesIO()
+    image.save(salida, format='JPEG', quality=JPEG_QUALITY)
+    return salida.getvalue(), 'image_transcode'
+
+
+def optimizar_png(blob: bytes) -> Tuple[bytes, str]:
+    '''
+    Recomprime un PNG sin pérdida: con paleta exacta si tiene hasta 256 colores. Si el
+    resultado no es más chico (o no es un PNG) devuelve el original.
+    '''
+    image = Image.open(BytesIO(blob))
+    if image.format != 'PNG':
+        return blob, 'image_passthrough'
+    if image.mode in MODOS_PALETA:
+        colores = image.getcolors(256)
+        if colores is not None:
+            # Median cut con tantos colores como tiene la imagen deja uno por caja. quantize con
+            # una paleta fija no sirve: busca el color más cercano con precisión reducida y junta
+            # colores parecidos, como (10,10,10) y (11,10,10)
+            paleta = image.quantize(colors=len(colores), method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+            # Solo se usa si devuelve exactamente la imagen original; si no, va sin paleta
+            if ImageChops.difference(paleta.convert(image.mode), image).getbbox() is None:
+                image = paleta
+    salida = BytesIO()
+    image.save(salida, format='PNG')
+    datos = salida.getvalue()
+    if len(datos) >= len(blob):
+        return blob, 'image_passthrough'
+    return datos, 'image_png_optimize'
+
+
+def _medir(imagen: Tuple[bytes, bool, Optional[Tuple[int, int]]]) -> Tuple[bytes, str, float]:
+    blob, conservar, objetivo = imagen
+    inicio = time.perf_counter()
+    clave = image_cache.clave(blob, conservar, objetivo) if image_cache.activo else None
+    datos = image_cache.obtener(clave) if clave else None
+    if datos is not None:
+        return datos or blob, 'image_cache_hit', time.perf_counter() - inicio
+    datos, etapa = optimizar_png(blob) if conservar else transcodificar(blob, objetivo)
+    if clave:
+        image_cache.guardar(clave, b'' if datos is blob else datos)
+    return datos, etapa, time.perf_counter() - inicio
+
+
+def preparar_imagenes(imagenes: List[Tuple[bytes, bool, Optional[tuple]]], dpi: float = IMAGE_TARGET_DPI) -> List[BytesIO]:
+    '''
+    imagenes: (blob, conservar, tamaño insertado) en orden. Devuelve un BytesIO por imagen, en
+    el mismo orden, listo para InlineImage. Sin dpi las que se conservan quedan como están.
+    '''
+    trabajos = {i: (blob, conservar, pixeles_objetivo(tamano, dpi))
+                for i, (blob, conservar, tamano) in enumerate(imagenes) if dpi or not conservar}
+    if len(trabajos) > 1:
+        resultados = list(_get_pool().map(_medir, trabajos.values()))
+    else:
+        resultados = [_medir(trabajo) for trabajo in trabajos.values()]
+
+    salida = [BytesIO(blob) for blob, _, _ in imagenes]
+    for i, (datos, etapa, segundos) in zip(trabajos, resultados):
+        # Los hilos del pool no ven el cronómetro del informe: las etapas se anotan acá
+        registrar_etapa(etapa, segundos)
+        salida[i] = BytesIO(datos)
+    return salida
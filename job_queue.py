@@ -0,0 +1,351 @@
+"""
+Cola local y durable de lotes asíncronos.
+
+El estado de cada lote y de cada archivo vive en SQLite y los archivos subidos y el ZIP
+final en un directorio por lote, así un reinicio del servidor retoma los lotes pendientes.
+Hilos de fondo toman los lotes de a uno y procesan sus archivos en el pool de procesos.
+"""
+
+import os
+import time
+import uuid
+import shutil
+import sqlite3
+import logging
+import tempfile
+import threading
+import zipfile
+from contextlib import contextmanager
+from concurrent.futures import as_completed
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+
+from batch_processor import enviar_archivo, esperar_resultado
+from report_cache import report_cache
+from zip_stream import contenido_errores, contenido_manifest
+
+logger = logging.getLogger(__name__)
+
+# Directorio con la base SQLite y los archivos de cada lote
+JOBS_DIR = os.getenv('JOBS_DIR', os.path.join(tempfile.gettempdir(), 'eco_jobs'))
+# Hilos que toman lotes de la cola
+JOBS_WORKERS = max(1, int(os.getenv('JOBS_WORKERS', 1)))
+# Segundos que se conservan los resultados de un lote terminado
+JOBS_TTL = int(os.getenv('JOBS_TTL', 24 * 3600))
+# Lotes en espera admitidos antes de responder 429
+JOBS_MAX_PENDING = max(1, int(os.getenv('JOBS_MAX_PENDING', 20)))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    estado TEXT NOT NULL,
+    creado REAL NOT NULL,
+    actualizado REAL NOT NULL,
+    terminado REAL,
+    zip_path TEXT,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS archivos (
+    job_id TEXT NOT NULL,
+    indice INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    input_path TEXT,
+    estado TEXT NOT NULL,
+    informe TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, indice)
+);
+'''
+
+
+class JobQueue:
+    '''
+    Estados de un lote: pendiente -> procesando -> terminado | fallido -> expirado.
+    Estados de un archivo: pendiente -> procesando -> ok | error.
+    Un lote queda fallido si algo falla fuera de sus archivos (p. ej. al armar el ZIP).
+    '''
+
+    def __init__(self, directorio: str = JOBS_DIR, workers: int = JOBS_WORKERS, ttl: int = JOBS_TTL):
+        self.directorio = directorio
+        self.workers = workers
+        self.ttl = ttl
+        self.db_path = os.path.join(directorio, 'jobs.sqlite3')
+        self._hilos: List[threading.Thread] = []
+        self._detener = threading.Event()
+        self._hay_trabajo = threading.Condition()
+        # Lotes reservados con nuevo_job cuyos archivos todavía se están recibiendo
+        self._recibiendo = 0
+        self._recibiendo_lock = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+        with self._conectar() as conn:
+            conn.executescript(SCHEMA)
+            # Bases creadas antes de que los lotes guardaran su error
+            if 'error' not in [row['name'] for row in conn.execute("PRAGMA table_info(jobs)")]:
+                conn.execute("ALTER TABLE jobs ADD COLUMN error TEXT")
+
+    @contextmanager
+    def _conectar(self) -> Iterator[sqlite3.Connection]:
+        '''
+        Conexión en una transacción: hace commit (o rollback si hubo un error) y la cierra.
+        '''
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # --- API usada por los endpoints ---
+
+    def nuevo_job(self, max_pendientes: Optional[int] = None) -> Optional[Tuple[str, str]]:
+        '''
+        Reserva un id y crea el directorio donde guardar los archivos del lote, que queda
+        contado como pendiente hasta encolar o descartar_job. Con max_pendientes devuelve
+        None, sin crear nada, si ya hay esa cantidad de lotes pendientes.
+        '''
+        with self._recibiendo_lock:
+            if max_pendientes is not None and self.pendientes() >= max_pendientes:
+                return None
+            self._recibiendo += 1
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.directorio, job_id)
+        os.makedirs(job_dir)
+        return job_id, job_dir
+
+    def descartar_job(self, job_id: str) -> None:
+        '''
+        Libera un lote reservado con nuevo_job que no se llegó a encolar.
+        '''
+        shutil.rmtree(os.path.join(self.directorio, job_id), ignore_errors=True)
+        with self._recibiendo_lock:
+            self._recibiendo -= 1
+
+    def pendientes(self) -> int:
+        '''
+        Lotes en espera o en proceso, más los que se están recibiendo.
+        '''
+        with self._conectar() as conn:
+            en_cola = conn.execute("SELECT COUNT(*) FROM jobs WHERE estado IN ('pendiente', 'procesando')").fetchone()[0]
+        return en_cola + self._recibiendo
+
+    def encolar(self, job_id: str, archivos: List[Dict[str, Any]]) -> None:
+        '''
+        Registra el lote. Cada archivo es {'filename', 'input_path'} o {'filename', 'error'}
+        si ya falló al guardarse.
+        '''
+        ahora = time.time()
+        with self._conectar() as conn:
+            conn.execute("INSERT INTO jobs (id, estado, creado, actualizado) VALUES (?, 'pendiente', ?, ?)",
+                         (job_id, ahora, ahora))
+            conn.executemany(
+                "INSERT INTO archivos (job_id, indice, filename, input_path, estado, error) VALUES (?, ?, ?, ?, ?, ?)",
+                [(job_id, indice, a['filename'], a.get('input_path'),
+                  'error' if a.get('error') else 'pendiente', a.get('error'))
+                 for indice, a in enumerate(archivos)]
+            )
+        with self._recibiendo_lock:
+            self._recibiendo -= 1
+        with self._hay_trabajo:
+            self._hay_trabajo.notify()
+
+    def obtener(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._conectar() as conn:
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            archivos = conn.execute(
+                "SELECT filename, estado, informe, error FROM archivos WHERE job_id = ? ORDER BY indice", (job_id,)
+            ).fetchall()
+        return {
+            'job_id': job['id'],
+            'estado': job['estado'],
+            'creado': job['creado'],
+            'terminado': job['terminado'],
+            'expira': job['terminado'] + self.ttl if job['terminado'] else None,
+            'zip_path': job['zip_path'],
+            'error': job['error'],
+            'archivos': [{'archivo': a['filename'], 'estado': a['estado'], 'informe': a['informe'], 'error': a['error']}
+                         for a in archivos],
+        }
+
+    # --- ciclo de vida ---
+
+    def iniciar(self) -> None:
+        self.reanudar_interrumpidos()
+        self._detener.clear()
+        for i in range(self.workers):
+            hilo = threading.Thread(target=self._bucle, name=f"job-worker-{i}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+        logger.info(f"Job queue started at {self.directorio} with {self.workers} workers")
+
+    def detener(self) -> None:
+        self._detener.set()
+        with self._hay_trabajo:
+            self._hay_trabajo.notify_all()
+        for hilo in self._hilos:
+            hilo.join(timeout=30)
+        self._hilos = []
+
+    def reanudar_interrumpidos(self) -> int:
+        '''
+        Vuelve a poner en cola los lotes y archivos que quedaron a medias por un reinicio.
+        '''
+        with self._conectar() as conn:
+            conn.execute("UPDATE archivos SET estado = 'pendiente' WHERE estado = 'procesando'")
+            cantidad = conn.execute(
+                "UPDATE jobs SET estado = 'pendiente', actualizado = ? WHERE estado = 'procesando'", (time.time(),)
+            ).rowcount
+        if cantidad:
+            logger.info(f"Requeued {cantidad} interrupted jobs")
+        return cantidad
+
+    def expirar(self) -> int:
+        '''
+        Borra los archivos de los lotes terminados o fallidos hace más de ttl segundos.
+        '''
+        limite = time.time() - self.ttl
+        with self._conectar() as conn:
+            vencidos = [row['id'] for row in conn.execute(
+                "SELECT id FROM jobs WHERE estado IN ('terminado', 'fallido') AND terminado < ?", (limite,)
+            )]
+            for job_id in vencidos:
+                shutil.rmtree(os.path.join(self.directorio, job_id), ignore_errors=True)
+                conn.execute("UPDATE jobs SET estado = 'expirado', zip_path = NULL, actualizado = ? WHERE id = ?",
+                             (time.time(), job_id))
+        return len(vencidos)
+
+    # --- procesamiento ---
+
+    def _reclamar(self) -> Optional[str]:
+        with self._conectar() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT id FROM jobs WHERE estado = 'pendiente' ORDER BY creado LIMIT 1").fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute("UPDATE jobs SET estado = 'procesando', actualizado = ? WHERE id = ?", (time.time(), row['id']))
+            conn.execute('COMMIT')
+            return row['id']
+
+    def _bucle(self) -> None:
+        while not self._detener.is_set():
+            try:
+                self.expirar()
+                job_id = self._reclamar()
+                if job_id is None:
+                    with self._hay_trabajo:
+                        self._hay_trabajo.wait(timeout=60)
+                    continue
+                self.procesar(job_id)
+            except Exception as e:
+                logger.error(f"Job worker error: {e}")
+                time.sleep(1)
+
+    def _actualizar_archivo(self, job_id: str, indice: int, **campos) -> None:
+        columnas = ", ".join(f"{k} = ?" for k in campos)
+        with self._conectar() as conn:
+            conn.execute(f"UPDATE archivos SET {columnas} WHERE job_id = ? AND indice = ?",
+                         (*campos.values(), job_id, indice))
+
+    def procesar(self, job_id: str) -> None:
+        '''
+        Procesa un lote reclamado. Si falla algo fuera de sus archivos, el lote queda fallido
+        con el error (en lugar de quedar procesando hasta un reinicio) y expira como uno terminado.
+        '''
+        try:
+            self._procesar(job_id)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            self._marcar_fallido(job_id, str(e))
+
+    def _marcar_fallido(self, job_id: str, error: str) -> None:
+        ahora = time.time()
+        with self._conectar() as conn:
+            conn.execute("UPDATE archivos SET estado = 'error', error = ? WHERE job_id = ? AND estado IN ('pendiente', 'procesando')",
+                         (error, job_id))
+            conn.execute("UPDATE jobs SET estado = 'fallido', error = ?, zip_path = NULL, terminado = ?, actualizado = ? WHERE id = ?",
+                         (error, ahora, ahora, job_id))
+
+    def _procesar(self, job_id: str) -> None:
+        job_dir = os.path.join(self.directorio, job_id)
+        with self._conectar() as conn:
+            pendientes = conn.execute(
+                "SELECT indice, filename, input_path FROM archivos WHERE job_id = ? AND estado = 'pendiente'", (job_id,)
+            ).fetchall()
+
+        # Los archivos repetidos del lote (mismo contenido) comparten un único Future
+        futures = {}
+        por_clave = {}
+        for archivo in pendientes:
+            indice, filename = archivo['indice'], archivo['filename']
+            workdir = os.path.dirname(archivo['input_path'])
+            self._actualizar_archivo(job_id, indice, estado='procesando')
+            try:
+                clave = report_cache.clave(archivo['input_path'])
+                if clave in por_clave:
+                    futures[por_clave[clave]].append((indice, filename))
+                    continue
+                future = enviar_archivo(archivo['input_path'], workdir, filename, clave)
+                por_clave[clave] = future
+                futures[future] = [(indice, filename)]
+            except Exception as e:
+                self._actualizar_archivo(job_id, indice, estado='error', error=str(e))
+
+        for future in as_completed(futures):
+            archivos = futures[future]
+            resultado = esperar_resultado(future, archivos[0][1])
+            for indice, _ in archivos:
+                if resultado['error'] is None:
+                    self._actualizar_archivo(job_id, indice, estado='ok', informe=resultado['save_path'])
+                else:
+                    self._actualizar_archivo(job_id, indice, estado='error', error=resultado['error'])
+
+        zip_path = self._crear_zip(job_id, job_dir)
+        ahora = time.time()
+        with self._conectar() as conn:
+            conn.execute("UPDATE jobs SET estado = 'terminado', zip_path = ?, terminado = ?, actualizado = ? WHERE id = ?",
+                         (zip_path, ahora, ahora, job_id))
+        logger.info(f"Job {job_id} finished")
+
+    def _crear_zip(self, job_id: str, job_dir: str) -> str:
+        with self._conectar() as conn:
+            archivos = conn.execute(
+                "SELECT filename, estado, informe, error FROM archivos WHERE job_id = ? ORDER BY indice", (job_id,)
+            ).fetchall()
+
+        zip_path = os.path.join(job_dir, "informes_generados.zip")
+        manifest = []
+        errors = []
+        generados = 0
+        incluidos = set()
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for archivo in archivos:
+                if archivo['estado'] == 'ok' and archivo['informe'] and os.path.exists(archivo['informe']):
+                    nombre = os.path.basename(archivo['informe'])
+                    # Los duplicados del lote apuntan al mismo informe: va una sola vez en el ZIP
+                    if archivo['informe'] not in incluidos:
+                        zip_file.write(archivo['informe'], nombre)
+                        incluidos.add(archivo['informe'])
+                        generados += 1
+                    manifest.append({"archivo": archivo['filename'], "estado": "ok", "informe": nombre})
+                else:
+                    error = archivo['error'] or "El informe generado no se encontró"
+                    errors.append(f"Error procesando {archivo['filename']}: {error}")
+                    manifest.append({"archivo": archivo['filename'], "estado": "error", "error": error})
+
+            if errors:
+                zip_file.writestr("errores.txt", contenido_errores(generados, errors))
+            zip_file.writestr("manifest.json", contenido_manifest(generados, manifest))
+        return zip_path
+
+
+_cola: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    global _cola
+    if _cola is None:
+        _cola = JobQueue()
+    return _cola
@@ -0,0 +1,205 @@
+"""
+Llamadas al LLM de extracción (Gemini vía langextract) con cache persistente,
+deduplicación de llamadas en curso, límite de concurrencia y tiempo máximo por llamada.
+
+La clave del cache es el hash del texto normalizado más la versión del prompt y el modelo,
+así el mismo estudio nunca se manda dos veces y cambiar el prompt invalida lo cacheado.
+El backend 'stub' permite probar y medir todo el circuito sin red.
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# 'gemini' o 'stub' (sin red, para tests y benchmarks)
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-pro')
+# Segundos máximos de espera por llamada; vencido el plazo se usa pattern matching
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 60))
+# Llamadas simultáneas al LLM por proceso
+LLM_MAX_CONCURRENT = max(1, int(os.getenv('LLM_MAX_CONCURRENT', 2)))
+# Llamadas por minuto por proceso; 0 sin límite
+LLM_MAX_RPM = int(os.getenv('LLM_MAX_RPM', 0))
+# Base SQLite con las respuestas cacheadas; vacío desactiva el cache
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'eco_llm_cache.sqlite3'))
+# Respuestas que se conservan; se descartan las más viejas
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 10000))
+# Latencia simulada del backend stub, en segundos
+LLM_STUB_LATENCY = float(os.getenv('LLM_STUB_LATENCY', 0))
+
+
+class LLMTimeoutError(Exception):
+    pass
+
+
+def normalizar_texto(text: str) -> str:
+    '''
+    Colapsa espacios y saltos de línea: el mismo estudio exportado dos veces
+    da la misma clave aunque cambie el espaciado.
+    '''
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def version_prompt(*partes) -> str:
+    '''
+    Hash corto del prompt, los ejemplos y el modelo; forma parte de la clave del cache.
+    '''
+    return hashlib.sha256(json.dumps(partes, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class CacheLLM:
+    '''
+    Respuestas del LLM en SQLite, compartidas entre los procesos del pool y persistentes entre reinicios.
+    '''
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_entradas: int = LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entradas = max_entradas
+        with self._conectar() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS respuestas '
+                         '(clave TEXT PRIMARY KEY, respuesta TEXT NOT NULL, creado REAL NOT NULL)')
+
+    def _conectar(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def obtener(self, clave: str) -> Optional[Dict[str, Any]]:
+        with self._conectar() as conn:
+            row = conn.execute("SELECT respuesta FROM respuestas WHERE clave = ?", (clave,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def guardar(self, clave: str, respuesta: Dict[str, Any]) -> None:
+        with self._conectar() as conn:
+            conn.execute("INSERT OR REPLACE INTO respuestas (clave, respuesta, creado) VALUES (?, ?, ?)",
+                         (clave, json.dumps(respuesta), time.time()))
+            conn.execute("DELETE FROM respuestas WHERE clave NOT IN "
+                         "(SELECT clave FROM respuestas ORDER BY creado DESC LIMIT ?)", (self.max_entradas,))
+
+
+class ExtractorLLM:
+    '''
+    Envuelve un backend `text -> dict`. Orden de resolución de cada llamada:
+    cache persistente, llamada idéntica ya en curso (single-flight) y recién ahí el backend,
+    con un máximo de llamadas simultáneas y por minuto y un tiempo máximo de espera.
+    '''
+
+    def __init__(self, backend: Callable[[str], Dict[str, Any]], version: str, cache: Optional[CacheLLM] = None,
+                 timeout: float = LLM_TIMEOUT, max_concurrentes: int = LLM_MAX_CONCURRENT, max_rpm: int = LLM_MAX_RPM):
+        self.backend = backend
+        self.version = version
+        self.cache = cache
+        self.timeout = timeout
+        self.max_rpm = max_rpm
+        # El tamaño del pool es el límite de concurrencia; una llamada vencida sigue ocupando
+        # su hilo hasta que el backend responde, pero ya nadie la espera
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrentes, thread_name_prefix='llm')
+        self._en_curso: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._proxima_llamada = 0.0
+        self.estadisticas = {'llamadas': 0, 'cache_hits': 0, 'compartidas': 0, 'timeouts': 0, 'errores': 0}
+
+    def _contar(self, nombre: str) -> None:
+        with self._lock:
+            self.estadisticas[nombre] += 1
+
+    def clave(self, text: str) -> str:
+        return hashlib.sha256(f"{self.version}|{normalizar_texto(text)}".encode()).hexdigest()
+
+    def _esperar_turno(self) -> None:
+        if self.max_rpm <= 0:
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            turno = max(ahora, self._proxima_llamada)
+            self._proxima_llamada = turno + 60.0 / self.max_rpm
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+    def _llamar(self, clave: str, text: str) -> Dict[str, Any]:
+        self._esperar_turno()
+        self._contar('llamadas')
+        respuesta = self.backend(text)
+        if respuesta and self.cache is not None:
+            try:
+                self.cache.guardar(clave, respuesta)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not store LLM response in cache: {e}")
+        return respuesta
+
+    def extraer(self, text: str) -> Dict[str, Any]:
+        '''
+        Devuelve la respuesta del backend para text. Lanza LLMTimeoutError si se vence el
+        plazo y propaga los errores del backend; quien llama decide el fallback.
+        '''
+        clave = self.clave(text)
+        if self.cache is not None:
+            try:
+                cacheada = self.cache.obtener(clave)
+            except sqlite3.Error as e:
+                logger.warning(f"LLM cache unavailable: {e}")
+                cacheada = None
+            if cacheada is not None:
+                self._contar('cache_hits')
+                return cacheada
+
+        with self._lock:
+            future = self._en_curso.get(clave)
+            nueva = future is None
+            if nueva:
+                future = self._pool.submit(self._llamar, clave, text)
+                self._en_curso[clave] = future
+            else:
+                self.estadisticas['compartidas'] += 1
+        if nueva:
+            # Fuera del lock: si la llamada ya terminó, el callback corre en este mismo hilo
+            future.add_done_callback(lambda f: self._terminar(clave, f))
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self._contar('timeouts')
+            raise LLMTimeoutError(f"El LLM no respondió en {self.timeout:.0f}s")
+        except Exception:
+            self._contar('errores')
+            raise
+
+    def _terminar(self, clave: str, future: Future) -> None:
+        with self._lock:
+            if self._en_curso.get(clave) is future:
+                del self._en_curso[clave]
+
+
+class BackendStub:
+    '''
+    Backend sin red: espera `latencia` segundos y responde con `extractor(text)`.
+    '''
+
+    def __init__(self, extractor: Callable[[str], Dict[str, Any]], latencia: float = LLM_STUB_LATENCY):
+        self.extractor = extractor
+        self.latencia = latencia
+
+    def __call__(self, text: str) -> Dict[str, Any]:
+        if self.latencia:
+            time.sleep(self.latencia)
+        return self.extractor(text)
+
+
+def crear_cache() -> Optional[CacheLLM]:
+    if not LLM_CACHE_PATH:
+        return None
+    try:
+        return CacheLLM(LLM_CACHE_PATH)
+    except sqlite3.Error as e:
+        logger.warning(f"LLM cache disabled: {e}")
+        return None
@@ -1,20 +1,30 @@
 import os
+import asyncio
 import shutil
 import tempfile
 import zipfile
 import logging
 import time
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
+from fastapi.responses import Response, FileResponse, StreamingResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
 from pathlib import Path
-from docx import Document
 from docxtpl import DocxTemplate
 
-from template_manager import template_selector
-from patient_data_extraction import extract_patient_info, image_extractor, generate_motility_report, get_measure_table, get_measurements, get_mot_table, mot_extractor
-from aux_calculations import expand_dict_with_lists_inplace, calc_e_e_stress
+from report_generator import PDF_PROCESSING_AVAILABLE
+from zip_stream import ZipEnStreaming, contenido_errores, contenido_manifest
+from doc_converter import iniciar_servicio_conversion, detener_servicio_conversion
+from batch_processor import (procesar_archivo, enviar_archivo, esperar_resultado_async, shutdown_executor, admision,
+                             rechazar_por_capacidad, estadisticas_templates, estadisticas_imagenes, InformesEnMemoria,
+                             BATCH_MAX_WORKERS, BATCH_RETRY_AFTER)
+from job_queue import get_job_queue, JOBS_MAX_PENDING
+from report_cache import report_cache
+from metrics import registro, iniciar_cronometro, etapa, formato_de, registrar_rechazo
+from parsed_study import PARSERS_DOCX, DOCX_PARSER
+from upload_spool import (Subida, copiar_subida, tamano_de, rechazar_por_tamano, directorio_de_trabajo,
+                          crear_directorio_de_trabajo, MAX_FILE_SIZE, MARGEN_MULTIPART)
 
 app = FastAPI(
     title="EcoReport API",
@@ -26,43 +36,8 @@ app = FastAPI(
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Safe import for PDF processing with enhanced fallback
-try:
-    from patient_data_extraction import process_pdf_images
-    from pdf_processor import pdf_to_docx_data, format_for_template
-    PDF_PROCESSING_AVAILABLE = True
-    logger.info("Standard PDF processing modules loaded successfully")
-except ImportError as e:
-    logger.warning(f"Standard PDF processing not available: {e}")
-
-    # Try enhanced PDF processor as fallback
-    try:
-        from pdf_processor_enhanced import pdf_to_docx_data, format_for_template
-        from patient_data_extraction import process_pdf_images
-        PDF_PROCESSING_AVAILABLE = True
-        logger.info("Enhanced PDF processing modules loaded successfully")
-    except ImportError as e2:
-        PDF_PROCESSING_AVAILABLE = False
-        logger.error(f"No PDF processing modules available: {e2}")
-
-        # Create dummy functions that provide clear error messages
-        def pdf_to_docx_data(pdf_path: str):
-            raise HTTPException(
-                status_code=503,
-                detail="PDF processing temporarily unavailable. Missing dependencies: pdfplumber, langextract. Please use .docx files."
-            )
-
-        def format_for_template(pdf_data):
-            raise HTTPException(
-                status_code=503,
-                detail="PDF processing temporarily unavailable. Please use .docx files."
-            )
-
-        def process_pdf_images(image_paths, template, tipo):
-            raise HTTPException(
-                status_code=503,
-                detail="PDF processing temporarily unavailable. Please use .docx files."
-            )
+# Límite de seguridad de archivos por lote (/generar_informes_multiples y /lotes)
+BATCH_MAX_FILES = 50
 
 @app.get("/")
 def root():
@@ -114,14 +89,29 @@ def system_info():
             "image_extraction": True,
             "motility_analysis": True
         },
+        "template_cache": estadisticas_templates(),
+        "report_cache": report_cache.estadisticas(),
+        "image_cache": estadisticas_imagenes(),
+        "docx_parsers": {"disponibles": list(PARSERS_DOCX), "por_defecto": DOCX_PARSER},
         "endpoints": {
             "single_file": "/generar_informe",
             "multiple_files": "/generar_informes_multiples",
+            "async_batch": "/lotes",
+            "async_batch_status": "/lotes/{job_id}",
+            "async_batch_download": "/lotes/{job_id}/descarga",
             "debug": "/debug_files",
-            "health": "/health"
+            "health": "/health",
+            "metrics": "/metrics"
         }
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metricas_prometheus():
+    """
+    Latencia por etapa e informes procesados, en formato de texto de Prometheus.
+    """
+    return PlainTextResponse(registro.exponer(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.post("/test_pdf_debug")
 async def test_pdf_debug(file: UploadFile = File(...)):
     """Debug endpoint to test PDF processing step by step"""
@@ -187,9 +177,8 @@ def debug_files(files: List[UploadFile] = File(...)):
         info = {
             "filename": file.filename,
             "content_type": file.content_type,
-            "size": len(file.file.read()) if hasattr(file.file, 'read') else "unknown"
+            "size": file.size if file.size is not None else tamano_de(file.file)
         }
-        file.file.seek(0)  # Reset file pointer
         file_info.append(info)
     
     return {
@@ -199,6 +188,32 @@ def debug_files(files: List[UploadFile] = File(...)):
         "message": "Debug info - no processing done"
     }
 
+@app.middleware("http")
+async def limitar_tamano_de_subida(request, call_next):
+    """
+    Rechaza antes de recibir el cuerpo los pedidos cuyo Content-Length ya supera el límite:
+    un archivo en /generar_informe, BATCH_MAX_FILES en los lotes. Un lote para /lotes con la
+    cola llena se rechaza también acá, antes de que se guarde nada. Definido antes que CORS
+    para que las respuestas 413 y 429 también lleven sus encabezados.
+    Los 413 y 429 de estos endpoints, de acá o de los handlers, se cuentan en /metrics.
+    """
+    archivos = {"/generar_informe": 1, "/generar_informes_multiples": BATCH_MAX_FILES, "/lotes": BATCH_MAX_FILES}
+    if request.method != "POST" or request.url.path not in archivos:
+        return await call_next(request)
+
+    largo = request.headers.get("content-length", "")
+    if largo.isdigit() and int(largo) > archivos[request.url.path] * (MAX_FILE_SIZE + MARGEN_MULTIPART):
+        error = rechazar_por_tamano()
+        response = JSONResponse(status_code=error.status_code, content={"detail": error.detail})
+    elif request.url.path == "/lotes" and await run_in_threadpool(get_job_queue().pendientes) >= JOBS_MAX_PENDING:
+        error = rechazar_por_cola_llena()
+        response = JSONResponse(status_code=error.status_code, content={"detail": error.detail}, headers=error.headers)
+    else:
+        response = await call_next(request)
+    if response.status_code in (413, 429):
+        registrar_rechazo(request.url.path, response.status_code)
+    return response
+
 # Configure CORS - adjust origins for production
 FRONTEND_ORIGINS = [
     "http://localhost:3000",  # React dev server
@@ -215,18 +230,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def procesar_archivo_individual(file: UploadFile, tmpdir: str) -> str:
+def guardar_archivo_subido(file: UploadFile, tmpdir: str) -> Subida:
     """
-    Procesa un archivo individual y devuelve la ruta del archivo generado.
+    Valida el archivo subido y lo guarda en tmpdir en bloques, cortando apenas supera el
+    límite. Devuelve la ruta donde quedó guardado junto con su tamaño y su hash.
     """
     logger.info(f"Processing file: {file.filename}")
     logger.info(f"Content type: {file.content_type}")
     logger.info(f"File size: {file.size if hasattr(file, 'size') else 'unknown'}")
 
-    # Validate file size (50MB limit)
-    MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+    # Validate file size when the client sent it; copiar_subida enforces it anyway
     if hasattr(file, 'size') and file.size and file.size > MAX_FILE_SIZE:
-        raise HTTPException(status_code=413, detail=f"Archivo demasiado grande. Máximo: 50MB")
+        raise rechazar_por_tamano()
 
     # Validate filename
     if not file.filename or len(file.filename) > 255:
@@ -259,255 +274,309 @@ def procesar_archivo_individual(file: UploadFile, tmpdir: str) -> str:
     print(f"[DEBUG] Safe filename: {safe_filename}")
     print(f"[DEBUG] Input path: {input_path}")
     
-    # Save uploaded file to temporary directory
-    with open(input_path, "wb") as f:
-        import shutil
-        shutil.copyfileobj(file.file, f)
+    # Save uploaded file to temporary directory, hashing it on the way
+    with etapa('upload'):
+        return copiar_subida(file.file, input_path)
 
-    # Si es .doc, convertir a .docx usando LibreOffice
-    if input_path.lower().endswith('.doc'):
-        try:
-            # Generar nombre para archivo convertido
-            converted_filename = os.path.splitext(os.path.basename(input_path))[0] + '.docx'
-            converted_path = os.path.join(tmpdir, converted_filename)
-            
-            print(f"[INFO] Convirtiendo .doc a .docx usando LibreOffice")
-            print(f"[INFO] Input: {input_path}")
-            print(f"[INFO] Output: {converted_path}")
-            
-            # Usar LibreOffice para la conversión inicial .doc -> .docx
-            import subprocess
-            
-            # Buscar LibreOffice en diferentes ubicaciones posibles
-            soffice_paths = [
-                'soffice',  # En PATH
-                '/usr/bin/soffice',
-                '/usr/local/bin/soffice',
-                '/opt/homebrew/bin/soffice',
-                '/Applications/LibreOffice.app/Contents/MacOS/soffice'  # macOS
-            ]
-            
-            soffice_cmd = None
-            for path in soffice_paths:
-                try:
-                    result = subprocess.run([path, '--version'], 
-                                          capture_output=True, text=True, timeout=10)
-                    if result.returncode == 0:
-                        soffice_cmd = path
-                        break
-                except (FileNotFoundError, subprocess.TimeoutExpired):
-                    continue
-            
-            if not soffice_cmd:
-                raise Exception("No se encontró LibreOffice/soffice en el sistema")
-            
-            # Convertir usando LibreOffice
-            cmd = [
-                soffice_cmd,
-                '--headless',
-                '--convert-to', 'docx',
-                '--outdir', tmpdir,
-                input_path
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-            
-            if result.returncode != 0:
-                raise Exception(f"LibreOffice falló: {result.stderr}")
-            
-            # Verificar que el archivo se creó correctamente
-            if not os.path.exists(converted_path):
-                raise Exception('El archivo .docx convertido no se creó')
-            
-            size = os.path.getsize(converted_path)
-            print(f"[INFO] Archivo convertido exitosamente: {size} bytes")
-            
-            if size == 0:
-                raise Exception('El archivo .docx convertido está vacío')
-            
-            doc_path = converted_path
-            
-        except Exception as e:
-            print(f"[ERROR] Error en la conversión: {e}")
-            raise HTTPException(status_code=500, detail=f"Error convirtiendo archivo .doc a .docx: {str(e)}")
-    else:
-        doc_path = input_path
+def validar_parser(parser: Optional[str]) -> None:
+    """
+    El parámetro `parser` elige cómo se leen los .docx: 'docx' (python-docx) o 'lxml'.
+    """
+    if parser is not None and parser not in PARSERS_DOCX:
+        raise HTTPException(status_code=400, detail=f"parser debe ser uno de: {', '.join(PARSERS_DOCX)}")
 
+def validar_lote(files: List[UploadFile]) -> None:
+    if not files:
+        raise HTTPException(status_code=400, detail="Debe proporcionar al menos un archivo")
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Máximo {BATCH_MAX_FILES} archivos por lote")
+
+def rechazar_por_cola_llena() -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=f"Hay {JOBS_MAX_PENDING} lotes en espera. Reintente más tarde.",
+        headers={"Retry-After": str(BATCH_RETRY_AFTER)}
+    )
+
+def procesar_archivo_individual(file: UploadFile, tmpdir: str, parser: Optional[str] = None) -> Tuple[str, bytes]:
+    """
+    Procesa un archivo individual y devuelve (nombre, contenido) del informe generado en memoria.
+    El procesamiento corre en el pool de procesos compartido.
+    """
+    iniciar_cronometro(formato_de(file.filename))
+    subida = guardar_archivo_subido(file, tmpdir)
+    clave = report_cache.clave(subida.path, subida.sha256, parser)
+    return procesar_archivo(subida.path, tmpdir, file.filename, parser, clave)
+
+async def procesar_archivo_de_lote(file: UploadFile, tmpdir: str, compartidos: Dict[str, asyncio.Future],
+                                   memoria: InformesEnMemoria, parser: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Guarda un archivo del lote en el threadpool y lo procesa en el pool de procesos.
+    Los archivos repetidos dentro del lote (mismo contenido) se procesan una sola vez:
+    compartidos guarda, por clave del cache, el resultado del primero.
+    El informe vuelve en memoria si entra en lo reservado del presupuesto del lote; si no, el
+    worker lo escribe en tmpdir.
+    Devuelve el resultado del worker: {'filename', 'nombre', 'contenido' o 'save_path', 'error'}.
+    """
+    # Cada tarea del lote tiene su propio contexto, y con él su propio cronómetro
+    iniciar_cronometro(formato_de(file.filename))
     try:
-        # Handle PDF files differently
-        if doc_path.lower().endswith('.pdf'):
-            logger.info(f"Processing PDF file: {doc_path}")
-
-            # Extract data from PDF
-            pdf_data = pdf_to_docx_data(doc_path)
-
-            # Select template based on PDF content
-            template, tipo = template_selector(doc_path)
-
-            # Format PDF data for template
-            context = format_for_template(pdf_data)
-
-            # Add patient info
-            info_pac = pdf_data.get('patient_info', {})
-
-            # Process images if available
-            if 'images' in pdf_data and pdf_data['images']:
-                image = process_pdf_images(pdf_data['images'], template, tipo)
-                context['image'] = image['image']
-
-            # Add motility if available
-            if 'motility' in pdf_data and pdf_data['motility']:
-                mot = pdf_data['motility']
-                if 'mot' in mot:
-                    mot_report = generate_motility_report(mot)
-                    context.update(mot_report)
-
-            # Clean up temp images
-            if 'images' in pdf_data:
-                import shutil
-                for path in pdf_data['images'].values():
-                    if os.path.exists(os.path.dirname(path)):
-                        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
-        else:
-            # Process DOCX files as before
-            doc = Document(doc_path)
-            template, tipo = template_selector(doc_path)
-            info_pac = extract_patient_info(doc)
-            image = image_extractor(doc, template, tipo=tipo)
-            context = None
-        # Nombre de salida temporal
-        safe_name = info_pac.get('Name', 'informe').replace('/', '_').replace('\\', '_')
-        safe_date = info_pac.get('Exam_Date', 'fecha').replace('/', '_').replace('\\', '_')
-        output_filename = f"{safe_name}_{tipo}_{safe_date}.docx"
-        save_path = os.path.join(tmpdir, output_filename)
-
-        # If context was already built (PDF case), skip the rest
-        if context is None and tipo in ['card', 'stress']:
-            measurements_table = get_measure_table(doc)
-            if 'Gender' not in info_pac:
-                print(f"[ERROR] info_pac keys: {list(info_pac.keys())}")
-                raise HTTPException(status_code=422, detail=f"Falta el dato 'Gender' en el archivo {file.filename}. Datos extraídos: {info_pac}")
-            measurements_dic = get_measurements(measurements_table, info_pac['Gender'])
-            if tipo == 'stress':
-                mot_table = get_mot_table(doc)
-                mot = mot_extractor(mot_table)
-                mot_report = generate_motility_report(mot)
-                expand_dict_with_lists_inplace(measurements_dic)
-                measurements_dic['E_e_rel'], measurements_dic['e_e_avg'] = calc_e_e_stress(measurements_dic)
-                context = {**info_pac, **measurements_dic, 'image': image['image'], 'mot': mot['mot'], **mot_report}
-            else:
-                context = {**info_pac, **measurements_dic, 'image': image['image']}
-        elif context is None:
-            context = {**info_pac, 'image': image['image']}
-
-        # Render template with context
-        template.render(context)
-        template.save(save_path)
-        return save_path
-    except HTTPException:
-        # Re-raise HTTP exceptions as-is
-        raise
+        subida = await run_in_threadpool(guardar_archivo_subido, file, tmpdir)
+        input_path = subida.path
+        clave = report_cache.clave(input_path, subida.sha256, parser)
     except Exception as e:
-        import traceback
-        tb = traceback.format_exc()
-        logger.error(f"Error processing file {file.filename}: {tb}")
-
-        # Return user-friendly error message
-        error_msg = "Error interno del servidor procesando el archivo"
-        if "No se encontró LibreOffice" in str(e):
-            error_msg = "Error de conversión de documento .doc"
-        elif "Falta el dato 'Gender'" in str(e):
-            error_msg = "Falta información requerida en el documento (Gender)"
-        elif "No se encontró tabla" in str(e):
-            error_msg = "Formato de documento no reconocido"
-
-        raise HTTPException(
-            status_code=500,
-            detail={
-                "error": error_msg,
-                "filename": file.filename,
-                "details": str(e)
-            }
-        )
+        return {'filename': file.filename, 'save_path': None, 'error': str(e)}
+
+    if clave in compartidos:
+        resultado = dict(await asyncio.shield(compartidos[clave]))
+        print(f"[INFO] {file.filename} es un duplicado de {resultado['filename']} en el lote")
+        resultado['duplicado_de'] = resultado['filename']
+        resultado['filename'] = file.filename
+        # Del duplicado solo se usa el nombre: el informe va una vez, con el original
+        resultado['contenido'] = None
+        return resultado
+
+    compartido = asyncio.get_running_loop().create_future()
+    compartidos[clave] = compartido
+    reservado = memoria.reservar(InformesEnMemoria.estimar(subida.tamano))
+    try:
+        try:
+            future = await run_in_threadpool(enviar_archivo, input_path, tmpdir, file.filename, clave, parser,
+                                             reservado is not None, reservado)
+            resultado = await esperar_resultado_async(future, file.filename)
+        except Exception as e:
+            resultado = {'filename': file.filename, 'save_path': None, 'error': str(e)}
+        memoria.ajustar(resultado, reservado)
+        compartido.set_result(resultado)
+        return resultado
+    finally:
+        if not compartido.done():
+            compartido.cancel()
+
+@app.on_event("startup")
+def iniciar_conversion_doc():
+    iniciar_servicio_conversion()
+
+@app.on_event("startup")
+def iniciar_cola_lotes():
+    get_job_queue().iniciar()
+
+@app.on_event("shutdown")
+def cerrar_pool_procesos():
+    get_job_queue().detener()
+    shutdown_executor()
+    detener_servicio_conversion()
 
 @app.post("/generar_informe")
-def generar_informe(file: UploadFile = File(...)):
+def generar_informe(file: UploadFile = File(...), parser: Optional[str] = None):
     """
     Recibe un archivo Word o PDF del ecógrafo y devuelve el informe generado como descarga.
     Soporta archivos .docx, .doc y .pdf.
     """
-    with tempfile.TemporaryDirectory() as tmpdir:
-        save_path = procesar_archivo_individual(file, tmpdir)
-        
-        # Devolver el archivo generado como descarga
-        generated_file = open(save_path, "rb")
-        return StreamingResponse(
-            generated_file,
+    validar_parser(parser)
+    if not admision.reservar(1):
+        raise rechazar_por_capacidad()
+
+    try:
+        # El directorio de trabajo es solo para el archivo subido: el informe vuelve en memoria
+        with directorio_de_trabajo() as tmpdir:
+            nombre, contenido = procesar_archivo_individual(file, tmpdir, parser)
+
+        # Devolver el informe generado como descarga
+        return Response(
+            contenido,
             media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            headers={"Content-Disposition": f"attachment; filename={os.path.basename(save_path)}"}
+            headers={"Content-Disposition": f"attachment; filename={nombre}"}
         )
+    finally:
+        admision.liberar(1)
 
 @app.post("/generar_informes_multiples")
-async def generar_informes_multiples(files: List[UploadFile] = File(...)):
+async def generar_informes_multiples(files: List[UploadFile] = File(...), parser: Optional[str] = None):
     """
     Recibe múltiples archivos Word o PDF del ecógrafo y devuelve un archivo ZIP con todos los informes generados.
     Soporta archivos .docx, .doc y .pdf.
+    El ZIP se envía en streaming: cada informe sale apenas termina de generarse, y al final
+    se agregan errores.txt (si hubo errores) y manifest.json con el estado de cada archivo.
+    Todo el trabajo bloqueante (guardado, procesamiento, compresión) corre fuera del event loop.
     """
-    if not files:
-        raise HTTPException(status_code=400, detail="Debe proporcionar al menos un archivo")
-    
-    if len(files) > 50:  # Límite de seguridad
-        raise HTTPException(status_code=400, detail="Máximo 50 archivos por lote")
-
-    with tempfile.TemporaryDirectory() as tmpdir:
-        generated_files = []
-        errors = []
-        
-        # Procesar cada archivo
-        for file in files:
-            try:
-                print(f"[INFO] Procesando archivo: {file.filename}")
-                save_path = procesar_archivo_individual(file, tmpdir)
-                generated_files.append(save_path)
-                print(f"[INFO] Archivo procesado exitosamente: {file.filename}")
-            except Exception as e:
-                error_msg = f"Error procesando {file.filename}: {str(e)}"
-                print(f"[ERROR] {error_msg}")
-                errors.append(error_msg)
-        
-        if not generated_files:
+    validar_lote(files)
+    validar_parser(parser)
+
+    if not admision.reservar(len(files)):
+        raise rechazar_por_capacidad()
+
+    tmpdir = crear_directorio_de_trabajo()
+    pendientes = {}
+    listos = []
+    compartidos = {}
+    memoria = InformesEnMemoria()
+
+    def liberar_lote():
+        for task in pendientes:
+            task.cancel()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        admision.liberar(len(files))
+        if memoria.a_disco:
+            print(f"[INFO] {memoria.a_disco} informes del lote se escribieron a disco (RENDER_SPILL_MB)")
+
+    try:
+        # Cada archivo usa su propio directorio de trabajo para que los
+        # workers no se pisen archivos con el mismo nombre
+        print(f"[INFO] Procesando {len(files)} archivos con hasta {BATCH_MAX_WORKERS} workers")
+        for index, file in enumerate(files):
+            workdir = os.path.join(tmpdir, f"{index:03d}")
+            os.makedirs(workdir)
+            task = asyncio.create_task(procesar_archivo_de_lote(file, workdir, compartidos, memoria, parser))
+            pendientes[task] = (index, file)
+
+        # Esperar el primer informe exitoso antes de empezar a responder, así un lote
+        # donde fallan todos los archivos sigue devolviendo un error HTTP
+        while pendientes and not any(r['error'] is None for _, _, r in listos):
+            done, _ = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index, file = pendientes.pop(task)
+                listos.append((index, file, task.result()))
+
+        if not any(r['error'] is None for _, _, r in listos):
+            errors = [f"Error procesando {file.filename}: {r['error']}" for _, file, r in sorted(listos, key=lambda x: x[0])]
             raise HTTPException(
                 status_code=500, 
                 detail=f"No se pudo procesar ningún archivo. Errores: {'; '.join(errors)}"
             )
-        
-        # Crear archivo ZIP con todos los informes generados
-        zip_filename = "informes_generados.zip"
-        zip_path = os.path.join(tmpdir, zip_filename)
-        
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for file_path in generated_files:
-                filename = os.path.basename(file_path)
-                zip_file.write(file_path, filename)
-            
+    except BaseException:
+        liberar_lote()
+        raise
+
+    async def resultados_en_orden_de_llegada():
+        for item in listos:
+            yield item
+        while pendientes:
+            done, _ = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index, file = pendientes.pop(task)
+                yield index, file, task.result()
+
+    async def generar_zip():
+        zip_stream = ZipEnStreaming()
+        manifest = []
+        errores = []
+        generados = 0
+        try:
+            async for index, file, resultado in resultados_en_orden_de_llegada():
+                if resultado['error'] is None and 'duplicado_de' in resultado:
+                    # El informe ya está (o va a estar) en el ZIP por el archivo original
+                    nombre = resultado['nombre']
+                    manifest.append((index, {"archivo": file.filename, "estado": "ok", "informe": nombre,
+                                             "duplicado_de": resultado['duplicado_de']}))
+                elif resultado['error'] is None:
+                    nombre = resultado['nombre']
+                    if resultado.get('contenido') is not None:
+                        yield await run_in_threadpool(zip_stream.agregar_bytes, nombre, resultado['contenido'])
+                        memoria.liberar(resultado)
+                    else:
+                        # Escrito a disco por el worker: se lee y se envía de a CHUNK_SIZE
+                        async for chunk in iterate_in_threadpool(zip_stream.agregar_archivo(resultado['save_path'], nombre)):
+                            yield chunk
+                    # El informe ya está en el ZIP: liberar el disco del archivo
+                    await run_in_threadpool(shutil.rmtree, os.path.join(tmpdir, f"{index:03d}"), True)
+                    generados += 1
+                    manifest.append((index, {"archivo": file.filename, "estado": "ok", "informe": nombre}))
+                    print(f"[INFO] Archivo procesado exitosamente: {file.filename}")
+                else:
+                    error_msg = f"Error procesando {file.filename}: {resultado['error']}"
+                    print(f"[ERROR] {error_msg}")
+                    errores.append((index, error_msg))
+                    manifest.append((index, {"archivo": file.filename, "estado": "error", "error": str(resultado['error'])}))
+
             # Si hay errores, agregar un archivo de log con los errores
-            if errors:
-                error_log = "\n".join([f"- {error}" for error in errors])
-                error_content = f"Archivos procesados exitosamente: {len(generated_files)}\n"
-                error_content += f"Archivos con errores: {len(errors)}\n\n"
-                error_content += "Errores encontrados:\n" + error_log
-                
-                error_file_path = os.path.join(tmpdir, "errores.txt")
-                with open(error_file_path, 'w', encoding='utf-8') as error_file:
-                    error_file.write(error_content)
-                zip_file.write(error_file_path, "errores.txt")
-        
-        print(f"[INFO] ZIP creado con {len(generated_files)} archivos procesados")
-        
-        # Devolver el archivo ZIP como descarga
-        zip_file_obj = open(zip_path, "rb")
-        return StreamingResponse(
-            zip_file_obj,
-            media_type="application/zip",
-            headers={"Content-Disposition": f"attachment; filename={zip_filename}"}
-        )
+            if errores:
+                errors = [error for _, error in sorted(errores)]
+                yield zip_stream.agregar_bytes("errores.txt", contenido_errores(generados, errors).encode('utf-8'))
+
+            archivos = [item for _, item in sorted(manifest, key=lambda x: x[0])]
+            yield zip_stream.agregar_bytes("manifest.json", contenido_manifest(generados, archivos))
+            yield zip_stream.cerrar()
+            print(f"[INFO] ZIP enviado con {generados} archivos procesados")
+        finally:
+            liberar_lote()
+
+    # Devolver el archivo ZIP como descarga
+    return StreamingResponse(
+        generar_zip(),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=informes_generados.zip"}
+    )
+
+@app.post("/lotes", status_code=202)
+def crear_lote(files: List[UploadFile] = File(...)):
+    """
+    Encola un lote para procesarlo en segundo plano y responde enseguida con el id del lote.
+    El estado se consulta en /lotes/{job_id} y el ZIP se descarga en /lotes/{job_id}/descarga.
+    Los lotes sobreviven a un reinicio del servidor.
+    """
+    validar_lote(files)
+    cola = get_job_queue()
+    # El lote cuenta como pendiente desde que se reserva, así los que se reciben a la vez
+    # tampoco superan JOBS_MAX_PENDING
+    reservado = cola.nuevo_job(JOBS_MAX_PENDING)
+    if reservado is None:
+        raise rechazar_por_cola_llena()
+
+    job_id, job_dir = reservado
+    archivos = []
+    try:
+        for index, file in enumerate(files):
+            workdir = os.path.join(job_dir, f"{index:03d}")
+            os.makedirs(workdir)
+            try:
+                input_path = guardar_archivo_subido(file, workdir).path
+                archivos.append({'filename': file.filename, 'input_path': input_path})
+            except HTTPException as e:
+                archivos.append({'filename': file.filename, 'error': str(e.detail)})
+            except Exception as e:
+                archivos.append({'filename': file.filename, 'error': str(e)})
+        cola.encolar(job_id, archivos)
+    except BaseException:
+        cola.descartar_job(job_id)
+        raise
+    print(f"[INFO] Lote {job_id} encolado con {len(archivos)} archivos")
+    return {
+        "job_id": job_id,
+        "estado": "pendiente",
+        "archivos": len(archivos),
+        "estado_url": f"/lotes/{job_id}",
+        "descarga_url": f"/lotes/{job_id}/descarga"
+    }
+
+def obtener_lote(job_id: str) -> Dict[str, Any]:
+    job = get_job_queue().obtener(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Lote no encontrado")
+    return job
+
+@app.get("/lotes/{job_id}")
+def estado_lote(job_id: str):
+    """
+    Estado del lote y de cada uno de sus archivos.
+    """
+    job = obtener_lote(job_id)
+    job.pop('zip_path')
+    for archivo in job['archivos']:
+        if archivo['informe']:
+            archivo['informe'] = os.path.basename(archivo['informe'])
+    return job
+
+@app.get("/lotes/{job_id}/descarga")
+def descargar_lote(job_id: str):
+    """
+    Descarga el ZIP de un lote terminado (informes, errores.txt y manifest.json).
+    """
+    job = obtener_lote(job_id)
+    if job['estado'] == 'expirado':
+        raise HTTPException(status_code=410, detail="Los resultados del lote expiraron")
+    if job['estado'] == 'fallido':
+        raise HTTPException(status_code=500, detail=f"El lote falló: {job['error']}")
+    if job['estado'] != 'terminado' or not job['zip_path'] or not os.path.exists(job['zip_path']):
+        raise HTTPException(status_code=409, detail=f"El lote todavía no terminó (estado: {job['estado']})")
+    return FileResponse(job['zip_path'], media_type="application/zip", filename="informes_generados.zip")
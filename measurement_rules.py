@@ -0,0 +1,232 @@
+"""
+Post-procesamiento e interpretación de las mediciones como tablas de reglas.
+
+Reemplaza la cadena update_dictionary -> dic_cleaning -> convert_to_int -> conv_vel_a_m ->
+text_mass_hypertrophy -> text_diam_LV -> text_atrium -> remove_signs, donde cada paso recorría
+todo el diccionario y buscaba en listas. Acá las listas son conjuntos (búsqueda O(1)), limpieza,
+conversión y paso a m/s se aplican en una sola pasada por clave, los umbrales de interpretación
+son tablas (los grados de dilatación auricular se resuelven con bisect) y los nombres sin signos
+se memorizan. El resultado es el mismo que el de la cadena original, que sigue en
+aux_calculations / patient_data_extraction como referencia (ver bench_measurement_rules.py).
+
+Lo usan el .docx (procesar_mediciones) y el PDF (interpretar_pdf).
+"""
+
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from typing import Dict, Any
+
+from aux_calculations import is_float, assign_max_if_list, mass_conc, conc_atrium
+
+# Cálculos que el equipo escribe dentro de la lista de valores de otra medición, seguidos de su valor
+CALCULOS = frozenset([
+    '*Dimensionless Index', '*Flow Rate AS', 'CSA(LVOT)', 'SV(LVOT)', 'CSA(AV SV)', 'Reg Vol(PISA TR)',
+    'EROA(PISA TR)', 'Flow Rate(PISA TR)', 'Reg Vol(PISA MR)', 'EROA(PISA MR)', 'Flow Rate(PISA MR)',
+    'AVA(VTI)', 'RWT(2D)', 'LVd Mass(2D-ASE)', 'MV E/A Ratio', "Average E'", "E/Med E'", 'LVIDd Index(2D)',
+    '%LVPW(2D)', 'LVESV(A4C Simp)', 'EF(A4C Simp)', "E/Lat E'", "E/Avg E'", '*Aortic Sinus Indexed',
+    'LVEDVI(A4C Simp)', 'LA ESVI(BP A-L)', 'AVAI(AVA VTI)', 'SI(LVOT)', '%IVS(2D)',
+])
+
+# Mediciones que se redondean a entero
+A_ENTERO = frozenset([
+    'LVIDd', 'LVIDs', 'IVSd', '%FS(2D)', 'LVd Mass Index(2D-ASE)', 'Ao Sinusus', 'Ao Diam', 'RAAd', 'RVAWd',
+    'LVPWd', 'LAVI', "E/Avg E'", 'EF(A4C Simp)', 'AR PHT', 'LAAd', 'LA ESVI(BP A-L)', 'Bi-plane LA A-L  LAVI',
+    'AV Vmax', 'AV Vmax  PG', 'LVOT Vmax', 'LVOT Vmax  PG', 'LVOT Trace  Peak PG', 'RVSP  TR Vmax',
+    'RVSP    PG', 'AV Trace  Vmax', 'AV Trace  Peak PG', 'TR Vmax  PG',
+])
+
+# Velocidades que el equipo informa en cm/s y el informe muestra en m/s
+VELOCIDADES_CM_S = frozenset([
+    'RVOT Vmax', 'AV Vmax', 'LVOT Vmax', 'TR Vmax', 'MV Vel E', 'MV Vel A', 'Vmax',
+    'AV Trace  Vmax', 'LVOT Trace  Vmax', 'RVSP  TR Vmax',
+])
+
+# Umbrales de hipertrofia por género: (índice de masa g/m², masa g); cualquier otro género usa MUJER
+HIPERTROFIA = {'Male': (115, 200)}
+HIPERTROFIA_MUJER = (95, 150)
+RWT_CONCENTRICO = 0.42
+
+# Diámetro diastólico del VI normal por género: (mínimo, máximo) en mm
+DIAMETRO_VI = {'Male': (42, 58)}
+DIAMETRO_VI_MUJER = (38, 54)
+# Espesores máximos normales en mm: septum, pared posterior
+ESPESOR_MAX = (12, 9)
+
+# Grados de dilatación auricular: el índice en GRADOS_AURICULA lo da bisect sobre los límites
+GRADOS_AURICULA = ('Diámetros conservados', 'Levemente dilatada', 'Moderadamente dilatada', 'Severamente dilatada')
+# Aurícula izquierda: intervalos [a, b) -> bisect_right
+LIMITES_AI_VOLUMEN = (34, 44, 54)
+LIMITES_AI_AREA = (21, 31, 41)
+# Aurícula derecha: intervalos (a, b] -> bisect_left
+LIMITES_AD = (18, 28, 38)
+
+# Mediciones del PDF que comparten reglas con el .docx, con el nombre que usan las reglas
+ALIAS_PDF = {'LVEDD': 'LVIDd', 'LVESD': 'LVIDs', 'IVSd': 'IVSd', 'PWd': 'LVPWd'}
+ESCALA_A_MM = {'mm': 1, 'cm': 10}
+GENEROS_PDF = {'m': 'Male', 'male': 'Male', 'masculino': 'Male', 'f': 'Female', 'female': 'Female', 'femenino': 'Female'}
+
+
+@lru_cache(maxsize=4096)
+def clave_sin_signos(clave: str) -> str:
+    '''
+    Igual que remove_signs para una clave; las claves del equipo se repiten en cada estudio.
+    '''
+    return (clave.replace('  ', ' ').replace(' ', '_').replace('/', '_').replace('(', '_').replace(')', '')
+            .replace('-', '_').replace('%', '').replace("'", '').replace('*', ''))
+
+
+def _calculos_incrustados(data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    update_dictionary: cada cálculo de CALCULOS que aparece en una lista de valores pasa a ser
+    una clave con el elemento siguiente como valor.
+    '''
+    updates = {}
+    for valores in data.values():
+        if not isinstance(valores, list):
+            continue
+        vistos = set()
+        for i, elemento in enumerate(valores):
+            if isinstance(elemento, str) and elemento in CALCULOS and elemento not in vistos:
+                vistos.add(elemento)
+                if i + 1 < len(valores):
+                    updates[elemento] = valores[i + 1]
+    return updates
+
+
+def _limpiar(valor, claves):
+    '''
+    dic_cleaning: una lista de un elemento es ese elemento; si la lista contiene otra clave
+    (el equipo pegó dos mediciones en una fila) se queda con el primer valor.
+    '''
+    if not isinstance(valor, list):
+        return valor
+    if len(valor) == 1:
+        return valor[0]
+    for i, elemento in enumerate(valor):
+        if elemento in claves:
+            return valor[0] if i > 0 else ''
+    return valor
+
+
+def _convertir(clave: str, valor):
+    '''
+    convert_to_int y conv_vel_a_m para una clave.
+    '''
+    if 'Exam_Date' not in clave:
+        redondear = clave in A_ENTERO
+        if isinstance(valor, list):
+            numeros = []
+            for i in valor:
+                if is_float(i):
+                    numero = float(i.replace('-', ''))
+                    numeros.append(int(round(numero, 0)) if redondear else numero)
+            valor = numeros
+        elif isinstance(valor, str) and is_float(valor):
+            numero = float(valor.replace('-', ''))
+            valor = int(round(numero, 0)) if redondear else numero
+    if clave in VELOCIDADES_CM_S:
+        if isinstance(valor, list):
+            valor = [round(i / 100, 2) for i in valor]
+        else:
+            valor = round(valor / 100, 2)
+    return valor
+
+
+def interpretar_masa(dic: Dict[str, Any]) -> None:
+    '''
+    text_mass_hypertrophy: agrega mass_interpretation y mass_conc.
+    '''
+    mass_index = dic.get('LVd Mass Index(2D-ASE)', '')
+    # el índice de masa tiene prioridad sobre la masa
+    mass = dic.get('LVd Mass(2D-ASE)', '') if mass_index == '' else ''
+    rwt = dic.get('RWT(2D)', '')
+    text_mass = 'Índice de masa dentro del parámetros de la normalidad' if mass_index != '' else 'Masa dentro de parámetros de la normalidad'
+    text_rwt = '' if rwt != '' and float(rwt) < RWT_CONCENTRICO else ', remodelado concéntrico'
+    limite_indice, limite_masa = HIPERTROFIA.get(dic.get('Gender', ''), HIPERTROFIA_MUJER)
+    if mass_index != '' and mass_index >= limite_indice or mass != '' and mass >= limite_masa:
+        text_mass = 'Hipertrofia'
+        text_rwt = ' concéntrica' if rwt != '' and rwt >= RWT_CONCENTRICO else ' excéntrica'
+    dic['mass_interpretation'] = text_mass + text_rwt
+    dic['mass_conc'] = mass_conc(text_mass, text_rwt)
+
+
+def interpretar_diametro_vi(dic: Dict[str, Any]) -> None:
+    '''
+    text_diam_LV: agrega diam_lv_interpretation si están LVIDd, IVSd y LVPWd.
+    '''
+    lvidd, ivsd, lvpwd = assign_max_if_list(dic.get('LVIDd', ''), dic.get('IVSd', ''), dic.get('LVPWd', ''))
+    if lvidd == '' or ivsd == '' or lvpwd == '':
+        return
+    text_lvidd = 'Dimensiones y '
+    text_thick = 'espesores conservados'
+    if float(ivsd) > ESPESOR_MAX[0] or float(lvpwd) > ESPESOR_MAX[1]:
+        text_thick = 'espesores aumentados'
+        text_lvidd = 'Dimensiones conservadas y '
+    minimo, maximo = DIAMETRO_VI.get(dic.get('Gender', ''), DIAMETRO_VI_MUJER)
+    if float(lvidd) > maximo:
+        text_lvidd = 'Dimensiones aumentadas, '
+    elif float(lvidd) < minimo:
+        text_lvidd = 'Dimensiones disminuidas, '
+    dic['diam_lv_interpretation'] = text_lvidd + text_thick
+
+
+def interpretar_auriculas(dic: Dict[str, Any]) -> None:
+    '''
+    text_atrium: agrega la_text y ra_text, y conc_atrium si hay mediciones de la aurícula izquierda.
+    '''
+    # volumen antes que área; el área solo se usa si no hay volumen
+    lav = dic.get('Bi-plane LA A-L  LAVI', '') if dic.get('LA ESVI(BP A-L)', '') == '' else dic.get('LA ESVI(BP A-L)', '')
+    lad = dic.get('LAAd', '') if lav == '' else ''
+    lav, lad, rad = assign_max_if_list(lav, lad, dic.get('RAAd', ''))
+    if lad == '' and lav == '':
+        dic['la_text'] = GRADOS_AURICULA[0]
+        dic['ra_text'] = GRADOS_AURICULA[0]
+        return
+    if lad == '':
+        la_text = GRADOS_AURICULA[bisect_right(LIMITES_AI_VOLUMEN, lav)]
+    else:
+        la_text = GRADOS_AURICULA[bisect_right(LIMITES_AI_AREA, lad)]
+    ra_text = GRADOS_AURICULA[bisect_left(LIMITES_AD, rad)] if rad != '' else GRADOS_AURICULA[0]
+    dic['la_text'] = la_text
+    dic['ra_text'] = ra_text
+    dic['conc_atrium'] = conc_atrium(la_text, ra_text)
+
+
+INTERPRETACIONES = (interpretar_masa, interpretar_diametro_vi, interpretar_auriculas)
+
+
+def procesar_mediciones(data: Dict[str, Any], gender) -> Dict[str, Any]:
+    '''
+    Mediciones crudas de la tabla anidada ({clave: [textos]}) -> diccionario para el template,
+    igual que la cadena update_dictionary ... remove_signs.
+    '''
+    data.update(_calculos_incrustados(data))
+    valores = {clave: _convertir(clave, _limpiar(valor, data)) for clave, valor in data.items()}
+    valores['Gender'] = gender
+    for interpretar in INTERPRETACIONES:
+        interpretar(valores)
+    # remove_signs va último porque las interpretaciones usan los nombres como los escribe el equipo
+    return {clave_sin_signos(clave): valor for clave, valor in valores.items()}
+
+
+def interpretar_pdf(measurements: Dict[str, Any], gender) -> Dict[str, Any]:
+    '''
+    Interpretaciones para las mediciones de un PDF ({clave: {'value', 'unit'}}) con las mismas
+    reglas que el .docx. Solo las de diámetros y espesores del VI: el PDF no trae masa ni
+    volúmenes auriculares, y esas reglas dan un texto de normalidad cuando faltan los datos.
+    Devuelve solo las claves nuevas.
+    '''
+    valores = {}
+    for clave, medicion in measurements.items():
+        destino = ALIAS_PDF.get(clave)
+        if destino is None or not isinstance(medicion, dict):
+            continue
+        escala = ESCALA_A_MM.get(str(medicion.get('unit', '')).strip().lower())
+        valor = medicion.get('value')
+        if escala is None or not is_float(valor):
+            continue
+        valores[destino] = _convertir(destino, str(float(valor) * escala))
+    valores['Gender'] = GENEROS_PDF.get(str(gender).strip().lower(), gender)
+    previas = set(valores)
+    interpretar_diametro_vi(valores)
+    return {clave: valor for clave, valor in valores.items() if clave not in previas}
@@ -0,0 +1,57 @@
+"""
+Vocabulario de campos de las tablas de mediciones aplanadas por LibreOffice.
+
+Los patrones (texto de la celda -> clave de la medición) se leen de field_mapping.csv, o del
+archivo en FIELD_MAPPING_PATH, y se compilan en una sola expresión regular. Gana el primer
+patrón del archivo que aparezca en la celda, igual que el diccionario que reemplaza.
+"""
+
+import os
+import re
+import csv
+from functools import lru_cache
+from typing import Dict, Optional
+
+FIELD_MAPPING_PATH = os.getenv('FIELD_MAPPING_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'field_mapping.csv'))
+
+
+class VocabularioCampos:
+    '''
+    Patrones en orden de prioridad. La regex es la alternancia de todos los patrones: descarta
+    en una pasada las celdas sin ningún campo (números, unidades, vacías), que son casi todas.
+    Solo en las que coinciden se busca el patrón de mayor prioridad, porque la regex devuelve
+    el de más a la izquierda y los patrones superpuestos podrían taparse entre sí.
+    '''
+
+    def __init__(self, campos: Dict[str, str]):
+        self.campos = {patron.lower(): campo for patron, campo in campos.items() if patron}
+        alternancia = '|'.join(re.escape(patron) for patron in self.campos)
+        self._regex = re.compile(alternancia) if self.campos else None
+
+    def buscar(self, texto: str) -> Optional[str]:
+        '''
+        Clave del primer patrón (en orden del archivo) contenido en texto, ya en minúsculas, o None.
+        '''
+        if self._regex is None or self._regex.search(texto) is None:
+            return None
+        for patron, campo in self.campos.items():
+            if patron in texto:
+                return campo
+        return None
+
+
+def cargar_vocabulario(path: str = FIELD_MAPPING_PATH) -> VocabularioCampos:
+    '''
+    Lee un CSV con columnas patron,campo; el orden de las filas es la prioridad.
+    '''
+    with open(path, newline='', encoding='utf-8') as f:
+        campos = {fila['patron'].strip(): fila['campo'].strip() for fila in csv.DictReader(f)}
+    return VocabularioCampos(campos)
+
+
+@lru_cache(maxsize=None)
+def vocabulario_campos(path: str = FIELD_MAPPING_PATH) -> VocabularioCampos:
+    '''
+    Vocabulario compilado una vez por proceso.
+    '''
+    return cargar_vocabulario(path)
@@ -0,0 +1,236 @@
+"""
+Métricas de latencia por etapa en formato de texto de Prometheus.
+
+Cada informe lleva un Cronometro (en un ContextVar) donde las etapas se anotan con
+`with etapa('render'):`. Los workers del pool devuelven sus etapas junto con el resultado
+y el proceso principal las vuelca en los histogramas que se exponen en /metrics.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Tuple, Optional, Any
+
+# Límites de los buckets en segundos: desde el parseo de una tabla hasta una llamada a Gemini
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+TIPO_DESCONOCIDO = 'desconocido'
+# Tipo de un informe servido desde el cache cuyo nombre de archivo no indica el tipo
+TIPO_CACHE = 'cache'
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatear_etiquetas(nombres: Tuple[str, ...], valores: Tuple[str, ...], extra: str = '') -> str:
+    pares = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _formatear_numero(valor: float) -> str:
+    return str(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+
+class Contador:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...]):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valores: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, cantidad: float = 1, **etiquetas) -> None:
+        clave = tuple(etiquetas[nombre] for nombre in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def exponer(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            for clave, valor in sorted(self._valores.items()):
+                lineas.append(f"{self.nombre}{_formatear_etiquetas(self.etiquetas, clave)} {_formatear_numero(valor)}")
+        return lineas
+
+
+class Histograma:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...], buckets: Tuple[float, ...] = BUCKETS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        # Por combinación de etiquetas: (conteo por bucket, suma, conteo total)
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, **etiquetas) -> None:
+        clave = tuple(etiquetas[nombre] for nombre in self.etiquetas)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def exponer(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            for clave, (conteos, suma, total) in sorted(self._series.items()):
+                for limite, conteo in zip(self.buckets, conteos):
+                    etiquetas = _formatear_etiquetas(self.etiquetas, clave, f'le="{_formatear_numero(limite)}"')
+                    lineas.append(f"{self.nombre}_bucket{etiquetas} {conteo}")
+                etiquetas = _formatear_etiquetas(self.etiquetas, clave, 'le="+Inf"')
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {total}")
+                etiquetas = _formatear_etiquetas(self.etiquetas, clave)
+                lineas.append(f"{self.nombre}_sum{etiquetas} {_formatear_numero(suma)}")
+                lineas.append(f"{self.nombre}_count{etiquetas} {total}")
+        return lineas
+
+
+class Registro:
+    def __init__(self):
+        self.metricas = []
+
+    def contador(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...]) -> Contador:
+        metrica = Contador(nombre, ayuda, etiquetas)
+        self.metricas.append(metrica)
+        return metrica
+
+    def histograma(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...], buckets: Tuple[float, ...] = BUCKETS) -> Histograma:
+        metrica = Histograma(nombre, ayuda, etiquetas, buckets)
+        self.metricas.append(metrica)
+        return metrica
+
+    def exponer(self) -> str:
+        lineas = []
+        for metrica in self.metricas:
+            lineas.extend(metrica.exponer())
+        return "\n".join(lineas) + "\n"
+
+
+registro = Registro()
+
+duracion_etapas = registro.histograma(
+    'eco_stage_duration_seconds', 'Duración de cada etapa de generación de un informe.', ('stage', 'tipo', 'formato'))
+duracion_informes = registro.histograma(
+    'eco_report_duration_seconds', 'Duración total de la generación de un informe.', ('tipo', 'formato', 'resultado'))
+informes_total = registro.contador(
+    'eco_reports_total', 'Informes procesados por tipo de estudio, formato de origen y resultado.', ('tipo', 'formato', 'resultado'))
+rechazos_total = registro.contador(
+    'eco_rejected_requests_total', 'Pedidos rechazados sin generar informes (413 por tamaño, 429 por capacidad).', ('endpoint', 'status'))
+
+
+def formato_de(filename: str) -> str:
+    '''
+    Formato de origen según la extensión del archivo subido: docx, doc o pdf.
+    '''
+    extension = filename.rsplit('.', 1)[-1].lower() if filename and '.' in filename else ''
+    return extension if extension in ('docx', 'doc', 'pdf') else 'otro'
+
+
+class Cronometro:
+    '''
+    Etapas de un informe: lista de (nombre, segundos) más las etiquetas tipo y formato.
+    degradado explica por qué el informe salió con un fallback (p. ej. el LLM falló).
+    '''
+
+    def __init__(self, formato: str):
+        self.formato = formato
+        self.tipo: Optional[str] = None
+        self.degradado: Optional[str] = None
+        self.etapas: List[Tuple[str, float]] = []
+        self.inicio = time.perf_counter()
+
+    @contextmanager
+    def etapa(self, nombre: str):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.etapas.append((nombre, time.perf_counter() - inicio))
+
+    def exportar(self) -> Dict[str, Any]:
+        return {'tipo': self.tipo, 'etapas': list(self.etapas), 'degradado': self.degradado}
+
+    def agregar(self, exportado: Dict[str, Any]) -> None:
+        '''
+        Suma las etapas que midió un worker.
+        '''
+        self.etapas.extend((nombre, segundos) for nombre, segundos in exportado.get('etapas', []))
+        if exportado.get('tipo'):
+            self.tipo = exportado['tipo']
+        if exportado.get('degradado'):
+            self.degradado = exportado['degradado']
+
+    def duracion(self) -> float:
+        return time.perf_counter() - self.inicio
+
+
+_cronometro: ContextVar[Optional[Cronometro]] = ContextVar('cronometro', default=None)
+
+
+def iniciar_cronometro(formato: str) -> Cronometro:
+    cronometro = Cronometro(formato)
+    _cronometro.set(cronometro)
+    return cronometro
+
+
+def cronometro_actual() -> Optional[Cronometro]:
+    return _cronometro.get()
+
+
+@contextmanager
+def etapa(nombre: str):
+    '''
+    Mide el bloque como una etapa del informe en curso; sin cronómetro activo no hace nada.
+    '''
+    cronometro = _cronometro.get()
+    if cronometro is None:
+        yield
+        return
+    with cronometro.etapa(nombre):
+        yield
+
+
+def registrar_etapa(nombre: str, segundos: float) -> None:
+    '''
+    Anota una etapa medida fuera del contexto del informe (p. ej. en un pool de hilos).
+    '''
+    cronometro = _cronometro.get()
+    if cronometro is not None:
+        cronometro.etapas.append((nombre, segundos))
+
+
+def etiquetar_tipo(tipo: str) -> None:
+    cronometro = _cronometro.get()
+    if cronometro is not None:
+        cronometro.tipo = tipo
+
+
+def marcar_degradado(motivo: str) -> None:
+    cronometro = _cronometro.get()
+    if cronometro is not None:
+        cronometro.degradado = motivo
+
+
+def registrar_rechazo(endpoint: str, status: int) -> None:
+    rechazos_total.incrementar(endpoint=endpoint, status=str(status))
+
+
+def registrar_informe(cronometro: Cronometro, resultado: str, duracion: Optional[float] = None) -> None:
+    '''
+    Vuelca las etapas del cronómetro en los histogramas. resultado es 'ok', 'error' o 'cache'.
+    '''
+    tipo = cronometro.tipo or TIPO_DESCONOCIDO
+    for nombre, segundos in cronometro.etapas:
+        duracion_etapas.observar(segundos, stage=nombre, tipo=tipo, formato=cronometro.formato)
+    if duracion is None:
+        duracion = sum(segundos for _, segundos in cronometro.etapas)
+    duracion_informes.observar(duracion, tipo=tipo, formato=cronometro.formato, resultado=resultado)
+    informes_total.incrementar(tipo=tipo, formato=cronometro.formato, resultado=resultado)
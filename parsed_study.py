@@ -0,0 +1,140 @@
+"""
+Estudio subido parseado una única vez.
+
+Selección de template, datos del paciente, mediciones, motilidad e imágenes trabajan
+sobre el mismo ParsedStudy en lugar de volver a abrir el archivo cada uno.
+"""
+
+import os
+from typing import List, Dict, Any, Tuple, Optional
+from docx import Document
+
+from docx_table_index import DocxTableIndex
+
+# Backend para leer tablas e imágenes de un .docx: 'docx' (python-docx, la referencia) o
+# 'lxml' (docx_xml_parser, lee word/document.xml en streaming sin objetos de python-docx)
+PARSERS_DOCX = ('docx', 'lxml')
+DOCX_PARSER = os.getenv('DOCX_PARSER', 'docx')
+
+
+class ParsedStudy:
+    '''
+    Envuelve el archivo del ecógrafo (.docx o .pdf) y cachea lo que se extrae de él.
+
+    Para .docx expone `tables` y `part` como un docx.Document, así puede pasarse directamente
+    a extract_patient_info, get_measure_table, get_mot_table e image_extractor; las tablas
+    vienen de un DocxTableIndex armado una sola vez, con python-docx o con lxml según `parser`.
+    Para .pdf cachea el análisis de páginas y las imágenes extraídas.
+    '''
+
+    def __init__(self, path: str, parser: Optional[str] = None):
+        self.path = str(path)
+        self.parser = parser or DOCX_PARSER
+        if self.parser not in PARSERS_DOCX:
+            raise ValueError(f"Parser de .docx desconocido: {self.parser}")
+        self.is_pdf = self.path.lower().endswith('.pdf')
+        self._doc = None
+        self._table_index = None
+        self._images = None
+        self._pdf_content = None
+        self._pdf_images = None
+        self._pdf_paginas = None
+
+    @property
+    def formato(self) -> str:
+        return 'pdf' if self.is_pdf else 'docx'
+
+    # --- docx ---
+
+    @property
+    def doc(self):
+        if self._doc is None:
+            self._doc = Document(self.path)
+        return self._doc
+
+    @property
+    def table_index(self) -> DocxTableIndex:
+        # Una sola pasada por todas las tablas (y sus anidadas) del documento
+        if self._table_index is None:
+            if self.parser == 'lxml':
+                self._table_index = DocxTableIndex.desde_xml(self.path)
+            else:
+                self._table_index = DocxTableIndex.desde_documento(self.doc)
+        return self._table_index
+
+    @property
+    def tables(self) -> list:
+        # Tablas indexadas: mismas rows/cells/text/tables que python-docx, ya calculadas
+        return self.table_index.tablas
+
+    @property
+    def part(self):
+        return self.doc.part
+
+    @property
+    def images(self) -> List[Tuple[str, bytes]]:
+        '''
+        Lista de (target_ref, blob) de las imágenes embebidas en el .docx.
+        '''
+        if self._images is None and self.parser == 'lxml':
+            from docx_xml_parser import leer_imagenes
+            self._images = leer_imagenes(self.path)
+        elif self._images is None:
+            self._images = [
+                (rel.target_ref, rel.target_part.blob)
+                for rel in self.part.rels.values()
+                if 'image' in rel.reltype and not rel.is_external
+            ]
+        return self._images
+
+    # --- pdf ---
+
+    def _analizar_pdf(self) -> None:
+        # Páginas e imágenes salen de la misma pasada sobre el PDF
+        from pdf_processor import analizar_pdf
+        self._pdf_content, self._pdf_images = analizar_pdf(self.path)
+        if self._pdf_paginas is not None:
+            self._pdf_paginas.sembrar(self._pdf_content)
+
+    @property
+    def pdf_paginas(self):
+        '''
+        Texto de cada página, leído a medida que se recorre (pdf_processor.PaginasPdf). Si el
+        análisis completo ya corrió, sale de ahí sin volver a abrir el PDF.
+        '''
+        if self._pdf_paginas is None:
+            from pdf_processor import PaginasPdf
+            self._pdf_paginas = PaginasPdf(self.path)
+            if self._pdf_content is not None:
+                self._pdf_paginas.sembrar(self._pdf_content)
+        return self._pdf_paginas
+
+    @property
+    def pdf_content(self) -> List[Dict[str, Any]]:
+        if self._pdf_content is None:
+            self._analizar_pdf()
+        return self._pdf_content
+
+    @property
+    def pdf_images(self) -> Dict[str, bytes]:
+        if self._pdf_images is None:
+            self._analizar_pdf()
+        return self._pdf_images
+
+    def pdf_text(self) -> str:
+        return " ".join(" ".join(lineas) for lineas in self.pdf_paginas)
+
+    def pdf_contiene(self, marcadores, max_paginas: int = 0) -> bool:
+        '''
+        True si alguna página contiene alguno de los marcadores; deja de leer en la primera.
+        '''
+        return self.pdf_paginas.buscar(marcadores, max_paginas) is not None
+
+
+def parse_study(path_or_study, parser: Optional[str] = None) -> ParsedStudy:
+    '''
+    Acepta una ruta o un ParsedStudy ya creado y devuelve siempre un ParsedStudy.
+    '''
+    if isinstance(path_or_study, ParsedStudy):
+        return path_or_study
+    return ParsedStudy(path_or_study, parser)
@@ -2,11 +2,11 @@
 from docxtpl import DocxTemplate, InlineImage
 from docx.shared import Cm
 import csv
-from PIL import Image
-from io import BytesIO
-from aux_calculations import convert_to_int,conv_vel_a_m,text_mass_hypertrophy,text_diam_LV,text_atrium,remove_signs
+from docx_table_index import indice_de, TablaIndexada
+from measurement_vocabulary import vocabulario_campos
+from measurement_rules import procesar_mediciones
+from image_pipeline import preparar_imagenes
 import re
-import os
 
 
 #extraer los datos de las tablas
@@ -16,17 +16,19 @@ def extract_patient_info(doc)->dict:
     returns a dictionary. Enhanced for LibreOffice-converted documents.
     '''
     data = {}
-    print(f"[DEBUG] extract_patient_info: Total tables found: {len(doc.tables)}")
+    # doc.tables de python-docx se recalcula en cada acceso; un ParsedStudy las tiene indexadas
+    tables = doc.tables
+    print(f"[DEBUG] extract_patient_info: Total tables found: {len(tables)}")
     
     # Try multiple tables in case LibreOffice changes table order
-    table_indices_to_try = [1, 0, 2] if len(doc.tables) > 2 else [1, 0] if len(doc.tables) > 1 else [0]
+    table_indices_to_try = [1, 0, 2] if len(tables) > 2 else [1, 0] if len(tables) > 1 else [0]
     
     for table_idx in table_indices_to_try:
-        if table_idx >= len(doc.tables):
+        if table_idx >= len(tables):
             continue
             
         try:
-            table = doc.tables[table_idx]
+            table = tables[table_idx]
             print(f"[DEBUG] Trying table {table_idx}: {len(table.rows)} rows, {len(table.rows[0].cells) if table.rows else 0} cols")
             
             table_data = {}
@@ -112,31 +114,27 @@ def dic_cleaning(data)->dict:
 
 def get_measure_table(doc)->'docx.table.Table | None':
     '''
-    Accepts word docx and extracts the table object where the measurements are
+    Accepts word docx and extracts the table object where the measurements are.
+    The lookup goes through the document's DocxTableIndex (built once per ParsedStudy).
     '''
     print("[DEBUG] get_measure_table: Searching for measurements table...")
-    for i, table in enumerate(doc.tables):
-        print(f"[DEBUG] Table {i}: {len(table.rows)} rows")
-        for j, row in enumerate(table.rows[:2]):  # Check first 2 rows
-            for k, cell in enumerate(row.cells):
-                if cell.text.strip():
-                    print(f"[DEBUG]   [{j},{k}]: {repr(cell.text)}")
-        # More flexible search for measure table
-        if any('measure' in cell.text.lower() for row in table.rows for cell in row.cells):
-            print(f"[DEBUG] Found measurements table at index {i}")
-            return table
-    print("[DEBUG] No measurements table found")
-    return None
+    indice = indice_de(doc)
+    i = indice.indice_con('measure')
+    if i is None:
+        print("[DEBUG] No measurements table found")
+        return None
+    print(f"[DEBUG] Found measurements table at index {i}")
+    return indice.tablas[i]
 
 def get_mot_table(doc)->'docx.table.Table | None':
     print("[DEBUG] get_mot_table: Searching for WMS table...")
-    for i, table in enumerate(doc.tables):
-        # More flexible search for WMS table
-        if any('wms' in cell.text.lower() for row in table.rows for cell in row.cells):
-            print(f"[DEBUG] Found WMS table at index {i}")
-            return table
-    print("[DEBUG] No WMS table found")
-    return None
+    indice = indice_de(doc)
+    i = indice.indice_con('wms')
+    if i is None:
+        print("[DEBUG] No WMS table found")
+        return None
+    print(f"[DEBUG] Found WMS table at index {i}")
+    return indice.tablas[i]
 
 def mot_extractor(table)->dict:
 
@@ -181,7 +179,10 @@ def get_measurements(table,gender):
     print(f"[DEBUG] get_measurements: Processing table with {len(table.rows)} rows")
     
     # Check if this is a LibreOffice flattened table (no nested tables)
-    has_nested_tables = any(len(cell.tables) > 0 for row in table.rows for cell in row.cells)
+    if isinstance(table, TablaIndexada):
+        has_nested_tables = table.tiene_anidadas
+    else:
+        has_nested_tables = any(len(cell.tables) > 0 for row in table.rows for cell in row.cells)
     print(f"[DEBUG] Table has nested tables: {has_nested_tables}")
     
     if not has_nested_tables:
@@ -193,61 +194,51 @@ def get_measurements(table,gender):
         print("[DEBUG] Using original nested table parsing")
         return parse_nested_measurements(table, gender)
 
+NUMERO_RE = re.compile(r'\d+(?:[.,]\d+)?')
+NO_NUMERICO_RE = re.compile(r'[^\d.,]')
+
+# Unidades en el orden en que se prueban contra el texto de una celda
+FLAT_UNITS = ['mm', 'cm', 'ml', 'g', 'mmHg', 'm²', 'cm²', 'cm/s', 'ml/s', 'ml/m²', 'cm²/m²', 'g/m²', 'ms', '%']
+
 def parse_flattened_measurements(table, gender):
     """Parse measurements from LibreOffice-flattened table structure with enhanced detection"""
     data = {}
     print(f"[DEBUG] Parsing flattened table: {len(table.rows)} rows")
     
-    # Enhanced field mapping with more variations
-    field_mapping = {
-        'diámetro diastólico del vi': 'LVIDd',
-        'diámetro sistólico del vi': 'LVIDs', 
-        'espesor diastólico del septum': 'IVSd',
-        'espesor diastólico de la pared': 'LVPWd',
-        'masa vi': 'LV_Mass',
-        'raíz de aorta': 'Aortic_Root',
-        'aurícula izquierda': 'LA_Area',
-        'aurícula derecha': 'RA_Area',
-        'diámetro basal vd': 'RV_Basal',
-        'fac%': 'FAC',
-        'tsvi': 'TSVI',
-        # Add velocity terms for second table
-        'vel pico': 'Vel_Peak',
-        'grad pico': 'Grad_Peak',
-        'aortica': 'Aortic_Vel',
-        'mitral': 'Mitral_Vel',
-        'tricúspide': 'Tricuspid_Vel',
-        'pulmonar': 'Pulmonary_Vel'
-    }
+    # Vocabulario de campos (field_mapping.csv) compilado en una sola regex
+    vocabulario = vocabulario_campos()
     
-    # First pass: create a cell content map for cross-referencing
+    # Una sola pasada: mapa de celdas, valor numérico y unidad de cada celda, y campos encontrados
     cell_map = {}
+    valores = {}
+    unidades = {}
+    campos = []
     for row_idx, row in enumerate(table.rows):
         for cell_idx, cell in enumerate(row.cells):
             cell_text = cell.text.strip()
             if cell_text:
                 cell_map[(row_idx, cell_idx)] = cell_text
                 print(f"[DEBUG] Cell map [{row_idx},{cell_idx}]: {repr(cell_text)}")
+                if is_numeric_value(cell_text):
+                    valores[(row_idx, cell_idx)] = extract_numeric_value(cell_text)
+                unit = next((unit for unit in FLAT_UNITS if unit in cell_text), None)
+                if unit:
+                    unidades[(row_idx, cell_idx)] = unit
+                key = vocabulario.buscar(cell_text.lower())
+                if key:
+                    campos.append((row_idx, cell_idx, len(row.cells), key))
     
-    # Second pass: enhanced value search
-    for row_idx, row in enumerate(table.rows):
-        for cell_idx, cell in enumerate(row.cells):
-            cell_text = cell.text.strip().lower()
-            
-            if cell_text:
-                # Look for medical field names
-                for pattern, key in field_mapping.items():
-                    if pattern in cell_text:
-                        value = find_associated_value(cell_map, row_idx, cell_idx, len(row.cells), len(table.rows))
-                        
-                        if value:
-                            unit = find_associated_unit(cell_map, row_idx, cell_idx, len(row.cells), len(table.rows))
-                            data[key] = {'value': value, 'unit': unit or ''}
-                            print(f"[DEBUG] Enhanced extraction: {key} = {value} {unit or ''}")
-                        break
+    # Los vecinos de cada campo ya están calculados: buscar valor y unidad es mirar diccionarios
+    for row_idx, cell_idx, max_cols, key in campos:
+        value = find_associated_value(valores, row_idx, cell_idx, max_cols, len(table.rows))
+        
+        if value:
+            unit = find_associated_unit(unidades, row_idx, cell_idx, max_cols, len(table.rows))
+            data[key] = {'value': value, 'unit': unit or ''}
+            print(f"[DEBUG] Enhanced extraction: {key} = {value} {unit or ''}")
     
     # Third pass: look for standalone numeric values that might be measurements
-    standalone_values = find_standalone_numeric_values(cell_map, len(table.rows))
+    standalone_values = find_standalone_numeric_values(cell_map, len(table.rows), valores)
     if standalone_values:
         print(f"[DEBUG] Found {len(standalone_values)} standalone numeric values")
         for pos, value in standalone_values.items():
@@ -256,54 +247,52 @@ def parse_flattened_measurements(table, gender):
     print(f"[DEBUG] Enhanced flattened parsing extracted: {data}")
     return data
 
-def find_associated_value(cell_map, row_idx, cell_idx, max_cols, max_rows):
-    """Find numeric value associated with a medical field using multiple search strategies"""
+def find_associated_value(valores, row_idx, cell_idx, max_cols, max_rows):
+    """Find numeric value associated with a medical field using multiple search strategies.
+    valores tiene el valor numérico de cada celda que lo contiene, por (fila, columna)."""
     
     # Strategy 1: Check immediate right cell
-    if (row_idx, cell_idx + 1) in cell_map:
-        right_text = cell_map[(row_idx, cell_idx + 1)]
-        if is_numeric_value(right_text):
-            return extract_numeric_value(right_text)
+    if (row_idx, cell_idx + 1) in valores:
+        return valores[(row_idx, cell_idx + 1)]
     
     # Strategy 2: Check same row, further right cells
     for check_col in range(cell_idx + 2, min(cell_idx + 4, max_cols)):
-        if (row_idx, check_col) in cell_map:
-            check_text = cell_map[(row_idx, check_col)]
-            if is_numeric_value(check_text):
-                return extract_numeric_value(check_text)
+        if (row_idx, check_col) in valores:
+            return valores[(row_idx, check_col)]
     
     # Strategy 3: Check next row, same column and nearby
     for check_row in range(row_idx + 1, min(row_idx + 3, max_rows)):
         for check_col in range(max(0, cell_idx - 1), min(cell_idx + 3, max_cols)):
-            if (check_row, check_col) in cell_map:
-                check_text = cell_map[(check_row, check_col)]
-                if is_numeric_value(check_text):
-                    return extract_numeric_value(check_text)
+            if (check_row, check_col) in valores:
+                return valores[(check_row, check_col)]
     
     return None
 
-def find_associated_unit(cell_map, row_idx, cell_idx, max_cols, max_rows):
-    """Find unit associated with a medical field"""
-    units = ['mm', 'cm', 'ml', 'g', 'mmHg', 'm²', 'cm²', 'cm/s', 'ml/s', 'ml/m²', 'cm²/m²', 'g/m²', 'ms', '%']
+def find_associated_unit(unidades, row_idx, cell_idx, max_cols, max_rows):
+    """Find unit associated with a medical field.
+    unidades tiene la primera unidad de FLAT_UNITS contenida en cada celda, por (fila, columna)."""
     
     # Search in nearby cells for units
     for check_row in range(max(0, row_idx - 1), min(row_idx + 3, max_rows)):
         for check_col in range(max(0, cell_idx - 1), min(cell_idx + 4, max_cols)):
-            if (check_row, check_col) in cell_map:
-                check_text = cell_map[(check_row, check_col)]
-                for unit in units:
-                    if unit in check_text:
-                        return unit
+            if (check_row, check_col) in unidades:
+                return unidades[(check_row, check_col)]
     return None
 
-def find_standalone_numeric_values(cell_map, max_rows):
-    """Find all numeric values in the table that might be measurements"""
+def find_standalone_numeric_values(cell_map, max_rows, valores=None):
+    """Find all numeric values in the table that might be measurements.
+    valores, si se pasa, son los valores numéricos ya calculados por celda."""
     standalone_values = {}
     
     for (row_idx, cell_idx), text in cell_map.items():
-        if is_numeric_value(text) and not any(char.isalpha() for char in text if char not in '.,'):
+        if valores is not None:
+            if (row_idx, cell_idx) not in valores:
+                continue
+        elif not is_numeric_value(text):
+            continue
+        if not any(char.isalpha() for char in text if char not in '.,'):
             # This is a pure numeric value
-            numeric_val = extract_numeric_value(text)
+            numeric_val = valores[(row_idx, cell_idx)] if valores is not None else extract_numeric_value(text)
             if numeric_val and float(numeric_val) > 0:  # Positive meaningful values
                 standalone_values[(row_idx, cell_idx)] = numeric_val
     
@@ -314,8 +303,7 @@ def extract_numeric_value(text):
     if not text:
         return None
     # Extract numbers with decimals
-    import re
-    match = re.search(r'\d+(?:[.,]\d+)?', text.replace(',', '.'))
+    match = NUMERO_RE.search(text.replace(',', '.'))
     if match:
         return match.group()
     return None
@@ -354,20 +342,23 @@ def parse_nested_measurements(table, gender):
                                 values.append(value)
                                 data[key+subkey]=values
     
-    data=update_dictionary(data) 
-    data=dic_cleaning(data)
-    data=convert_to_int(data)
-    data=conv_vel_a_m(data)
-    data['Gender']=gender
-    data=text_mass_hypertrophy(data)
-    data=text_diam_LV(data)
-    data=text_atrium(data)
-    data=remove_signs(data) #tiene que ir ultimo porque las funciones de interpretaci'on usan el dict como se ve en el word del equpo.
-    return data
+    # update_dictionary, dic_cleaning, convert_to_int, conv_vel_a_m, interpretaciones y remove_signs
+    # en una sola pasada de reglas (measurement_rules)
+    return procesar_mediciones(data, gender)
 
 
 
 
+def image_blobs(doc) -> list:
+    '''
+    Devuelve (target_ref, blob) de cada imagen del documento.
+    Si doc es un ParsedStudy usa su lista ya cacheada.
+    '''
+    if hasattr(doc, 'images'):
+        return doc.images
+    return [(rel.target_ref, rel.target_part.blob)
+            for rel in doc.part.rels.values() if 'image' in rel.reltype]
+
 def image_extractor(doc, template, tipo, image_width=Cm(8), image_height=Cm(5.36)) -> dict:
     '''
     Extrae las imágenes del reporte docx del dispositivo Vinno y devuelve un diccionario con objetos InlineImage.
@@ -379,43 +370,25 @@ def image_extractor(doc, template, tipo, image_width=Cm(8), image_height=Cm(5.36
     '''
     image_dict = {}
 
-    # Extraer imágenes
-    for rel in doc.part.rels:
-        rel_obj = doc.part.rels[rel]
-        if 'image' in rel_obj.reltype:
-            image_data = rel_obj.target_part.blob
-            image = Image.open(BytesIO(image_data))
-            compressed_image = BytesIO()
-
-            # Extraer el número de imagen
-            target = rel_obj.target_ref.split('.')[0].replace(r'media/', '')
-            image_number = int(target.replace('image', ''))
-
-            # Si es 'stress' y la imagen es 1 o 2, se manejan de manera diferente
-            if tipo == 'stress' and image_number in [1, 2]:
-                compressed_image = BytesIO(image_data)  # Mantener PNG sin convertir
-                compressed_image.seek(0)
-                # Definir tamaños específicos para las primeras dos imágenes
-                if image_number == 1:
-                    image_dict[target] = InlineImage(template,
-                                                     compressed_image,
-                                                     width=Cm(16.23), height=Cm(8.22))
-                else:
-                    image_dict[target] = InlineImage(template,
-                                                     compressed_image,
-                                                     width=Cm(16.23), height=Cm(6.39))
-            else:
-                # Si no es 'stress' o es una imagen normal, convertir a JPEG si es necesario
-                if image.format != 'JPEG':
-                    image = image.convert("RGB")  # Convertir a RGB para JPEG
-                image.save(compressed_image, format='JPEG', quality=85)  # Guardar como JPEG
-                compressed_image.seek(0)
-
-                # Asignar tamaño predeterminado
-                image_dict[target] = InlineImage(template,
-                                                 compressed_image,
-                                                 width=image_width,
-                                                 height=image_height)
+    # Extraer imágenes: los mapas polares del stress (1 y 2) se mantienen en PNG sin convertir
+    imagenes = []
+    for target_ref, image_data in image_blobs(doc):
+        # Extraer el número de imagen
+        target = target_ref.split('.')[0].replace(r'media/', '')
+        image_number = int(target.replace('image', ''))
+        if tipo == 'stress' and image_number in [1, 2]:
+            # Definir tamaños específicos para las primeras dos imágenes
+            tamano = (Cm(16.23), Cm(8.22)) if image_number == 1 else (Cm(16.23), Cm(6.39))
+            imagenes.append((target, image_data, True, tamano))
+        else:
+            # Asignar tamaño predeterminado
+            imagenes.append((target, image_data, False, (image_width, image_height)))
+
+    # JPEG directos sin recodificar, el resto en paralelo (y reducido a IMAGE_TARGET_DPI)
+    preparadas = preparar_imagenes([(image_data, conservar, tamano) for _, image_data, conservar, tamano in imagenes])
+
+    for (target, _, _, (width, height)), compressed_image in zip(imagenes, preparadas):
+        image_dict[target] = InlineImage(template, compressed_image, width=width, height=height)
 
     # Ordenar las imágenes por su número
     key = sorted(image_dict.keys(), key=lambda image_name: int(image_name.replace('image', '')))
@@ -429,7 +402,7 @@ def is_numeric_value(text):
     if not text:
         return False
     # Remove common non-numeric characters and check if what remains is numeric
-    cleaned = re.sub(r'[^\d.,]', '', text.strip())
+    cleaned = NO_NUMERICO_RE.sub('', text.strip())
     if not cleaned:
         return False
     try:
@@ -509,12 +482,12 @@ def delta_motility(dic: dict)-> dict:
 # In[ ]:
 
 
-def process_pdf_images(image_paths, template, tipo, image_width=Cm(8), image_height=Cm(5.36)) -> dict:
+def process_pdf_images(images, template, tipo, image_width=Cm(8), image_height=Cm(5.36)) -> dict:
     """
     Processes images extracted from PDF for use with DocxTemplate.
 
     Args:
-        image_paths: Dictionary of image paths from PDF extraction
+        images: Dictionary of image name -> image bytes (or memoryview) from PDF extraction
         template: DocxTemplate instance
         tipo: Template type
         image_width: Default image width
@@ -525,41 +498,33 @@ def process_pdf_images(image_paths, template, tipo, image_width=Cm(8), image_hei
     """
     image_dict = {}
 
-    for name, path in image_paths.items():
-        if os.path.exists(path):
-            with open(path, 'rb') as f:
-                image_data = f.read()
-
-            image = Image.open(BytesIO(image_data))
-            compressed_image = BytesIO()
-
-            # Extract image number from name if possible
-            image_number = 0
-            match = re.search(r'img_(\d+)', name)
-            if match:
-                image_number = int(match.group(1))
-
-            # Handle stress template special cases
-            if tipo == 'stress' and image_number in [1, 2]:
-                compressed_image = BytesIO(image_data)
-                compressed_image.seek(0)
-                if image_number == 1:
-                    image_dict[f"image{image_number}"] = InlineImage(template,
-                                                     compressed_image,
-                                                     width=Cm(16.23), height=Cm(8.22))
-                else:
-                    image_dict[f"image{image_number}"] = InlineImage(template,
-                                                     compressed_image,
-                                                     width=Cm(16.23), height=Cm(6.39))
-            else:
-                # Convert to JPEG if needed
-                if image.format != 'JPEG':
-                    image = image.convert("RGB")
-                image.save(compressed_image, format='JPEG', quality=85)
-                compressed_image.seek(0)
-
-                image_dict[f"image{image_number if image_number else len(image_dict)+1}"] = InlineImage(
-                    template, compressed_image, width=image_width, height=image_height)
+    imagenes = []
+    for name, image_data in images.items():
+        if not image_data:
+            continue
+
+        # Extract image number from name if possible
+        image_number = 0
+        match = re.search(r'img_(\d+)', name)
+        if match:
+            image_number = int(match.group(1))
+
+        # Handle stress template special cases: keep the polar maps as PNG
+        if tipo == 'stress' and image_number in [1, 2]:
+            tamano = (Cm(16.23), Cm(8.22)) if image_number == 1 else (Cm(16.23), Cm(6.39))
+            imagenes.append((image_number, image_data, True, tamano))
+        else:
+            imagenes.append((image_number, image_data, False, (image_width, image_height)))
+
+    # JPEG passthrough and parallel transcoding of the rest (downsampled to IMAGE_TARGET_DPI)
+    preparadas = preparar_imagenes([(image_data, conservar, tamano) for _, image_data, conservar, tamano in imagenes])
+
+    for (image_number, _, conservar, (width, height)), compressed_image in zip(imagenes, preparadas):
+        if conservar:
+            image_dict[f"image{image_number}"] = InlineImage(template, compressed_image, width=width, height=height)
+        else:
+            image_dict[f"image{image_number if image_number else len(image_dict)+1}"] = InlineImage(
+                template, compressed_image, width=width, height=height)
 
     # Format for template
     image_dict = {'image': [{'key': k, 'image': v} for k, v in image_dict.items()]}
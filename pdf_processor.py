@@ -3,9 +3,81 @@ from pathlib import Path
 import re
 from PIL import Image
 from io import BytesIO
-from typing import Dict, List, Optional, Any
-import tempfile
+from typing import Dict, List, Optional, Any, Tuple
 import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from docx.shared import Cm
+
+from image_pipeline import IMAGE_TARGET_DPI, pixeles_objetivo, tamano_reducido
+from metrics import marcar_degradado
+
+try:
+    import pypdfium2 as pdfium
+    import pypdfium2.raw as pdfium_c
+except ImportError:
+    pdfium = None
+
+# Backends para analyze_pdf_content: pdfium extrae el texto mucho más rápido que pdfplumber,
+# que queda solo para detectar tablas
+BACKENDS_PDF = ('pdfium', 'pdfplumber')
+PDF_BACKEND = os.getenv('PDF_BACKEND', 'pdfium')
+# Procesos para analizar las páginas de un PDF en paralelo, y páginas mínimas para usarlos
+PDF_PAGE_WORKERS = max(1, int(os.getenv('PDF_PAGE_WORKERS', min(4, os.cpu_count() or 1))))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', 16))
+# 1 busca tablas en todas las páginas, sin triage por texto (para depurar)
+PDF_FULL_TABLE_SCAN = os.getenv('PDF_FULL_TABLE_SCAN', '0') == '1'
+
+# Mayor tamaño al que se inserta una imagen del PDF (mapa polar del stress, ver process_pdf_images):
+# con IMAGE_TARGET_DPI las imágenes decodificadas no se guardan más grandes que eso
+TAMANO_MAXIMO_IMAGEN_PDF = (Cm(16.23), Cm(8.22))
+
+_page_pool: Optional[ProcessPoolExecutor] = None
+_page_pool_lock = threading.Lock()
+
+# Enhanced field mapping with medical term synonyms
+CAMPOS_MEDICIONES_PDF = {
+    'LVEDD': ['LVEDD', 'DDVI', 'LVIDd', 'LVEDd', 'diámetro diastólico'],
+    'LVESD': ['LVESD', 'DSVI', 'LVIDs', 'LVESd', 'diámetro sistólico'],
+    'LVEF': ['LVEF', 'EF', 'FEVI', 'fracción de eyección'],
+    'PWd': ['PWd', 'LVPWd', 'Posterior Wall', 'pared posterior'],
+    'IVSd': ['IVSd', 'IVSD', 'Septum', 'septo', 'septum diastolic'],
+    'LA': ['LA', 'Left Atrium', 'AI', 'aurícula izquierda'],
+    'AOD': ['AOD', 'Ao', 'Aorta', 'aortic root', 'raíz aórtica'],
+    'EDV': ['EDV', 'LVEDV', 'volumen diastólico'],
+    'ESV': ['ESV', 'LVESV', 'volumen sistólico'],
+    'SV': ['SV', 'stroke volume', 'volumen latido'],
+    'FS': ['FS', 'fractional shortening', 'fracción acortamiento'],
+    'E/A': ['E/A', 'E/A ratio', 'relación E/A'],
+    'TAPSE': ['TAPSE'],
+    'FAC': ['FAC', 'fractional area change'],
+    'PAPS': ['PAPS', 'PAP', 'presión pulmonar']
+}
+
+# Segment names to look for
+SEGMENTOS_WMS = [
+    'basal anterior', 'basal anteroseptal', 'basal inferoseptal',
+    'basal inferior', 'basal inferolateral', 'basal anterolateral',
+    'mid anterior', 'mid anteroseptal', 'mid inferoseptal',
+    'mid inferior', 'mid inferolateral', 'mid anterolateral',
+    'apical anterior', 'apical septal', 'apical inferior', 'apical lateral',
+    'apex'
+]
+
+# Tabla que vale la pena buscar en una página: la que tiene alguna medición o la motilidad.
+# Las abreviaturas cortas (LA, EF, Ao...) se buscan con mayúsculas exactas y las demás sin
+# distinguir mayúsculas, siempre como palabras enteras: en una página narrativa en castellano
+# "la" o "ao" aparecen en cualquier lado
+_TERMINOS_TABLA = [patron for patrones in CAMPOS_MEDICIONES_PDF.values() for patron in patrones]
+_TERMINOS_TABLA += SEGMENTOS_WMS + ['WMS', 'wall motion']
+_MARCADORES_TABLA_RE = re.compile(
+    r'(?<!\w)(?:' + '|'.join(re.escape(t) for t in _TERMINOS_TABLA if len(t) > 3) + r')(?!\w)', re.IGNORECASE)
+_ABREVIATURAS_TABLA_RE = re.compile(
+    r'(?<!\w)(?:' + '|'.join(re.escape(t) for t in _TERMINOS_TABLA if len(t) <= 3) + r')(?!\w)')
 
 def find_pdf_files(folder_path: str) -> List[Path]:
     """
@@ -19,45 +91,361 @@ def find_pdf_files(folder_path: str) -> List[Path]:
     """
     return list(Path(folder_path).glob("*.pdf"))
 
-def analyze_pdf_content(pdf_path: str) -> List[Dict[str, Any]]:
+def _pagina_vacia(page_number: int) -> Dict[str, Any]:
+    return {
+        "page_number": page_number,
+        "text_lines": [],
+        "tables": [],
+        "has_tables": False,
+        "has_images": False
+    }
+
+def _imagenes_de_pagina(page) -> Dict[str, bytes]:
+    extracted_images = {}
+    for i, img in enumerate(page.images):
+        image_name = f"page_{page.page_number}_img_{i+1}"
+        if hasattr(img, 'stream') and hasattr(img['stream'], 'get_data'):
+            extracted_images[image_name] = img['stream'].get_data()
+        elif 'data' in img:
+            extracted_images[image_name] = img['data']
+    return extracted_images
+
+def _imagenes_de_pagina_pdfium(page, page_number: int) -> Dict[str, bytes]:
     """
-    Analyzes the content of a PDF file, extracting text and tables from each page.
+    Images of a pdfium page, named like _imagenes_de_pagina. JPEG (DCTDecode) streams come
+    out as they are stored; anything else is decoded by pdfium and saved as PNG, scaled down
+    to the largest placed size at IMAGE_TARGET_DPI.
+    """
+    extracted_images = {}
+    maximo = pixeles_objetivo(TAMANO_MAXIMO_IMAGEN_PDF, IMAGE_TARGET_DPI)
+    for i, img in enumerate(page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_IMAGE])):
+        image_name = f"page_{page_number}_img_{i+1}"
+        try:
+            if img.get_filters(skip_simple=True) == ['DCTDecode']:
+                # ASCII85/Flate alrededor del JPEG se decodifican; el JPEG queda intacto
+                extracted_images[image_name] = bytes(img.get_data(decode_simple=True))
+                continue
+            bitmap = img.get_bitmap(render=False)
+            image = bitmap.to_pil()
+            reducido = tamano_reducido(image.size, maximo)
+            if reducido is not None:
+                image = image.resize(reducido, Image.LANCZOS)
+            salida = BytesIO()
+            image.save(salida, format='PNG')
+            extracted_images[image_name] = salida.getvalue()
+        except Exception as e:
+            print(f"[WARNING] Could not extract image {image_name}: {e}")
+    return extracted_images
 
-    Args:
-        pdf_path: The path to the PDF file.
+def _imagenes_pdfium(pdf_path: str, page_numbers) -> Dict[str, bytes]:
+    extracted_images = {}
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        for page_number in page_numbers:
+            page = pdf[page_number - 1]
+            extracted_images.update(_imagenes_de_pagina_pdfium(page, page_number))
+            page.close()
+    finally:
+        pdf.close()
+    return extracted_images
 
-    Returns:
-        List of dictionaries, each representing a page with extracted content.
+def necesita_tablas(text_lines: List[str]) -> bool:
+    """
+    Text-first triage: whether a page's text mentions a measurement or the wall motion
+    scores, i.e. whether running table detection on it can yield anything we extract.
     """
+    texto = "\n".join(text_lines)
+    return bool(_ABREVIATURAS_TABLA_RE.search(texto) or _MARCADORES_TABLA_RE.search(texto))
+
+def _triaje_vacio() -> Dict[str, Any]:
+    # Páginas sin extract_tables, páginas con extract_tables y el tiempo que llevaron estas
+    return {"saltadas": [], "escaneadas": 0, "segundos": 0.0}
+
+def _extraer_tablas(page, page_data: Dict[str, Any], triaje: Dict[str, Any]) -> None:
+    inicio = time.perf_counter()
+    tables = page.extract_tables()
+    triaje["segundos"] += time.perf_counter() - inicio
+    triaje["escaneadas"] += 1
+    if tables:
+        page_data["has_tables"] = True
+        page_data["tables"] = tables
+
+def _analizar_rango_pdfplumber(pdf_path: str, inicio: int, fin: int) -> Tuple[List[Dict[str, Any]], Dict[str, bytes], Dict[str, Any]]:
     all_pages_content = []
+    extracted_images = {}
+    triaje = _triaje_vacio()
 
-    with pdfplumber.open(pdf_path) as pdf:
+    with pdfplumber.open(pdf_path, pages=list(range(inicio + 1, fin + 1))) as pdf:
         for page in pdf.pages:
-            page_data = {
-                "page_number": page.page_number,
-                "text_lines": [],
-                "tables": [],
-                "has_tables": False,
-                "has_images": False
-            }
+            page_data = _pagina_vacia(page.page_number)
 
             # Extract text
-            if page.extract_text():
-                page_data["text_lines"] = page.extract_text().splitlines()
+            text = page.extract_text()
+            if text:
+                page_data["text_lines"] = text.splitlines()
 
-            # Extract tables
-            tables = page.extract_tables()
-            if tables:
-                page_data["has_tables"] = True
-                page_data["tables"] = tables
+            # Extract tables, only where the text says there may be one worth having
+            if PDF_FULL_TABLE_SCAN or necesita_tablas(page_data["text_lines"]):
+                _extraer_tablas(page, page_data, triaje)
+            else:
+                triaje["saltadas"].append(page.page_number)
 
             # Check for images
             if page.images:
                 page_data["has_images"] = True
+                if pdfium is None:
+                    extracted_images.update(_imagenes_de_pagina(page))
+
+            all_pages_content.append(page_data)
+
+    # pdfium decodes the image streams that pdfplumber only hands over raw
+    if pdfium is not None:
+        extracted_images = _imagenes_pdfium(
+            pdf_path, [page_data["page_number"] for page_data in all_pages_content if page_data["has_images"]])
+
+    return all_pages_content, extracted_images, triaje
+
+def _analizar_rango_pdfium(pdf_path: str, inicio: int, fin: int) -> Tuple[List[Dict[str, Any]], Dict[str, bytes], Dict[str, Any]]:
+    """
+    Text and images with pdfium; tables still come from pdfplumber, but only for
+    pages that have vector paths and pass the text triage. pdfplumber's table finder builds
+    cells out of ruling lines and rects, so a page without any path object can never yield
+    a table.
+    """
+    all_pages_content = []
+    extracted_images = {}
+    pages_with_tables = set()
+    triaje = _triaje_vacio()
+
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        for index in range(inicio, fin):
+            page = pdf[index]
+            page_data = _pagina_vacia(index + 1)
+
+            textpage = page.get_textpage()
+            page_data["text_lines"] = textpage.get_text_bounded().splitlines()
+            textpage.close()
+
+            tipos = {obj.type for obj in page.get_objects()}
+            if pdfium_c.FPDF_PAGEOBJ_IMAGE in tipos:
+                page_data["has_images"] = True
+                extracted_images.update(_imagenes_de_pagina_pdfium(page, index + 1))
+            if PDF_FULL_TABLE_SCAN or (pdfium_c.FPDF_PAGEOBJ_PATH in tipos and necesita_tablas(page_data["text_lines"])):
+                pages_with_tables.add(index + 1)
+            else:
+                triaje["saltadas"].append(index + 1)
 
+            page.close()
             all_pages_content.append(page_data)
+    finally:
+        pdf.close()
+
+    if pages_with_tables:
+        with pdfplumber.open(pdf_path, pages=sorted(pages_with_tables)) as plumber:
+            for page in plumber.pages:
+                _extraer_tablas(page, all_pages_content[page.page_number - 1 - inicio], triaje)
 
-    return all_pages_content
+    return all_pages_content, extracted_images, triaje
+
+def _analizar_rango(pdf_path: str, inicio: int, fin: int, backend: str) -> Tuple[List[Dict[str, Any]], Dict[str, bytes], Dict[str, Any]]:
+    """
+    Pages [inicio, fin) of the PDF (0-based), opened by this call: the unit of work of the page pool.
+    """
+    if backend == 'pdfium' and pdfium is not None:
+        return _analizar_rango_pdfium(pdf_path, inicio, fin)
+    return _analizar_rango_pdfplumber(pdf_path, inicio, fin)
+
+def _rangos_de_paginas(paginas: List[int]) -> str:
+    # [2, 3, 4, 7] -> "2-4, 7"
+    rangos = []
+    for pagina in sorted(paginas):
+        if rangos and pagina == rangos[-1][1] + 1:
+            rangos[-1][1] = pagina
+        else:
+            rangos.append([pagina, pagina])
+    return ", ".join(f"{a}-{b}" if a != b else str(a) for a, b in rangos)
+
+def _registrar_triaje(pdf_path: str, triaje: Dict[str, Any]) -> None:
+    saltadas = triaje["saltadas"]
+    if not saltadas:
+        return
+    if triaje["escaneadas"]:
+        # Las páginas con tablas son las más caras: es una cota superior
+        por_pagina = triaje["segundos"] / triaje["escaneadas"]
+        ahorro = f"est. up to {por_pagina * len(saltadas) * 1000:.0f} ms saved at {por_pagina * 1000:.1f} ms/scanned page"
+    else:
+        ahorro = "no page scanned to estimate the time saved"
+    print(f"[INFO] Table detection skipped on {len(saltadas)} of {len(saltadas) + triaje['escaneadas']} pages "
+          f"of {os.path.basename(pdf_path)} ({ahorro}): pages {_rangos_de_paginas(saltadas)}")
+
+def _contar_paginas(pdf_path: str) -> int:
+    if pdfium is not None:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+def _get_page_pool() -> ProcessPoolExecutor:
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            # spawn, igual que el pool de archivos: no hereda hilos ni locks del proceso que lo crea
+            _page_pool = ProcessPoolExecutor(max_workers=PDF_PAGE_WORKERS,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return _page_pool
+
+def _descartar_page_pool() -> None:
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is not None:
+            _page_pool.shutdown(wait=False, cancel_futures=True)
+            _page_pool = None
+
+def analizar_pdf(pdf_path: str, backend: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Dict[str, bytes]]:
+    """
+    Analyzes the pages and extracts the images of a PDF in a single pass.
+
+    PDFs with at least PDF_PARALLEL_MIN_PAGES pages are split into PDF_PAGE_WORKERS page
+    ranges, each analyzed in its own process; the results are merged in page order.
+
+    Args:
+        pdf_path: The path to the PDF file.
+        backend: 'pdfium' or 'pdfplumber' (see BACKENDS_PDF); None uses PDF_BACKEND.
+
+    Returns:
+        Tuple of (pages as in analyze_pdf_content, images as in extract_images_from_pdf).
+    """
+    backend = backend or PDF_BACKEND
+    if backend not in BACKENDS_PDF:
+        raise ValueError(f"Backend de PDF desconocido: {backend}. Opciones: {', '.join(BACKENDS_PDF)}")
+
+    total = _contar_paginas(pdf_path)
+    if PDF_PAGE_WORKERS < 2 or total < max(2, PDF_PARALLEL_MIN_PAGES):
+        all_pages_content, extracted_images, triaje = _analizar_rango(pdf_path, 0, total, backend)
+        _registrar_triaje(pdf_path, triaje)
+        return all_pages_content, extracted_images
+
+    paso = -(-total // PDF_PAGE_WORKERS)
+    rangos = [(inicio, min(inicio + paso, total)) for inicio in range(0, total, paso)]
+    try:
+        pool = _get_page_pool()
+        futures = [pool.submit(_analizar_rango, pdf_path, inicio, fin, backend) for inicio, fin in rangos]
+        partes = [future.result() for future in futures]
+    except BrokenProcessPool as e:
+        print(f"[WARNING] PDF page pool failed, analyzing {pdf_path} sequentially: {e}")
+        _descartar_page_pool()
+        partes = [_analizar_rango(pdf_path, 0, total, backend)]
+
+    all_pages_content = []
+    extracted_images = {}
+    triaje = _triaje_vacio()
+    for paginas, imagenes, triaje_rango in partes:
+        all_pages_content.extend(paginas)
+        extracted_images.update(imagenes)
+        triaje["saltadas"].extend(triaje_rango["saltadas"])
+        triaje["escaneadas"] += triaje_rango["escaneadas"]
+        triaje["segundos"] += triaje_rango["segundos"]
+    _registrar_triaje(pdf_path, triaje)
+    return all_pages_content, extracted_images
+
+def analyze_pdf_content(pdf_path: str, backend: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Analyzes the content of a PDF file, extracting text and tables from each page.
+
+    Args:
+        pdf_path: The path to the PDF file.
+        backend: 'pdfium' or 'pdfplumber' (see BACKENDS_PDF); None uses PDF_BACKEND.
+
+    Returns:
+        List of dictionaries, each representing a page with extracted content.
+    """
+    return analizar_pdf(pdf_path, backend)[0]
+
+class PaginasPdf:
+    """
+    Lazy, cached per-page text of a PDF.
+
+    Pages are read only when iteration reaches them, so a search that finds what it needs on
+    the first pages never opens the rest. Each page's lines are read once and reused by later
+    stages; sembrar() loads them from a full analysis that already ran.
+    """
+
+    def __init__(self, pdf_path: str, backend: Optional[str] = None):
+        self.pdf_path = pdf_path
+        self.backend = backend or PDF_BACKEND
+        self._lineas: Dict[int, List[str]] = {}
+        self._total: Optional[int] = None
+        self._pdf = None
+
+    def __len__(self) -> int:
+        if self._total is None:
+            self._total = _contar_paginas(self.pdf_path)
+        return self._total
+
+    def _abrir(self):
+        if self._pdf is None:
+            if self.backend == 'pdfium' and pdfium is not None:
+                self._pdf = pdfium.PdfDocument(self.pdf_path)
+            else:
+                self._pdf = pdfplumber.open(self.pdf_path)
+        return self._pdf
+
+    def lineas(self, index: int) -> List[str]:
+        """
+        Text lines of page index (0-based), read on first access.
+        """
+        if index not in self._lineas:
+            pdf = self._abrir()
+            if isinstance(pdf, pdfplumber.PDF):
+                self._lineas[index] = (pdf.pages[index].extract_text() or '').splitlines()
+            else:
+                page = pdf[index]
+                textpage = page.get_textpage()
+                self._lineas[index] = textpage.get_text_bounded().splitlines()
+                textpage.close()
+                page.close()
+            if len(self._lineas) == len(self):
+                self.cerrar()
+        return self._lineas[index]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.lineas(index)
+
+    def buscar(self, marcadores, max_paginas: int = 0) -> Optional[int]:
+        """
+        Number of the first page whose text contains any of marcadores (case-insensitive),
+        reading pages only up to that one; None if none does. max_paginas > 0 limits the
+        search to the first pages.
+        """
+        marcadores = [marcador.upper() for marcador in marcadores]
+        cola = max(len(marcador) for marcador in marcadores)
+        anterior = ''
+        paginas = min(len(self), max_paginas) if max_paginas else len(self)
+        for index in range(paginas):
+            texto = " ".join(self.lineas(index)).upper()
+            # El final de la página anterior cubre un marcador partido entre dos páginas
+            unido = f"{anterior} {texto}" if anterior else texto
+            if any(marcador in unido for marcador in marcadores):
+                return index + 1
+            anterior = unido[-cola:]
+        return None
+
+    def sembrar(self, pdf_content: List[Dict[str, Any]]) -> None:
+        for page in pdf_content:
+            self._lineas[page["page_number"] - 1] = page.get("text_lines", [])
+        self._total = self._total or len(pdf_content)
+        if len(self._lineas) >= len(self):
+            self.cerrar()
+
+    def cerrar(self) -> None:
+        if self._pdf is not None:
+            self._pdf.close()
+            self._pdf = None
 
 def extract_images_from_pdf(pdf_path: str) -> Dict[str, bytes]:
     """
@@ -69,17 +457,14 @@ def extract_images_from_pdf(pdf_path: str) -> Dict[str, bytes]:
     Returns:
         Dictionary where keys are image names and values are image data.
     """
+    if pdfium is not None:
+        return _imagenes_pdfium(pdf_path, range(1, _contar_paginas(pdf_path) + 1))
+
     extracted_images = {}
 
     with pdfplumber.open(pdf_path) as pdf:
         for page in pdf.pages:
-            images = page.images
-            for i, img in enumerate(images):
-                image_name = f"page_{page.page_number}_img_{i+1}"
-                if hasattr(img, 'stream') and hasattr(img['stream'], 'get_data'):
-                    extracted_images[image_name] = img['stream'].get_data()
-                elif 'data' in img:
-                    extracted_images[image_name] = img['data']
+            extracted_images.update(_imagenes_de_pagina(page))
 
     return extracted_images
 
@@ -117,28 +502,11 @@ def extract_measurements_from_pdf(pdf_content: List[Dict[str, Any]], use_gemini:
 
         except Exception as e:
             print(f"[INFO] Gemini extraction failed, falling back to pattern matching: {e}")
+            marcar_degradado(f"llm: {e}")
 
     # Fallback to original pattern matching
     measurements = {}
 
-    # Enhanced field mapping with medical term synonyms
-    field_mapping = {
-        'LVEDD': ['LVEDD', 'DDVI', 'LVIDd', 'LVEDd', 'diámetro diastólico'],
-        'LVESD': ['LVESD', 'DSVI', 'LVIDs', 'LVESd', 'diámetro sistólico'],
-        'LVEF': ['LVEF', 'EF', 'FEVI', 'fracción de eyección'],
-        'PWd': ['PWd', 'LVPWd', 'Posterior Wall', 'pared posterior'],
-        'IVSd': ['IVSd', 'IVSD', 'Septum', 'septo', 'septum diastolic'],
-        'LA': ['LA', 'Left Atrium', 'AI', 'aurícula izquierda'],
-        'AOD': ['AOD', 'Ao', 'Aorta', 'aortic root', 'raíz aórtica'],
-        'EDV': ['EDV', 'LVEDV', 'volumen diastólico'],
-        'ESV': ['ESV', 'LVESV', 'volumen sistólico'],
-        'SV': ['SV', 'stroke volume', 'volumen latido'],
-        'FS': ['FS', 'fractional shortening', 'fracción acortamiento'],
-        'E/A': ['E/A', 'E/A ratio', 'relación E/A'],
-        'TAPSE': ['TAPSE'],
-        'FAC': ['FAC', 'fractional area change'],
-        'PAPS': ['PAPS', 'PAP', 'presión pulmonar']
-    }
 
     # Units to look for
     units = ['mm', 'cm', 'ml', 'g', 'ms', 'mmHg', 'cm²', 'cm/s', 'ml/s', 'm²', 'ml/m²', 'cm²/m²', 'g/m²', '%']
@@ -163,8 +531,10 @@ def extract_measurements_from_pdf(pdf_content: List[Dict[str, Any]], use_gemini:
 
         line_lower = line.lower()
 
-        # Check each measurement pattern
-        for key, patterns in field_mapping.items():
+        # Check each measurement pattern; only the first value found for each key is kept
+        for key, patterns in CAMPOS_MEDICIONES_PDF.items():
+            if key in measurements:
+                continue
             for pattern in patterns:
                 if pattern.lower() in line_lower:
                     # Extract numeric value following the pattern
@@ -181,6 +551,10 @@ def extract_measurements_from_pdf(pdf_content: List[Dict[str, Any]], use_gemini:
                             }
                         break
 
+        # Every field already has its value: the remaining lines can't change anything
+        if len(measurements) == len(CAMPOS_MEDICIONES_PDF):
+            break
+
     return measurements
 
 def extract_wall_motion_scores(pdf_content: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
@@ -195,15 +569,6 @@ def extract_wall_motion_scores(pdf_content: List[Dict[str, Any]]) -> Dict[str, L
     """
     motility_data = {}
 
-    # Segment names to look for
-    segments = [
-        'basal anterior', 'basal anteroseptal', 'basal inferoseptal',
-        'basal inferior', 'basal inferolateral', 'basal anterolateral',
-        'mid anterior', 'mid anteroseptal', 'mid inferoseptal',
-        'mid inferior', 'mid inferolateral', 'mid anterolateral',
-        'apical anterior', 'apical septal', 'apical inferior', 'apical lateral',
-        'apex'
-    ]
 
     # Process all tables looking for WMS data
     for page in pdf_content:
@@ -217,7 +582,7 @@ def extract_wall_motion_scores(pdf_content: List[Dict[str, Any]]) -> Dict[str, L
                     row_text = ' '.join(str(cell) if cell else '' for cell in row).lower()
 
                     # Check if this row contains segment data
-                    for segment in segments:
+                    for segment in SEGMENTOS_WMS:
                         if segment in row_text:
                             # Try to extract scores (baseline, peak, recovery)
                             scores = []
@@ -283,42 +648,38 @@ def extract_patient_info_from_pdf(pdf_content: List[Dict[str, Any]]) -> Dict[str
 
     return patient_info
 
-def pdf_to_docx_data(pdf_path: str) -> Dict[str, Any]:
+def pdf_to_docx_data(pdf_path: str, pdf_content: Optional[List[Dict[str, Any]]] = None,
+                     images: Optional[Dict[str, bytes]] = None) -> Dict[str, Any]:
     """
     Converts PDF data into a format compatible with existing DOCX processing.
 
     Args:
         pdf_path: Path to the PDF file.
+        pdf_content: Already analyzed pages (e.g. from a ParsedStudy), to avoid re-parsing.
+        images: Already extracted images, to avoid opening the PDF again.
 
     Returns:
         Dictionary with extracted data ready for template processing.
     """
     # Analyze PDF content
-    pdf_content = analyze_pdf_content(pdf_path)
+    if pdf_content is None:
+        pdf_content = analyze_pdf_content(pdf_path)
 
     # Extract different types of data
     patient_info = extract_patient_info_from_pdf(pdf_content)
     measurements = extract_measurements_from_pdf(pdf_content)
     motility = extract_wall_motion_scores(pdf_content)
 
-    # Extract images and save them temporarily
-    images = extract_images_from_pdf(pdf_path)
-    image_paths = {}
-
-    if images:
-        temp_dir = tempfile.mkdtemp()
-        for name, data in images.items():
-            image_path = os.path.join(temp_dir, f"{name}.png")
-            with open(image_path, 'wb') as f:
-                f.write(data)
-            image_paths[name] = image_path
+    # Images stay in memory (name -> bytes) all the way to InlineImage
+    if images is None:
+        images = extract_images_from_pdf(pdf_path)
 
     # Combine all data
     combined_data = {
         'patient_info': patient_info,
         'measurements': measurements,
         'motility': motility,
-        'images': image_paths,
+        'images': dict(images),
         'source_type': 'pdf'
     }
 
@@ -8,38 +8,19 @@ import re
 from PIL import Image
 from io import BytesIO
 from typing import Dict, List, Optional, Any
-import tempfile
 import os
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-def extract_with_llm(text: str, use_gemini: bool = False) -> Dict[str, Any]:
-    """
-    Extract measurements using Gemini LLM if API key is available.
-    Falls back to pattern matching if not available.
-
-    Args:
-        text: Text content to analyze
-        use_gemini: Whether to use Gemini for extraction
+# After load_dotenv so the LLM_* settings can come from .env
+from llm_extraction import (ExtractorLLM, BackendStub, crear_cache, version_prompt,
+                            LLM_BACKEND, GEMINI_MODEL)
+from metrics import etapa, marcar_degradado
 
-    Returns:
-        Dictionary of extracted measurements
-    """
-
-    measurements = {}
-
-    # Check if Gemini API key is available and use_gemini is True
-    google_api_key = os.getenv('GOOGLE_API_KEY')
-
-    if use_gemini and google_api_key and google_api_key != 'your_gemini_api_key_here':
-        try:
-            # Only import if we're actually using it
-            import langextract as lx
-
-            # Define extraction prompt
-            prompt_description = """
+# Define extraction prompt
+PROMPT_DESCRIPTION = """
             Extract echocardiographic measurements and motility findings into structured entities.
 
             1. Extract all measurements with canonical_key (normalized name), value, and unit.
@@ -53,56 +34,121 @@ def extract_with_llm(text: str, use_gemini: bool = False) -> Dict[str, Any]:
                - LA = Left Atrium = AI
             """
 
-            # Define examples for structured extraction
-            examples = [
-                lx.data.ExampleData(
-                    text="DDVI 40 mm, DSVI 25 mm, EF 55 %, PWd 10 mm",
-                    extractions=[
-                        lx.data.Extraction(
-                            extraction_class="measurement",
-                            extraction_text="DDVI",
-                            attributes={"measurement_group": "LVEDD", "value": 40, "unit": "mm"}
-                        ),
-                        lx.data.Extraction(
-                            extraction_class="measurement",
-                            extraction_text="DSVI",
-                            attributes={"measurement_group": "LVESD", "value": 25, "unit": "mm"}
-                        ),
-                        lx.data.Extraction(
-                            extraction_class="measurement",
-                            extraction_text="EF",
-                            attributes={"measurement_group": "LVEF", "value": 55, "unit": "%"}
-                        ),
-                        lx.data.Extraction(
-                            extraction_class="measurement",
-                            extraction_text="PWd",
-                            attributes={"measurement_group": "PWd", "value": 10, "unit": "mm"}
-                        ),
-                    ]
-                )
+# Examples for structured extraction (converted to langextract objects on each call)
+EXAMPLE_TEXT = "DDVI 40 mm, DSVI 25 mm, EF 55 %, PWd 10 mm"
+EXAMPLE_EXTRACTIONS = [
+    ("DDVI", {"measurement_group": "LVEDD", "value": 40, "unit": "mm"}),
+    ("DSVI", {"measurement_group": "LVESD", "value": 25, "unit": "mm"}),
+    ("EF", {"measurement_group": "LVEF", "value": 55, "unit": "%"}),
+    ("PWd", {"measurement_group": "PWd", "value": 10, "unit": "mm"}),
+]
+
+_extractor_llm = None
+
+
+def _gemini_api_key() -> Optional[str]:
+    google_api_key = os.getenv('GOOGLE_API_KEY')
+    if google_api_key and google_api_key != 'your_gemini_api_key_here':
+        return google_api_key
+    return None
+
+
+def _extract_with_gemini(text: str) -> Dict[str, Any]:
+    """
+    Blocking call to Gemini through langextract. Returns {key: {"value", "unit"}}.
+    """
+    # Only import if we're actually using it
+    import langextract as lx
+
+    examples = [
+        lx.data.ExampleData(
+            text=EXAMPLE_TEXT,
+            extractions=[
+                lx.data.Extraction(extraction_class="measurement", extraction_text=extraction_text, attributes=attributes)
+                for extraction_text, attributes in EXAMPLE_EXTRACTIONS
             ]
+        )
+    ]
+
+    # Run extraction with Gemini
+    result = lx.extract(
+        text_or_documents=text,
+        prompt_description=PROMPT_DESCRIPTION,
+        examples=examples,
+        model_id=GEMINI_MODEL,
+        api_key=_gemini_api_key()
+    )
+
+    # Process results
+    measurements = {}
+    for extraction in result.extractions:
+        attrs = extraction.attributes or {}
+        if "measurement_group" in attrs:
+            key = attrs["measurement_group"]
+            measurements[key] = {
+                "value": attrs.get("value"),
+                "unit": attrs.get("unit")
+            }
+    return measurements
 
-            # Run extraction with Gemini
-            result = lx.extract(
-                text_or_documents=text,
-                prompt_description=prompt_description,
-                examples=examples,
-                model_id="gemini-2.5-pro",
-                api_key=google_api_key
-            )
-
-            # Process results
-            for extraction in result.extractions:
-                attrs = extraction.attributes or {}
-                if "measurement_group" in attrs:
-                    key = attrs["measurement_group"]
-                    measurements[key] = {
-                        "value": attrs.get("value"),
-                        "unit": attrs.get("unit")
-                    }
 
+def _version_prompt() -> str:
+    return version_prompt(LLM_BACKEND, GEMINI_MODEL, PROMPT_DESCRIPTION, EXAMPLE_TEXT, EXAMPLE_EXTRACTIONS)
+
+
+def version_extraccion() -> str:
+    """
+    Backend, model and prompt version used for measurements ('patrones' when no LLM is
+    configured). Part of the report cache key.
+    """
+    if LLM_BACKEND != 'stub' and not _gemini_api_key():
+        return 'patrones'
+    return f"{LLM_BACKEND}:{GEMINI_MODEL}:{_version_prompt()}"
+
+
+def get_llm_extractor() -> Optional[ExtractorLLM]:
+    """
+    Extractor shared by the process, or None when no LLM backend is configured
+    (stub backend, or gemini with a valid GOOGLE_API_KEY).
+    """
+    global _extractor_llm
+    if _extractor_llm is None:
+        if LLM_BACKEND == 'stub':
+            backend = BackendStub(extract_measurements_pattern_matching)
+        elif _gemini_api_key():
+            backend = _extract_with_gemini
+        else:
+            return None
+        _extractor_llm = ExtractorLLM(backend, _version_prompt(), cache=crear_cache())
+    return _extractor_llm
+
+
+def extract_with_llm(text: str, use_gemini: bool = False) -> Dict[str, Any]:
+    """
+    Extract measurements using Gemini LLM if API key is available.
+    Falls back to pattern matching if not available.
+
+    Responses are cached by normalized text and prompt/model version, identical
+    calls in flight share one request, and each call waits at most LLM_TIMEOUT seconds.
+
+    Args:
+        text: Text content to analyze
+        use_gemini: Whether to use Gemini for extraction
+
+    Returns:
+        Dictionary of extracted measurements
+    """
+
+    measurements = {}
+
+    extractor = get_llm_extractor() if use_gemini else None
+    if extractor is not None:
+        try:
+            with etapa('gemini'):
+                measurements = extractor.extraer(text)
         except Exception as e:
             print(f"[WARNING] Gemini extraction failed, falling back to pattern matching: {e}")
+            marcar_degradado(f"llm: {e}")
             # Fall through to pattern matching
 
     # Fallback to pattern matching if Gemini is not available or failed
@@ -302,42 +348,38 @@ def extract_wall_motion_scores(pdf_content: List[Dict[str, Any]]) -> Dict[str, A
 
     return {'mot': motility} if motility else {}
 
-def pdf_to_docx_data(pdf_path: str) -> Dict[str, Any]:
+def pdf_to_docx_data(pdf_path: str, pdf_content: Optional[List[Dict[str, Any]]] = None,
+                     images: Optional[Dict[str, bytes]] = None) -> Dict[str, Any]:
     """
     Converts PDF data into a format compatible with existing DOCX processing.
 
     Args:
         pdf_path: Path to the PDF file.
+        pdf_content: Already analyzed pages (e.g. from a ParsedStudy), to avoid re-parsing.
+        images: Already extracted images, to avoid opening the PDF again.
 
     Returns:
         Dictionary with extracted data ready for template processing.
     """
     try:
         # Analyze PDF content
-        pdf_content = analyze_pdf_content(pdf_path)
+        if pdf_content is None:
+            pdf_content = analyze_pdf_content(pdf_path)
 
         # Extract different types of data
         patient_info = extract_patient_info_from_pdf(pdf_content)
         measurements = extract_measurements_from_pdf(pdf_content)
         motility = extract_wall_motion_scores(pdf_content)
 
-        # Extract images and save them temporarily
-        images = extract_images_from_pdf(pdf_path)
-        image_paths = {}
-
-        if images:
-            temp_dir = tempfile.mkdtemp()
-            for name, data in images.items():
-                image_path = os.path.join(temp_dir, f"{name}.png")
-                with open(image_path, 'wb') as f:
-                    f.write(data)
-                image_paths[name] = image_path
+        # Images stay in memory (name -> bytes) all the way to InlineImage
+        if images is None:
+            images = extract_images_from_pdf(pdf_path)
 
         return {
             'patient_info': patient_info,
             'measurements': measurements,
             'motility': motility,
-            'images': image_paths
+            'images': dict(images)
         }
 
     except Exception as e:
@@ -0,0 +1,266 @@
+"""
+Cache en disco de informes generados, direccionado por contenido.
+
+La clave es el hash de los bytes subidos más todo lo demás que cambia el informe (el nombre
+del archivo, el parser y los ajustes del proceso, la versión de los templates): volver a subir
+el mismo archivo del ecógrafo devuelve el informe ya generado sin parsear ni renderizar.
+Las entradas se descartan por LRU cuando el cache supera su tamaño máximo.
+"""
+
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Tuple, List
+
+import image_pipeline
+from parsed_study import DOCX_PARSER
+from template_manager import template_store, tipo_por_nombre, PDF_TYPE_DETECTION_PAGES
+
+try:
+    import pdf_processor
+except ImportError:
+    pdf_processor = None
+
+try:
+    import pdf_processor_enhanced
+except ImportError:
+    pdf_processor_enhanced = None
+
+logger = logging.getLogger(__name__)
+
+# Directorio donde se guardan los informes cacheados
+REPORT_CACHE_DIR = os.getenv('REPORT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'eco_report_cache'))
+# Tamaño máximo del cache en MB; 0 lo desactiva
+REPORT_CACHE_MAX_MB = float(os.getenv('REPORT_CACHE_MAX_MB', 500))
+# Subir este número cuando un cambio en la extracción invalida los informes ya cacheados
+VERSION_PIPELINE = "2"
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _ajustes(parser: Optional[str]) -> str:
+    '''
+    Parser de .docx y ajustes del proceso (por entorno) que cambian el informe generado,
+    incluidos el backend, el modelo y el prompt del LLM que extrae las mediciones de los PDF.
+    '''
+    ajustes = [f"parser:{parser or DOCX_PARSER}", f"dpi:{image_pipeline.IMAGE_TARGET_DPI}",
+               f"deteccion_pdf:{PDF_TYPE_DETECTION_PAGES}"]
+    if pdf_processor is not None:
+        ajustes += [f"pdf:{pdf_processor.PDF_BACKEND}", f"tablas_pdf:{pdf_processor.PDF_FULL_TABLE_SCAN}"]
+    if pdf_processor_enhanced is not None:
+        ajustes.append(f"llm:{pdf_processor_enhanced.version_extraccion()}")
+    return "|".join(ajustes)
+
+
+class CacheInformes:
+    '''
+    Cada entrada es un directorio <clave>/ con el informe adentro, con su nombre original.
+    El índice LRU vive en memoria y se reconstruye al iniciar a partir del mtime de cada entrada.
+    '''
+
+    def __init__(self, directorio: str = REPORT_CACHE_DIR, max_bytes: int = int(REPORT_CACHE_MAX_MB * 1024 * 1024)):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._cargado = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def activo(self) -> bool:
+        return self.max_bytes > 0
+
+    def _cargar_indice(self) -> None:
+        if self._cargado:
+            return
+        self._cargado = True
+        os.makedirs(self.directorio, exist_ok=True)
+        encontradas = []
+        for clave in os.listdir(self.directorio):
+            entrada = os.path.join(self.directorio, clave)
+            if clave.startswith('.'):
+                # Restos de una escritura interrumpida
+                shutil.rmtree(entrada, ignore_errors=True)
+                continue
+            archivos = os.listdir(entrada) if os.path.isdir(entrada) else []
+            if len(archivos) != 1:
+                shutil.rmtree(entrada, ignore_errors=True)
+                continue
+            path = os.path.join(entrada, archivos[0])
+            stat = os.stat(path)
+            encontradas.append((stat.st_mtime, clave, path, stat.st_size))
+        for _, clave, path, size in sorted(encontradas):
+            self._entradas[clave] = (path, size)
+        for descartada in self._recortar():
+            shutil.rmtree(descartada, ignore_errors=True)
+
+    def clave(self, input_path: str, contenido=None, parser: Optional[str] = None) -> str:
+        '''
+        Hash de los bytes del archivo subido más lo que cambia el informe generado a partir de
+        ellos: el tipo que marca el nombre del archivo (template_selector) y su extensión, el
+        parser y los ajustes del proceso, y las versiones de los templates y del pipeline.
+        contenido es el hashlib.sha256 de esos bytes si ya se calculó al recibirlos
+        (upload_spool); si no, se lee el archivo.
+        '''
+        if contenido is not None:
+            digest = contenido.copy()
+        else:
+            digest = hashlib.sha256()
+            with open(input_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+        extension = os.path.splitext(input_path)[1].lower()
+        digest.update(f"|nombre:{tipo_por_nombre(input_path)}|extension:{extension}|{_ajustes(parser)}"
+                      f"|templates:{template_store.version()}|pipeline:{VERSION_PIPELINE}".encode())
+        return digest.hexdigest()
+
+    def _entrada_vigente(self, clave: str) -> Optional[str]:
+        '''
+        Ruta del informe cacheado (y lo marca como usado) o None. El informe se lee sin el lock:
+        si la entrada se descarta mientras tanto, la lectura falla y se trata como no cacheado.
+        '''
+        with self._lock:
+            self._cargar_indice()
+            entrada = self._entradas.get(clave)
+            if entrada is None or not os.path.exists(entrada[0]):
+                self._entradas.pop(clave, None)
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.hits += 1
+            # El mtime guarda el orden LRU entre reinicios
+            os.utime(entrada[0], (time.time(), time.time()))
+            return entrada[0]
+
+    def tamano(self, clave: str) -> Optional[int]:
+        '''
+        Tamaño del informe cacheado bajo clave, o None; no cuenta como uso.
+        '''
+        if not self.activo:
+            return None
+        with self._lock:
+            self._cargar_indice()
+            entrada = self._entradas.get(clave)
+        return entrada[1] if entrada is not None else None
+
+    def obtener(self, clave: str, destino_dir: str) -> Optional[str]:
+        '''
+        Si el informe está cacheado lo copia a destino_dir y devuelve su ruta; si no, devuelve None.
+        '''
+        if not self.activo:
+            return None
+        path = self._entrada_vigente(clave)
+        if path is None:
+            return None
+        save_path = os.path.join(destino_dir, os.path.basename(path))
+        try:
+            shutil.copyfile(path, save_path)
+        except FileNotFoundError:
+            return None
+        return save_path
+
+    def obtener_contenido(self, clave: str) -> Optional[Tuple[str, bytes]]:
+        '''
+        Como obtener, pero devuelve (nombre, contenido) del informe en lugar de copiarlo.
+        '''
+        if not self.activo:
+            return None
+        path = self._entrada_vigente(clave)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return os.path.basename(path), f.read()
+        except FileNotFoundError:
+            return None
+
+    def guardar(self, clave: str, save_path: str) -> None:
+        '''
+        Guarda una copia del informe generado bajo su clave.
+        '''
+        if not self.activo:
+            return
+        self._guardar(clave, os.path.basename(save_path), os.path.getsize(save_path),
+                      lambda destino: shutil.copyfile(save_path, destino))
+
+    def guardar_contenido(self, clave: str, nombre: str, contenido: bytes) -> None:
+        '''
+        Como guardar, para un informe generado en memoria.
+        '''
+        if not self.activo:
+            return
+
+        def escribir(destino: str) -> None:
+            with open(destino, 'wb') as f:
+                f.write(contenido)
+
+        self._guardar(clave, nombre, len(contenido), escribir)
+
+    def _guardar(self, clave: str, nombre: str, size: int, escribir) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._cargar_indice()
+            if clave in self._entradas:
+                return
+        # Se escribe fuera del lock en un directorio temporal y se renombra, así una entrada
+        # nunca queda a medias y las lecturas no esperan a la escritura
+        temporal = os.path.join(self.directorio, f".{uuid.uuid4().hex}")
+        os.makedirs(temporal)
+        try:
+            escribir(os.path.join(temporal, nombre))
+        except BaseException:
+            shutil.rmtree(temporal, ignore_errors=True)
+            raise
+        entrada = os.path.join(self.directorio, clave)
+        with self._lock:
+            if clave in self._entradas:
+                # Otro pedido la guardó mientras tanto
+                descartadas = [temporal]
+            else:
+                descartadas = [self._apartar(clave)] if os.path.exists(entrada) else []
+                os.rename(temporal, entrada)
+                self._entradas[clave] = (os.path.join(entrada, nombre), size)
+                descartadas += self._recortar()
+        for descartada in descartadas:
+            shutil.rmtree(descartada, ignore_errors=True)
+
+    def _apartar(self, clave: str) -> str:
+        # Renombra el directorio de una entrada a uno temporal para borrarlo fuera del lock
+        apartada = os.path.join(self.directorio, f".{uuid.uuid4().hex}")
+        os.rename(os.path.join(self.directorio, clave), apartada)
+        return apartada
+
+    def _recortar(self) -> List[str]:
+        '''
+        Descarta entradas por LRU hasta entrar en max_bytes. Devuelve los directorios que
+        quedaron apartados para borrar sin el lock.
+        '''
+        descartadas = []
+        total = sum(size for _, size in self._entradas.values())
+        while total > self.max_bytes and self._entradas:
+            clave, (_, size) = self._entradas.popitem(last=False)
+            try:
+                descartadas.append(self._apartar(clave))
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+        return descartadas
+
+    def estadisticas(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entradas': len(self._entradas),
+                    'bytes': sum(size for _, size in self._entradas.values())}
+
+
+report_cache = CacheInformes()
@@ -0,0 +1,200 @@
+"""
+Pipeline de generación de un informe a partir de un archivo ya guardado en disco.
+
+Vive fuera de main.py para que los workers del procesamiento por lotes puedan
+importarlo sin levantar la aplicación FastAPI.
+"""
+
+import os
+import logging
+from io import BytesIO
+from typing import Optional, Tuple
+from fastapi import HTTPException
+
+from template_manager import template_selector
+from parsed_study import ParsedStudy
+from patient_data_extraction import extract_patient_info, image_extractor, generate_motility_report, get_measure_table, get_measurements, get_mot_table, mot_extractor
+from aux_calculations import expand_dict_with_lists_inplace, calc_e_e_stress
+from measurement_rules import interpretar_pdf
+from doc_converter import convertir_doc_a_docx
+from metrics import etapa, etiquetar_tipo
+
+logger = logging.getLogger(__name__)
+
+# Safe import for PDF processing with enhanced fallback
+try:
+    from patient_data_extraction import process_pdf_images
+    from pdf_processor import pdf_to_docx_data, format_for_template
+    PDF_PROCESSING_AVAILABLE = True
+    logger.info("Standard PDF processing modules loaded successfully")
+except ImportError as e:
+    logger.warning(f"Standard PDF processing not available: {e}")
+
+    # Try enhanced PDF processor as fallback
+    try:
+        from pdf_processor_enhanced import pdf_to_docx_data, format_for_template
+        from patient_data_extraction import process_pdf_images
+        PDF_PROCESSING_AVAILABLE = True
+        logger.info("Enhanced PDF processing modules loaded successfully")
+    except ImportError as e2:
+        PDF_PROCESSING_AVAILABLE = False
+        logger.error(f"No PDF processing modules available: {e2}")
+
+        # Create dummy functions that provide clear error messages
+        def pdf_to_docx_data(pdf_path: str, pdf_content=None, images=None):
+            raise HTTPException(
+                status_code=503,
+                detail="PDF processing temporarily unavailable. Missing dependencies: pdfplumber, langextract. Please use .docx files."
+            )
+
+        def format_for_template(pdf_data):
+            raise HTTPException(
+                status_code=503,
+                detail="PDF processing temporarily unavailable. Please use .docx files."
+            )
+
+        def process_pdf_images(images, template, tipo):
+            raise HTTPException(
+                status_code=503,
+                detail="PDF processing temporarily unavailable. Please use .docx files."
+            )
+
+
+def procesar_ruta(input_path: str, tmpdir: str, filename: str, parser: Optional[str] = None) -> str:
+    """
+    Genera el informe para un archivo ya guardado en input_path, lo escribe en tmpdir y
+    devuelve la ruta del .docx generado.
+    """
+    nombre, contenido = generar_en_memoria(input_path, tmpdir, filename, parser)
+    save_path = os.path.join(tmpdir, nombre)
+    with open(save_path, 'wb') as f:
+        f.write(contenido)
+    return save_path
+
+
+def generar_en_memoria(input_path: str, tmpdir: str, filename: str, parser: Optional[str] = None) -> Tuple[str, bytes]:
+    """
+    Genera el informe para un archivo ya guardado en input_path y devuelve (nombre del .docx, contenido),
+    sin escribir el informe en disco. Solo la conversión de un .doc usa tmpdir.
+    parser elige el backend de lectura del .docx ('docx' o 'lxml'); None usa DOCX_PARSER.
+    """
+    # Si es .doc, convertir a .docx con el servicio de LibreOffice
+    if input_path.lower().endswith('.doc'):
+        doc_path = convertir_doc_a_docx(input_path, tmpdir)
+    else:
+        doc_path = input_path
+
+    try:
+        # El estudio se parsea una sola vez y se comparte entre selección y extracción
+        study = ParsedStudy(doc_path, parser)
+
+        # Handle PDF files differently
+        if study.is_pdf:
+            logger.info(f"Processing PDF file: {doc_path}")
+
+            with etapa('pdf_analysis'):
+                pdf_content = study.pdf_content
+            with etapa('pdf_images'):
+                pdf_images = study.pdf_images
+
+            # Extract data from PDF
+            with etapa('pdf_extraction'):
+                pdf_data = pdf_to_docx_data(doc_path, pdf_content=pdf_content, images=pdf_images)
+
+            # Select template based on PDF content
+            with etapa('template_selector'):
+                template, tipo = template_selector(study)
+            etiquetar_tipo(tipo)
+
+            # Format PDF data for template
+            context = format_for_template(pdf_data)
+
+            # Add patient info
+            info_pac = pdf_data.get('patient_info', {})
+
+            # Interpretaciones con las mismas reglas que el .docx
+            with etapa('measurements'):
+                context.update(interpretar_pdf(pdf_data.get('measurements', {}), info_pac.get('Gender', '')))
+
+            # Process images if available
+            if 'images' in pdf_data and pdf_data['images']:
+                with etapa('images'):
+                    image = process_pdf_images(pdf_data['images'], template, tipo)
+                context['image'] = image['image']
+
+            # Add motility if available
+            if 'motility' in pdf_data and pdf_data['motility']:
+                mot = pdf_data['motility']
+                if 'mot' in mot:
+                    with etapa('motility'):
+                        mot_report = generate_motility_report(mot)
+                    context.update(mot_report)
+        else:
+            # Process DOCX files as before; ParsedStudy se usa como el Document
+            doc = study
+            with etapa('template_selector'):
+                template, tipo = template_selector(study)
+            etiquetar_tipo(tipo)
+            with etapa('patient_info'):
+                info_pac = extract_patient_info(doc)
+            with etapa('images'):
+                image = image_extractor(doc, template, tipo=tipo)
+            context = None
+        # Nombre de salida temporal
+        safe_name = info_pac.get('Name', 'informe').replace('/', '_').replace('\\', '_')
+        safe_date = info_pac.get('Exam_Date', 'fecha').replace('/', '_').replace('\\', '_')
+        output_filename = f"{safe_name}_{tipo}_{safe_date}.docx"
+
+        # If context was already built (PDF case), skip the rest
+        if context is None and tipo in ['card', 'stress']:
+            measurements_table = get_measure_table(doc)
+            if 'Gender' not in info_pac:
+                print(f"[ERROR] info_pac keys: {list(info_pac.keys())}")
+                raise HTTPException(status_code=422, detail=f"Falta el dato 'Gender' en el archivo {filename}. Datos extraídos: {info_pac}")
+            with etapa('measurements'):
+                measurements_dic = get_measurements(measurements_table, info_pac['Gender'])
+            if tipo == 'stress':
+                with etapa('motility'):
+                    mot_table = get_mot_table(doc)
+                    mot = mot_extractor(mot_table)
+                    mot_report = generate_motility_report(mot)
+                expand_dict_with_lists_inplace(measurements_dic)
+                measurements_dic['E_e_rel'], measurements_dic['e_e_avg'] = calc_e_e_stress(measurements_dic)
+                context = {**info_pac, **measurements_dic, 'image': image['image'], 'mot': mot['mot'], **mot_report}
+            else:
+                context = {**info_pac, **measurements_dic, 'image': image['image']}
+        elif context is None:
+            context = {**info_pac, 'image': image['image']}
+
+        # Render template with context
+        with etapa('render'):
+            template.render(context)
+        with etapa('save'):
+            salida = BytesIO()
+            template.save(salida)
+        return output_filename, salida.getvalue()
+    except HTTPException:
+        # Re-raise HTTP exceptions as-is
+        raise
+    except Exception as e:
+        import traceback
+        tb = traceback.format_exc()
+        logger.error(f"Error processing file {filename}: {tb}")
+
+        # Return user-friendly error message
+        error_msg = "Error interno del servidor procesando el archivo"
+        if "No se encontró LibreOffice" in str(e):
+            error_msg = "Error de conversión de documento .doc"
+        elif "Falta el dato 'Gender'" in str(e):
+            error_msg = "Falta información requerida en el documento (Gender)"
+        elif "No se encontró tabla" in str(e):
+            error_msg = "Formato de documento no reconocido"
+
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "error": error_msg,
+                "filename": filename,
+                "details": str(e)
+            }
+        )
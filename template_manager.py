@@ -5,9 +5,189 @@
 
 
 import os
+import copy
+import hashlib
+import threading
+from typing import Dict, Optional
+from jinja2 import Environment
 from docxtpl import DocxTemplate
 from docx import Document
 
+from parsed_study import parse_study
+
+# Usar rutas relativas para compatibilidad cloud/container
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TEMPLATE_FILES = {
+    'card': 'auto card.docx',
+    'stress': 'auto stress.docx',
+    'carotid': 'auto vc.docx',
+    'art': 'auto art.docx',
+    'ven': 'auto ven.docx',
+}
+
+# Palabras del nombre del estudio (como lo guarda el equipo vinno) que definen su tipo
+TIPOS_POR_NOMBRE = (('Carotid', 'carotid'), ('Arteries', 'art'), ('Veins', 'ven'))
+# Texto que marca un PDF de stress (tabla de motilidad parietal)
+MARCADORES_STRESS_PDF = ('WMS', 'WALL MOTION')
+# Páginas de un PDF en las que se buscan esos marcadores; 0 las recorre todas (hasta encontrarlos)
+PDF_TYPE_DETECTION_PAGES = max(0, int(os.getenv('PDF_TYPE_DETECTION_PAGES', 0)))
+
+
+class _EntornoJinjaCacheado(Environment):
+    '''
+    Environment de jinja que compila cada XML de template una sola vez.
+    Hay uno por template y el XML de origen es siempre el del template sin renderizar, asi que
+    el cache es acotado; al recargar un template, TemplateStore descarta el de su versión anterior.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._compilados = {}
+        self._lock = threading.Lock()
+
+    def from_string(self, source, globals=None, template_class=None):
+        if globals or template_class:
+            return super().from_string(source, globals, template_class)
+        compilado = self._compilados.get(source)
+        if compilado is None:
+            compilado = super().from_string(source)
+            with self._lock:
+                self._compilados[source] = compilado
+        return compilado
+
+
+# Por ruta del template: el XML ya limpiado por patch_xml ({xml de origen: xml limpio}) y el
+# entorno jinja con los templates compilados
+_xml_parcheado: Dict[str, Dict[str, str]] = {}
+_entornos_jinja: Dict[str, _EntornoJinjaCacheado] = {}
+
+
+def _descartar_parcheado(path: str) -> None:
+    '''
+    Olvida el XML limpio y los templates jinja compilados de la versión anterior de un template.
+    '''
+    _xml_parcheado.pop(path, None)
+    _entornos_jinja.pop(path, None)
+
+
+class PlantillaCacheada(DocxTemplate):
+    '''
+    DocxTemplate que reutiliza el XML ya limpiado por patch_xml y los templates jinja
+    ya compilados entre renders del mismo archivo.
+    '''
+
+    def patch_xml(self, src_xml):
+        parcheados = _xml_parcheado.setdefault(self.template_file, {})
+        patched = parcheados.get(src_xml)
+        if patched is None:
+            patched = super().patch_xml(src_xml)
+            parcheados[src_xml] = patched
+        return patched
+
+    def render(self, context, jinja_env=None, autoescape=False):
+        if jinja_env is None and not autoescape:
+            jinja_env = _entornos_jinja.get(self.template_file)
+            if jinja_env is None:
+                jinja_env = _entornos_jinja.setdefault(self.template_file, _EntornoJinjaCacheado())
+        return super().render(context, jinja_env, autoescape)
+
+
+class TemplateStore:
+    '''
+    Guarda los templates ya parseados en memoria y entrega copias independientes para renderizar.
+    Un template se vuelve a leer solo si su archivo cambió en disco (mtime o tamaño).
+    '''
+
+    def __init__(self, base_dir: str = BASE_DIR, archivos: Optional[Dict[str, str]] = None):
+        self.base_dir = base_dir
+        self.archivos = dict(archivos or TEMPLATE_FILES)
+        self._cache = {}
+        self._versiones = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.reloads = 0
+        self.loads = 0
+
+    def ruta(self, tipo: str) -> str:
+        return os.path.join(self.base_dir, self.archivos[tipo])
+
+    def _firma(self, path: str) -> tuple:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _cargar(self, tipo: str):
+        path = self.ruta(tipo)
+        firma = self._firma(path)
+        document = Document(path)
+        self._cache[tipo] = (firma, document)
+        _descartar_parcheado(path)
+        return document
+
+    def precargar(self) -> None:
+        with self._lock:
+            for tipo in self.archivos:
+                if tipo not in self._cache:
+                    self._cargar(tipo)
+                    self.loads += 1
+
+    def obtener(self, tipo: str) -> DocxTemplate:
+        '''
+        Devuelve una copia lista para renderizar del template del tipo pedido.
+        '''
+        path = self.ruta(tipo)
+        with self._lock:
+            cached = self._cache.get(tipo)
+            if cached is None:
+                document = self._cargar(tipo)
+                self.loads += 1
+            elif cached[0] != self._firma(path):
+                print(f"[INFO] Template {self.archivos[tipo]} cambió en disco, recargando")
+                document = self._cargar(tipo)
+                self.reloads += 1
+            else:
+                document = cached[1]
+                self.hits += 1
+            copia = copy.deepcopy(document)
+        template = PlantillaCacheada(path)
+        template.docx = copia
+        return template
+
+    def estadisticas(self) -> dict:
+        return {'hits': self.hits, 'reloads': self.reloads, 'loads': self.loads}
+
+    def version(self) -> str:
+        '''
+        Hash del contenido de todos los templates. Cambia cuando se modifica cualquiera de ellos;
+        el contenido solo se vuelve a leer si cambió la firma (mtime o tamaño) del archivo.
+        '''
+        digest = hashlib.sha256()
+        with self._lock:
+            for tipo in sorted(self.archivos):
+                path = self.ruta(tipo)
+                firma = self._firma(path)
+                cached = self._versiones.get(tipo)
+                if cached is None or cached[0] != firma:
+                    with open(path, 'rb') as f:
+                        cached = (firma, hashlib.sha256(f.read()).hexdigest())
+                    self._versiones[tipo] = cached
+                digest.update(f"{tipo}:{cached[1]};".encode())
+        return digest.hexdigest()
+
+
+template_store = TemplateStore()
+
+
+def tipo_por_nombre(path: str) -> Optional[str]:
+    '''
+    Tipo de estudio que indica el nombre del archivo, o None si hay que mirar su contenido.
+    '''
+    for marcador, tipo in TIPOS_POR_NOMBRE:
+        if marcador in path:
+            return tipo
+    return None
+
+
 def template_selector(path)->tuple: 
 
     '''
@@ -17,51 +197,35 @@ def template_selector(path)->tuple:
     si no encuentra estas palabras abre el docx y busca la palabra WMS en las tablas del informe (esto determinaria un ecostres)
     si la encuentra cambia al ecostress
     Devuelve el template correspondiente con el tipo de template, para ser usado en la funcion render template
+    El template sale de template_store, que mantiene los archivos ya parseados en memoria
+    Acepta tambien un ParsedStudy para no volver a parsear el estudio
     '''
     #por default elijo la plantilla de cardio
-    # Usar rutas relativas para compatibilidad cloud/container
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    template_path = os.path.join(base_dir, "auto card.docx")
     tipo = 'card'
-    path_str = str(path)
+    study = parse_study(path)
+    por_nombre = tipo_por_nombre(study.path)
     try:
-        if 'Carotid' in path_str:
-            template_path = os.path.join(base_dir, "auto vc.docx")
-            tipo = 'carotid'
-        elif 'Arteries' in path_str:
-            template_path = os.path.join(base_dir, "auto art.docx")
-            tipo = 'art'
-        elif 'Veins' in path_str:
-            template_path = os.path.join(base_dir, "auto ven.docx")
-            tipo = 'ven'
+        if por_nombre is not None:
+            tipo = por_nombre
         else:
             # Check if it's a PDF file
-            if path_str.lower().endswith('.pdf'):
+            if study.is_pdf:
                 # For PDF files, try to determine type from content
                 try:
-                    from pdf_processor import analyze_pdf_content
-                    pdf_content = analyze_pdf_content(path)
-
-                    # Look for WMS indicators in PDF text
-                    full_text = ""
-                    for page in pdf_content:
-                        full_text += " ".join(page.get('text_lines', []))
-
-                    if 'WMS' in full_text.upper() or 'WALL MOTION' in full_text.upper():
-                        template_path = os.path.join(base_dir, "auto stress.docx")
+                    # Look for WMS indicators in PDF text, page by page until the first hit
+                    if study.pdf_contiene(MARCADORES_STRESS_PDF, PDF_TYPE_DETECTION_PAGES):
                         tipo = 'stress'
                 except Exception as e:
                     print(f"Error analyzing PDF for template selection: {e}, defaulting to 'card'")
             else:
                 # Handle Word documents as before
-                doc = Document(path)
-                if len(doc.tables) > 2 and doc.tables[2].rows[0].cells[0].text == 'WMS':
-                    template_path = os.path.join(base_dir, "auto stress.docx")
+                tables = study.tables
+                if len(tables) > 2 and tables[2].rows[0].cells[0].text == 'WMS':
                     tipo = 'stress'
     except (IndexError, AttributeError) as e:
         print(f"Error: {e}, defaulting to 'card' template.")
 
-    template = DocxTemplate(template_path)
+    template = template_store.obtener(tipo)
     return template, tipo
 
 
@@ -0,0 +1,106 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import batch_processor
+from batch_processor import enviar_archivo, esperar_resultado, ControlAdmision, InformesEnMemoria
+
+
+def test_error_del_worker_vuelve_como_resultado(tmp_path):
+    roto = tmp_path / "roto.docx"
+    roto.write_bytes(b"no es un docx real")
+
+    future = enviar_archivo(str(roto), str(tmp_path), "roto.docx")
+    resultado = esperar_resultado(future, "roto.docx")
+
+    assert resultado["filename"] == "roto.docx"
+    assert resultado["save_path"] is None and resultado["error"]
+    assert resultado["status_code"] == 500
+
+
+def test_archivo_inexistente_falla_antes_de_encolarse(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        enviar_archivo(str(tmp_path / "inexistente.docx"), str(tmp_path), "inexistente.docx")
+
+
+def test_control_admision_respeta_capacidad():
+    control = ControlAdmision(3)
+    assert control.reservar(2)
+    assert not control.reservar(2)
+    control.liberar(2)
+    # un lote más grande que la capacidad entra si no hay nada en curso
+    assert control.reservar(5)
+    control.liberar(5)
+    assert control.en_curso == 0
+
+
+def test_informes_del_lote_reservan_memoria_antes_de_encolarse():
+    memoria = InformesEnMemoria(max_bytes=10)
+    assert memoria.reservar(6) == 6
+    # no hay lugar: el worker lo escribe en disco
+    assert memoria.reservar(6) is None
+
+    primero = {'nombre': 'a.docx', 'contenido': b'x' * 4, 'save_path': None, 'error': None}
+    memoria.ajustar(primero, 6)
+    assert memoria.en_memoria == 4
+    assert memoria.reservar(6) == 6
+    memoria.ajustar({'nombre': 'b.docx', 'contenido': None, 'save_path': '/tmp/b.docx', 'error': None}, 6)
+    assert memoria.en_memoria == 4 and memoria.a_disco == 1
+
+    # agregado al ZIP, el primero libera su lugar
+    memoria.liberar(primero)
+    assert primero['contenido'] is None and memoria.en_memoria == 0
+
+
+def test_worker_escribe_en_disco_el_informe_mayor_a_lo_reservado(monkeypatch, tmp_path):
+    monkeypatch.setattr(batch_processor, "generar_en_memoria", lambda *args: ("informe.docx", b"x" * 8))
+
+    chico = batch_processor._procesar_en_worker("estudio.docx", str(tmp_path), "estudio.docx", 0, None, True, 8)
+    assert chico['contenido'] == b"x" * 8 and chico['save_path'] is None
+
+    grande = batch_processor._procesar_en_worker("estudio.docx", str(tmp_path), "estudio.docx", 0, None, True, 4)
+    assert grande['contenido'] is None
+    assert open(grande['save_path'], 'rb').read() == b"x" * 8
+
+
+def test_informe_degradado_no_se_guarda_en_cache(monkeypatch):
+    from concurrent.futures import Future
+
+    guardados = []
+    monkeypatch.setattr(batch_processor.report_cache, "guardar_contenido", lambda *args: guardados.append(args))
+    resultado = {'filename': 'estudio.pdf', 'save_path': None, 'nombre': 'informe.docx', 'contenido': b'x',
+                 'error': None, 'degradado': 'llm: timeout'}
+    future, salida = Future(), Future()
+    future.set_result(resultado)
+
+    batch_processor._guardar_en_cache("clave", future, salida)
+    assert salida.result() is resultado and guardados == []
+
+    del resultado['degradado']
+    batch_processor._guardar_en_cache("clave", future, Future())
+    assert guardados == [("clave", "informe.docx", b"x")]
+
+
+def test_informe_cacheado_toma_el_tipo_del_nombre():
+    from metrics import informes_total, iniciar_cronometro, formato_de
+
+    claves = [("carotid", "docx", "cache"), ("cache", "docx", "cache")]
+    antes = [informes_total._valores.get(clave, 0) for clave in claves]
+    for filename in ("Carotid 01.docx", "estudio.docx"):
+        # cada pedido tiene su cronómetro, como en main
+        iniciar_cronometro(formato_de(filename))
+        batch_processor._registrar_resultado({'filename': filename, 'save_path': None, 'nombre': 'informe.docx',
+                                              'contenido': b'x', 'error': None, 'cache': True})
+    assert [informes_total._valores.get(clave, 0) for clave in claves] == [n + 1 for n in antes]
+
+
+def test_lote_rechazado_con_429_y_retry_after(monkeypatch):
+    from main import app
+
+    monkeypatch.setattr(batch_processor.admision, "en_curso", batch_processor.admision.capacidad)
+    client = TestClient(app)
+    response = client.post(
+        "/generar_informes_multiples",
+        files=[("files", ("a.docx", b"x")), ("files", ("b.docx", b"y"))]
+    )
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(batch_processor.BATCH_RETRY_AFTER)
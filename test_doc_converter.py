@@ -0,0 +1,136 @@
+import os
+import sys
+import stat
+import tempfile
+
+import pytest
+from fastapi import HTTPException
+
+import doc_converter
+from doc_converter import ServicioConversion
+
+FAKE_SOFFICE = """#!/bin/sh
+# Simula soffice --convert-to docx --outdir DIR archivo.doc
+while [ $# -gt 0 ]; do
+  case "$1" in
+    --outdir) outdir="$2"; shift ;;
+    *.doc) input="$1" ;;
+  esac
+  shift
+done
+name=$(basename "$input" .doc)
+case "$name" in
+  lento) sleep 5 ;;
+esac
+echo convertido > "$outdir/$name.docx"
+"""
+
+
+@pytest.fixture
+def fake_soffice():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "soffice")
+        with open(path, "w") as f:
+            f.write(FAKE_SOFFICE)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        yield path, tmpdir
+
+
+def test_servicio_convierte_varios_archivos_con_perfiles_propios(fake_soffice):
+    soffice, tmpdir = fake_soffice
+    servicio = ServicioConversion(soffice, cantidad=2)
+    try:
+        assert len({w.profile_dir for w in servicio.workers}) == 2
+        for nombre in ("a", "b", "c"):
+            origen = os.path.join(tmpdir, f"{nombre}.doc")
+            open(origen, "wb").close()
+            servicio.convertir(origen, os.path.join(tmpdir, f"{nombre}.docx"))
+            assert os.path.exists(os.path.join(tmpdir, f"{nombre}.docx"))
+    finally:
+        servicio.detener()
+
+
+def test_servicio_respeta_timeout_por_trabajo(fake_soffice):
+    soffice, tmpdir = fake_soffice
+    servicio = ServicioConversion(soffice, cantidad=1)
+    origen = os.path.join(tmpdir, "lento.doc")
+    open(origen, "wb").close()
+    try:
+        with pytest.raises(Exception, match="tiempo máximo"):
+            servicio.convertir(origen, os.path.join(tmpdir, "lento.docx"), timeout=0.5)
+        # el worker vuelve al pool y sigue atendiendo conversiones
+        rapido = os.path.join(tmpdir, "rapido.doc")
+        open(rapido, "wb").close()
+        servicio.convertir(rapido, os.path.join(tmpdir, "rapido.docx"))
+    finally:
+        servicio.detener()
+
+
+# Simula un python con uno corriendo uno_bridge.py: mismo protocolo, sin LibreOffice
+FAKE_PUENTE = """#!{python}
+import os, sys, json, time
+print(os.getpid(), file=open(os.path.join(os.path.dirname(sys.argv[0]), "puente.pid"), "a"))
+for linea in sys.stdin:
+    pedido = json.loads(linea)
+    if "lento" in pedido["entrada"]:
+        time.sleep(5)
+    open(pedido["salida"], "w").write("convertido")
+    print(json.dumps({{"ok": True}}), flush=True)
+"""
+
+
+def _ejecutable(tmpdir, nombre, contenido):
+    path = os.path.join(tmpdir, nombre)
+    with open(path, "w") as f:
+        f.write(contenido)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+def test_modo_persistente_reutiliza_la_instancia_y_reinicia_tras_timeout(tmp_path):
+    tmpdir = str(tmp_path)
+    # la instancia de LibreOffice solo tiene que seguir viva
+    soffice = _ejecutable(tmpdir, "soffice", "#!/bin/sh\nexec sleep 60\n")
+    puente = _ejecutable(tmpdir, "python_uno", FAKE_PUENTE.format(python=sys.executable))
+    servicio = ServicioConversion(soffice, cantidad=1, python_uno=puente)
+    try:
+        for nombre in ("a", "b"):
+            origen = os.path.join(tmpdir, f"{nombre}.doc")
+            open(origen, "wb").close()
+            servicio.convertir(origen, os.path.join(tmpdir, f"{nombre}.docx"))
+            assert open(os.path.join(tmpdir, f"{nombre}.docx")).read() == "convertido"
+        # las dos conversiones pasaron por el mismo puente
+        assert len(open(os.path.join(tmpdir, "puente.pid")).read().split()) == 1
+
+        with pytest.raises(Exception, match="tiempo máximo"):
+            servicio.convertir(os.path.join(tmpdir, "lento.doc"), os.path.join(tmpdir, "lento.docx"), timeout=0.5)
+        servicio.convertir(os.path.join(tmpdir, "a.doc"), os.path.join(tmpdir, "c.docx"))
+        assert len(open(os.path.join(tmpdir, "puente.pid")).read().split()) == 2
+    finally:
+        servicio.detener()
+
+
+@pytest.mark.skipif(not (doc_converter.encontrar_soffice() and doc_converter.encontrar_python_uno()),
+                    reason="requiere LibreOffice y un python con el módulo uno")
+def test_conversion_real_por_uno(tmp_path):
+    from docx import Document
+
+    origen = tmp_path / "estudio.doc"
+    origen.write_text(r"{\rtf1\ansi Patient: Juan Perez\par}")
+    servicio = ServicioConversion(doc_converter.encontrar_soffice(), cantidad=1,
+                                  python_uno=doc_converter.encontrar_python_uno())
+    try:
+        for nombre in ("uno.docx", "dos.docx"):
+            servicio.convertir(str(origen), str(tmp_path / nombre))
+            assert "Juan Perez" in Document(str(tmp_path / nombre)).paragraphs[0].text
+        assert servicio.workers[0].vivo()
+    finally:
+        servicio.detener()
+
+
+def test_convertir_sin_soffice_da_error_claro(monkeypatch):
+    monkeypatch.setattr(doc_converter, "iniciar_servicio_conversion", lambda: None)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with pytest.raises(HTTPException) as excinfo:
+            doc_converter.convertir_doc_a_docx(os.path.join(tmpdir, "x.doc"), tmpdir)
+    assert "No se encontró LibreOffice" in excinfo.value.detail
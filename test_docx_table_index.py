@@ -0,0 +1,37 @@
+from docx import Document
+
+from docx_table_index import DocxTableIndex
+from patient_data_extraction import get_measure_table, get_mot_table, mot_extractor
+
+
+def _documento():
+    doc = Document()
+    doc.add_table(rows=1, cols=1).cell(0, 0).text = 'Name: Juan Perez'
+    medidas = doc.add_table(rows=1, cols=1)
+    medidas.cell(0, 0).text = 'Measure'
+    wms = doc.add_table(rows=1, cols=1)
+    wms.cell(0, 0).text = 'WMS'
+    anidada = wms.cell(0, 0).add_table(rows=3, cols=9)
+    for c, texto in enumerate(['1', '', '', '', '', 'Basal anterior', '1', '2', '1']):
+        anidada.cell(1, c).text = texto
+    return doc
+
+
+def test_indice_encuentra_tablas_por_marcador():
+    doc = _documento()
+    indice = DocxTableIndex.desde_documento(doc)
+
+    assert indice.indice_con('measure') == 1
+    assert indice.indice_con('WMS') == 2
+    assert indice.tabla_con('inexistente') is None
+    assert indice.tablas[2].tiene_anidadas
+    assert not indice.tablas[1].tiene_anidadas
+    assert get_measure_table(doc).rows[0].cells[0].text == 'Measure'
+
+
+def test_tablas_indexadas_dan_el_mismo_resultado_que_python_docx():
+    doc = _documento()
+    original = [t for t in doc.tables if 'WMS' in t.rows[0].cells[0].text][0]
+
+    assert mot_extractor(get_mot_table(doc)) == mot_extractor(original)
+    assert mot_extractor(original) == {'mot': [{'key': 'basal anterior', 'motilidad': [1, 2, 1]}]}
@@ -0,0 +1,78 @@
+import io
+
+from docx import Document
+from docx.oxml import parse_xml
+from PIL import Image
+
+from parsed_study import ParsedStudy
+from patient_data_extraction import extract_patient_info, get_measure_table, get_measurements, get_mot_table, mot_extractor
+
+
+def _celdas(tabla):
+    return [[(cell.text, [_celdas(t) for t in cell.tables]) for cell in row.cells] for row in tabla.rows]
+
+
+def _documento(path):
+    doc = Document()
+    paciente = doc.add_table(rows=2, cols=2)
+    paciente.cell(0, 0).text = 'Name: Juan Perez'
+    paciente.cell(0, 1).text = 'Gender: Male'
+    paciente.cell(1, 0).text = 'Exam Date: 22/04/2025'
+    paciente.cell(1, 1).text = 'Age: 60'
+
+    # Celdas combinadas horizontal y verticalmente, tabs, saltos e hipervínculos
+    combinada = doc.add_table(rows=3, cols=3)
+    combinada.cell(0, 0).merge(combinada.cell(0, 1)).text = 'horizontal'
+    combinada.cell(1, 2).merge(combinada.cell(2, 2)).text = 'vertical'
+    parrafo = combinada.cell(1, 0).paragraphs[0]
+    parrafo.add_run('a\tb')
+    parrafo.add_run().add_break()
+    parrafo.add_run('c')
+    parrafo._p.append(parse_xml(
+        '<w:hyperlink xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        '<w:r><w:t>link</w:t></w:r></w:hyperlink>'))
+
+    medidas = doc.add_table(rows=2, cols=1)
+    medidas.cell(0, 0).text = 'Measure'
+    anidada = medidas.cell(1, 0).add_table(rows=2, cols=3)
+    for c, texto in enumerate(['LVIDd', '48', 'mm']):
+        anidada.cell(0, c).text = texto
+
+    wms = doc.add_table(rows=1, cols=1)
+    wms.cell(0, 0).text = 'WMS'
+    motilidad = wms.cell(0, 0).add_table(rows=3, cols=9)
+    for c, texto in enumerate(['1', '', '', '', '', 'Basal anterior', '1', '2', '1']):
+        motilidad.cell(1, c).text = texto
+
+    imagen = io.BytesIO()
+    Image.new('RGB', (4, 4), 'red').save(imagen, format='PNG')
+    imagen.seek(0)
+    doc.add_picture(imagen)
+    doc.save(path)
+
+
+def test_lxml_lee_las_mismas_tablas_que_python_docx(tmp_path):
+    path = tmp_path / 'estudio.docx'
+    _documento(path)
+    referencia = ParsedStudy(path, parser='docx')
+    lxml = ParsedStudy(path, parser='lxml')
+
+    assert [_celdas(t) for t in lxml.tables] == [_celdas(t) for t in referencia.tables]
+    assert lxml.tables[1].rows[1].cells[0].text == 'a\tb\nclink'
+    assert lxml.tables[1].rows[2].cells[2] is lxml.tables[1].rows[1].cells[2]
+    assert lxml.images == referencia.images
+    assert lxml._doc is None
+
+
+def test_lxml_da_los_mismos_dicts_de_extraccion(tmp_path):
+    path = tmp_path / 'estudio.docx'
+    _documento(path)
+    resultados = []
+    for parser in ('docx', 'lxml'):
+        study = ParsedStudy(path, parser=parser)
+        info = extract_patient_info(study)
+        resultados.append((info, get_measurements(get_measure_table(study), info['Gender']),
+                           mot_extractor(get_mot_table(study))))
+
+    assert resultados[0] == resultados[1]
+    assert resultados[1][2] == {'mot': [{'key': 'basal anterior', 'motilidad': [1, 2, 1]}]}
@@ -0,0 +1,124 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from docx.shared import Cm
+
+import image_pipeline
+from image_pipeline import transcodificar, preparar_imagenes, optimizar_png, pixeles_objetivo
+from metrics import iniciar_cronometro
+
+
+def _imagen(formato, modo='RGB', color='red', size=(40, 30)):
+    salida = BytesIO()
+    Image.new(modo, size, color).save(salida, format=formato)
+    return salida.getvalue()
+
+
+def test_jpeg_rgb_se_usa_sin_recodificar():
+    jpeg = _imagen('JPEG')
+    assert transcodificar(jpeg) == (jpeg, 'image_passthrough')
+
+
+def test_png_y_jpeg_cmyk_se_recodifican_a_jpeg():
+    for blob in (_imagen('PNG', 'RGBA'), _imagen('JPEG', 'CMYK')):
+        datos, etapa = transcodificar(blob)
+        assert etapa == 'image_transcode'
+        assert Image.open(BytesIO(datos)).format == 'JPEG'
+
+
+def test_preparar_imagenes_mantiene_el_orden_y_anota_etapas():
+    cronometro = iniciar_cronometro('docx')
+    png = _imagen('PNG')
+    imagenes = [(png, True, None), (_imagen('PNG', color='blue'), False, None), (_imagen('JPEG'), False, None),
+                (_imagen('PNG', color='green'), False, None)]
+
+    preparadas = preparar_imagenes(imagenes)
+
+    assert preparadas[0].getvalue() == png
+    assert preparadas[2].getvalue() == imagenes[2][0]
+    colores = [Image.open(preparadas[i]).convert('RGB').getpixel((0, 0)) for i in (1, 3)]
+    assert colores[0][2] > 200 and colores[1][1] > 100
+    assert sorted(nombre for nombre, _ in cronometro.etapas) == ['image_passthrough', 'image_transcode', 'image_transcode']
+
+
+def test_reduce_a_los_dpi_del_tamano_insertado():
+    objetivo = pixeles_objetivo((Cm(8), Cm(5.36)), dpi=100)
+    assert objetivo == (315, 211)
+
+    jpeg = _imagen('JPEG', size=(1600, 1200))
+    datos, etapa = transcodificar(jpeg, objetivo)
+    # misma proporción, al menos el objetivo en los dos ejes
+    assert etapa == 'image_transcode'
+    assert Image.open(BytesIO(datos)).size == (315, 236)
+
+    chico = _imagen('JPEG', size=(300, 200))
+    assert transcodificar(chico, objetivo) == (chico, 'image_passthrough')
+
+
+def test_png_con_pocos_colores_pasa_a_paleta_sin_perdida():
+    original = Image.new('RGB', (300, 200), 'white')
+    for x in range(0, 300, 7):
+        for y in range(0, 200, 5):
+            original.putpixel((x, y), ((x // 50) * 40, (y // 50) * 60, 90))
+    blob = BytesIO()
+    original.save(blob, format='PNG')
+
+    datos, etapa = optimizar_png(blob.getvalue())
+
+    optimizado = Image.open(BytesIO(datos))
+    assert etapa == 'image_png_optimize'
+    assert optimizado.mode == 'P' and len(datos) < len(blob.getvalue())
+    assert optimizado.convert('RGB').tobytes() == original.tobytes()
+
+
+@pytest.mark.parametrize('modo, cercanos', [('RGB', [(10, 10, 10), (11, 10, 10)]), ('L', [10, 11])])
+def test_png_con_colores_cercanos_no_los_junta(modo, cercanos):
+    original = Image.new(modo, (64, 64), cercanos[0])
+    for x in range(0, 64, 2):
+        for y in range(64):
+            original.putpixel((x, y), cercanos[1])
+    blob = BytesIO()
+    original.save(blob, format='PNG')
+
+    datos, _ = optimizar_png(blob.getvalue())
+
+    assert Image.open(BytesIO(datos)).convert(modo).tobytes() == original.tobytes()
+
+
+def test_sin_dpi_los_mapas_polares_no_se_tocan():
+    png = _imagen('PNG')
+    assert preparar_imagenes([(png, True, (Cm(16.23), Cm(8.22)))], dpi=0)[0].getvalue() == png
+
+
+def test_cache_de_imagenes_reusa_la_transcodificacion():
+    cache = image_pipeline.CacheImagenes(max_bytes=1024 * 1024)
+    original, image_pipeline.image_cache = image_pipeline.image_cache, cache
+    try:
+        png = _imagen('PNG', color='blue')
+        jpeg = _imagen('JPEG')
+        imagenes = [(png, False, None), (jpeg, False, None)]
+        primera = [b.getvalue() for b in preparar_imagenes(imagenes)]
+
+        cronometro = iniciar_cronometro('pdf')
+        segunda = [b.getvalue() for b in preparar_imagenes(imagenes)]
+
+        assert segunda == primera and segunda[1] == jpeg
+        assert [nombre for nombre, _ in cronometro.etapas] == ['image_cache_hit', 'image_cache_hit']
+        assert cache.estadisticas()['hits'] == 2 and cache.estadisticas()['misses'] == 2
+        # otro DPI objetivo es otra entrada
+        assert cache.clave(png, False, (10, 10)) != cache.clave(png, False, None)
+    finally:
+        image_pipeline.image_cache = original
+
+
+def test_cache_de_imagenes_descarta_la_menos_usada():
+    cache = image_pipeline.CacheImagenes(max_bytes=3 * (100 + image_pipeline.CacheImagenes.COSTO_ENTRADA))
+    for clave in 'abc':
+        cache.guardar(clave, b'x' * 100)
+    cache.obtener('a')
+    cache.guardar('d', b'x' * 100)
+
+    assert cache.obtener('b') is None and cache.obtener('a') is not None
+    assert cache.estadisticas()['evictions'] == 1
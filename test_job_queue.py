@@ -0,0 +1,113 @@
+import os
+import time
+import zipfile
+import json
+
+from job_queue import JobQueue
+
+
+def _subir(cola, contenidos):
+    job_id, job_dir = cola.nuevo_job()
+    archivos = []
+    for index, (nombre, data) in enumerate(contenidos):
+        workdir = os.path.join(job_dir, f"{index:03d}")
+        os.makedirs(workdir)
+        path = os.path.join(workdir, nombre)
+        with open(path, "wb") as f:
+            f.write(data)
+        archivos.append({'filename': nombre, 'input_path': path})
+    cola.encolar(job_id, archivos)
+    return job_id
+
+
+def test_lote_procesado_con_manifest(tmp_path):
+    cola = JobQueue(str(tmp_path))
+    job_id = _subir(cola, [("roto.docx", b"no es un docx real")])
+    assert cola.obtener(job_id)['estado'] == 'pendiente'
+
+    assert cola._reclamar() == job_id
+    cola.procesar(job_id)
+
+    job = cola.obtener(job_id)
+    assert job['estado'] == 'terminado'
+    assert job['archivos'][0]['estado'] == 'error'
+    with zipfile.ZipFile(job['zip_path']) as zf:
+        manifest = json.loads(zf.read("manifest.json"))
+        assert "errores.txt" in zf.namelist()
+    assert manifest['errores'] == 1
+
+
+def test_reinicio_reanuda_lotes_interrumpidos(tmp_path):
+    cola = JobQueue(str(tmp_path))
+    job_id = _subir(cola, [("a.docx", b"x")])
+    assert cola._reclamar() == job_id
+    cola._actualizar_archivo(job_id, 0, estado='procesando')
+
+    # una nueva instancia sobre el mismo directorio simula el reinicio del servidor
+    reiniciada = JobQueue(str(tmp_path))
+    assert reiniciada.reanudar_interrumpidos() == 1
+    job = reiniciada.obtener(job_id)
+    assert job['estado'] == 'pendiente'
+    assert job['archivos'][0]['estado'] == 'pendiente'
+
+
+def test_lotes_vencidos_expiran(tmp_path):
+    cola = JobQueue(str(tmp_path), ttl=0)
+    job_id = _subir(cola, [("roto.docx", b"x")])
+    cola._reclamar()
+    cola.procesar(job_id)
+    time.sleep(0.01)
+
+    assert cola.expirar() == 1
+    job = cola.obtener(job_id)
+    assert job['estado'] == 'expirado'
+    assert not os.path.exists(os.path.join(str(tmp_path), job_id))
+
+
+def test_lote_que_falla_al_armar_el_zip_queda_fallido_y_expira(tmp_path, monkeypatch):
+    cola = JobQueue(str(tmp_path), ttl=0)
+    job_id = _subir(cola, [("roto.docx", b"x")])
+    cola._reclamar()
+
+    def sin_espacio(*args):
+        raise OSError("No space left on device")
+    monkeypatch.setattr(cola, "_crear_zip", sin_espacio)
+    cola.procesar(job_id)
+
+    job = cola.obtener(job_id)
+    assert job['estado'] == 'fallido' and "No space left" in job['error']
+    assert cola.pendientes() == 0
+    time.sleep(0.01)
+    assert cola.expirar() == 1 and cola.obtener(job_id)['estado'] == 'expirado'
+
+
+def test_lotes_en_recepcion_cuentan_como_pendientes(tmp_path):
+    cola = JobQueue(str(tmp_path))
+    primero = cola.nuevo_job(max_pendientes=2)
+    segundo = cola.nuevo_job(max_pendientes=2)
+
+    # los dos se están recibiendo: un tercero se rechaza sin crear su directorio
+    assert cola.nuevo_job(max_pendientes=2) is None
+    assert sorted(os.listdir(str(tmp_path))) == sorted([primero[0], segundo[0], 'jobs.sqlite3'])
+
+    cola.descartar_job(segundo[0])
+    cola.encolar(primero[0], [])
+    assert cola.pendientes() == 1 and not os.path.exists(segundo[1])
+
+
+def test_endpoint_lotes_valida_antes_de_guardar(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    import main
+
+    cola = JobQueue(str(tmp_path))
+    monkeypatch.setattr(main, 'get_job_queue', lambda: cola)
+    client = TestClient(main.app)
+
+    demasiados = [("files", (f"{i}.docx", b"x")) for i in range(main.BATCH_MAX_FILES + 1)]
+    assert client.post("/lotes", files=demasiados).status_code == 400
+
+    monkeypatch.setattr(main, 'JOBS_MAX_PENDING', 1)
+    _subir(cola, [("a.docx", b"x")])
+    respuesta = client.post("/lotes", files=[("files", ("b.docx", b"y"))])
+    assert respuesta.status_code == 429 and "Retry-After" in respuesta.headers
+    assert len([nombre for nombre in os.listdir(str(tmp_path)) if nombre != 'jobs.sqlite3']) == 1
@@ -0,0 +1,50 @@
+import threading
+import time
+
+import pytest
+
+from llm_extraction import ExtractorLLM, BackendStub, CacheLLM, LLMTimeoutError
+
+
+def _respuesta(text):
+    return {"LVEF": {"value": 60, "unit": "%"}}
+
+
+def test_cache_persistente_entre_instancias(tmp_path):
+    backend = BackendStub(_respuesta)
+    cache_path = str(tmp_path / "llm.sqlite3")
+    extractor = ExtractorLLM(backend, "v1", cache=CacheLLM(cache_path))
+    assert extractor.extraer("EF 60 %") == _respuesta(None)
+
+    # otro proceso (o un reinicio) con el mismo texto, distinto espaciado
+    otro = ExtractorLLM(backend, "v1", cache=CacheLLM(cache_path))
+    assert otro.extraer("  EF   60\n%") == _respuesta(None)
+    assert otro.estadisticas['cache_hits'] == 1
+    assert otro.estadisticas['llamadas'] == 0
+
+    # cambiar la versión del prompt o del modelo invalida el cache
+    nueva_version = ExtractorLLM(backend, "v2", cache=CacheLLM(cache_path))
+    nueva_version.extraer("EF 60 %")
+    assert nueva_version.estadisticas['llamadas'] == 1
+
+
+def test_llamadas_identicas_en_curso_se_comparten():
+    extractor = ExtractorLLM(BackendStub(_respuesta, latencia=0.3), "v1", max_concurrentes=4)
+    resultados = []
+    hilos = [threading.Thread(target=lambda: resultados.append(extractor.extraer("EF 60 %"))) for _ in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert len(resultados) == 4
+    assert extractor.estadisticas['llamadas'] == 1
+    assert extractor.estadisticas['compartidas'] == 3
+
+
+def test_llamada_vencida_lanza_timeout():
+    extractor = ExtractorLLM(BackendStub(_respuesta, latencia=1), "v1", timeout=0.1)
+    inicio = time.monotonic()
+    with pytest.raises(LLMTimeoutError):
+        extractor.extraer("EF 60 %")
+    assert time.monotonic() - inicio < 0.5
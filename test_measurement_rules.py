@@ -0,0 +1,72 @@
+import copy
+
+import pytest
+
+from bench_measurement_rules import cadena_original
+from measurement_rules import procesar_mediciones, interpretar_auriculas, interpretar_pdf
+
+
+def _crudo():
+    return {
+        'LVIDd': ['61.2', '59.8'],
+        'IVSd': ['10.4'],
+        'LVPWd': ['8.7'],
+        'LVd Mass Index(2D-ASE)': ['120.3'],
+        'RWT(2D)': ['0.39'],
+        'AV Vmax': ['132.0'],
+        'MV Vel E': ['80', '75'],
+        'LA ESVI(BP A-L)': ['45.1'],
+        'RAAd': ['20.5'],
+        'LVEF': ['60', 'RWT(2D)', '0.41'],
+        'Exam_Date': ['22-04-2025'],
+    }
+
+
+@pytest.mark.parametrize('gender', ['Male', 'Female'])
+def test_mismo_resultado_que_la_cadena_original(gender):
+    assert procesar_mediciones(_crudo(), gender) == cadena_original(copy.deepcopy(_crudo()), gender)
+
+
+def test_resultado_del_motor():
+    resultado = procesar_mediciones(_crudo(), 'Male')
+
+    assert resultado['LVIDd'] == [61, 60]
+    assert resultado['AV_Vmax'] == 1.32
+    assert resultado['MV_Vel_E'] == [0.8, 0.75]
+    assert resultado['LVEF'] == 60.0
+    assert resultado['diam_lv_interpretation'] == 'Dimensiones aumentadas, espesores conservados'
+    assert resultado['mass_interpretation'] == 'Hipertrofia excéntrica'
+    assert resultado['la_text'] == 'Moderadamente dilatada'
+    assert resultado['ra_text'] == 'Levemente dilatada'
+    assert resultado['Exam_Date'] == '22-04-2025'
+
+
+@pytest.mark.parametrize('volumen, esperado', [
+    (33.9, 'Diámetros conservados'), (34, 'Levemente dilatada'), (44, 'Moderadamente dilatada'), (54, 'Severamente dilatada')])
+def test_limites_auricula_izquierda(volumen, esperado):
+    dic = {'LA ESVI(BP A-L)': volumen}
+    interpretar_auriculas(dic)
+    assert dic['la_text'] == esperado
+
+
+@pytest.mark.parametrize('area, esperado', [
+    (18, 'Diámetros conservados'), (18.5, 'Levemente dilatada'), (28, 'Levemente dilatada'), (38.1, 'Severamente dilatada')])
+def test_limites_auricula_derecha(area, esperado):
+    dic = {'LAAd': 10, 'RAAd': area}
+    interpretar_auriculas(dic)
+    assert dic['ra_text'] == esperado
+
+
+def test_pdf_usa_las_mismas_reglas_de_diametros():
+    measurements = {
+        'LVEDD': {'value': '6.0', 'unit': 'cm'},
+        'IVSd': {'value': 13.0, 'unit': 'mm'},
+        'PWd': {'value': '9', 'unit': 'mm'},
+        'LVEF': {'value': '55', 'unit': '%'},
+    }
+
+    assert interpretar_pdf(measurements, 'M') == {'diam_lv_interpretation': 'Dimensiones aumentadas, espesores aumentados'}
+    assert interpretar_pdf(measurements, 'Femenino')['diam_lv_interpretation'] == 'Dimensiones aumentadas, espesores aumentados'
+    # sin todas las mediciones (o sin unidad de longitud) no se interpreta
+    assert interpretar_pdf({'LVEDD': {'value': '60', 'unit': ''}, 'IVSd': {'value': 9, 'unit': 'mm'},
+                            'PWd': {'value': 9, 'unit': 'mm'}}, 'M') == {}
@@ -0,0 +1,38 @@
+from docx import Document
+
+from measurement_vocabulary import VocabularioCampos, cargar_vocabulario, vocabulario_campos
+from patient_data_extraction import parse_flattened_measurements
+
+
+def test_gana_el_primer_patron_del_archivo_aunque_aparezca_despues():
+    vocabulario = VocabularioCampos({'pico': 'Pico', 'vel': 'Vel', 'aortica': 'Aortica'})
+
+    assert vocabulario.buscar('vel pico') == 'Pico'
+    assert vocabulario.buscar('aortica vel') == 'Vel'
+    assert vocabulario.buscar('45 mm') is None
+    assert VocabularioCampos({}).buscar('vel') is None
+
+
+def test_vocabulario_desde_csv(tmp_path):
+    path = tmp_path / 'campos.csv'
+    path.write_text('patron,campo\nTAPSE,TAPSE\nfac%,FAC\n', encoding='utf-8')
+    vocabulario = cargar_vocabulario(str(path))
+
+    assert list(vocabulario.campos) == ['tapse', 'fac%']
+    assert vocabulario.buscar('tapse (mm)') == 'TAPSE'
+    assert vocabulario_campos().buscar('diámetro diastólico del vi') == 'LVIDd'
+
+
+def test_tabla_aplanada_busca_valor_y_unidad_en_los_vecinos():
+    doc = Document()
+    tabla = doc.add_table(rows=4, cols=3)
+    for (fila, columna), texto in {(0, 0): 'Diámetro diastólico del VI', (0, 1): '48', (0, 2): 'mm',
+                                   (2, 0): 'Masa VI', (2, 1): '180', (2, 2): 'g',
+                                   (3, 0): 'Tricúspide'}.items():
+        tabla.cell(fila, columna).text = texto
+
+    # Tricúspide no tiene ningún número cerca y no aparece
+    assert parse_flattened_measurements(tabla, 'M') == {
+        'LVIDd': {'value': '48', 'unit': 'mm'},
+        'LV_Mass': {'value': '180', 'unit': 'g'},
+    }
@@ -0,0 +1,34 @@
+from metrics import Registro, Cronometro, iniciar_cronometro, etapa, formato_de
+
+
+def test_histograma_en_formato_prometheus():
+    registro = Registro()
+    histograma = registro.histograma('eco_test_seconds', 'Prueba.', ('stage', 'tipo'), buckets=(0.1, 1.0))
+    contador = registro.contador('eco_test_total', 'Prueba.', ('tipo',))
+    histograma.observar(0.05, stage='render', tipo='card')
+    histograma.observar(0.5, stage='render', tipo='card')
+    contador.incrementar(tipo='card')
+
+    texto = registro.exponer()
+    assert '# TYPE eco_test_seconds histogram' in texto
+    assert 'eco_test_seconds_bucket{stage="render",tipo="card",le="0.1"} 1' in texto
+    assert 'eco_test_seconds_bucket{stage="render",tipo="card",le="1"} 2' in texto
+    assert 'eco_test_seconds_bucket{stage="render",tipo="card",le="+Inf"} 2' in texto
+    assert 'eco_test_seconds_count{stage="render",tipo="card"} 2' in texto
+    assert 'eco_test_total{tipo="card"} 1' in texto
+
+
+def test_cronometro_suma_las_etapas_del_worker():
+    cronometro = iniciar_cronometro(formato_de('estudio.DOC'))
+    with etapa('upload'):
+        pass
+
+    worker = Cronometro('doc')
+    worker.tipo = 'stress'
+    with worker.etapa('render'):
+        pass
+    cronometro.agregar(worker.exportar())
+
+    assert cronometro.formato == 'doc'
+    assert cronometro.tipo == 'stress'
+    assert [nombre for nombre, _ in cronometro.etapas] == ['upload', 'render']
@@ -0,0 +1,48 @@
+import os
+import tempfile
+
+from docx import Document
+
+import parsed_study
+from parsed_study import ParsedStudy, parse_study
+from template_manager import template_selector
+from patient_data_extraction import extract_patient_info
+
+
+def _estudio_docx(tmpdir):
+    doc = Document()
+    doc.add_table(rows=1, cols=1).cell(0, 0).text = 'Vinno'
+    info = doc.add_table(rows=1, cols=2)
+    info.cell(0, 0).text = 'Name: Juan Perez'
+    info.cell(0, 1).text = 'Gender: Male'
+    doc.add_table(rows=1, cols=1).cell(0, 0).text = 'WMS'
+    path = os.path.join(tmpdir, 'estudio.docx')
+    doc.save(path)
+    return path
+
+
+def test_docx_se_parsea_una_sola_vez(monkeypatch):
+    aperturas = []
+    original = parsed_study.Document
+
+    def contar(path):
+        aperturas.append(path)
+        return original(path)
+
+    monkeypatch.setattr(parsed_study, 'Document', contar)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        study = ParsedStudy(_estudio_docx(tmpdir))
+        _, tipo = template_selector(study)
+        info = extract_patient_info(study)
+
+    assert tipo == 'stress'
+    assert info['Gender'] == 'Male'
+    assert len(aperturas) == 1
+    assert study.tables is study.tables
+
+
+def test_parse_study_reutiliza_instancia():
+    study = ParsedStudy('informe.pdf')
+    assert parse_study(study) is study
+    assert study.formato == 'pdf'
+    assert parse_study('informe.docx').formato == 'docx'
@@ -0,0 +1,158 @@
+import pytest
+
+import pdf_processor
+from pdf_processor import analyze_pdf_content, analizar_pdf, PaginasPdf, BACKENDS_PDF
+
+# Una página con texto y una tabla de 2x2 dibujada con líneas, otra solo con texto
+PAGINAS = [
+    b"BT /F1 12 Tf 72 760 Td (Patient: Juan Perez) Tj 0 -16 Td (Gender: M) Tj ET\n"
+    b"0.5 w 72 600 m 272 600 l 72 630 m 272 630 l 72 660 m 272 660 l "
+    b"72 600 m 72 660 l 172 600 m 172 660 l 272 600 m 272 660 l S\n"
+    b"BT /F1 10 Tf 80 640 Td (LVIDd) Tj 100 0 Td (48) Tj -100 -30 Td (IVSd) Tj 100 0 Td (11) Tj ET\n",
+    b"BT /F1 12 Tf 72 760 Td (Narrative page) Tj ET\n",
+]
+
+
+def _pdf(path, paginas=PAGINAS, imagenes=()):
+    # imagenes: (diccionario, datos) de XObjects /Im1, /Im2... disponibles en todas las páginas
+    primera_imagen = 4 + 2 * len(paginas)
+    xobjects = b" ".join(b"/Im%d %d 0 R" % (k + 1, primera_imagen + k) for k in range(len(imagenes)))
+    objetos = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % (4 + 2 * i) for i in range(len(paginas)))
+               + b"] /Count %d >>" % len(paginas),
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for i, contenido in enumerate(paginas):
+        objetos.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >>"
+                       b" /XObject << %s >> >> /Contents %d 0 R >>" % (xobjects, 5 + 2 * i))
+        objetos.append(b"<< /Length %d >>\nstream\n" % len(contenido) + contenido + b"\nendstream")
+    for diccionario, contenido in imagenes:
+        objetos.append(b"<< /Type /XObject /Subtype /Image %s /Length %d >>\nstream\n" % (diccionario, len(contenido))
+                       + contenido + b"\nendstream")
+    datos = b"%PDF-1.4\n"
+    offsets = []
+    for numero, objeto in enumerate(objetos, start=1):
+        offsets.append(len(datos))
+        datos += b"%d 0 obj\n" % numero + objeto + b"\nendobj\n"
+    xref = len(datos)
+    datos += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1)
+    datos += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    datos += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objetos) + 1, xref)
+    path.write_bytes(datos)
+    return str(path)
+
+
+def test_backends_devuelven_las_mismas_paginas(tmp_path):
+    pdf = _pdf(tmp_path / "estudio.pdf")
+
+    resultados = [analyze_pdf_content(pdf, backend) for backend in BACKENDS_PDF]
+
+    assert resultados[0] == resultados[1]
+    primera, segunda = resultados[0]
+    assert primera['text_lines'][:2] == ['Patient: Juan Perez', 'Gender: M']
+    assert primera['has_tables'] and primera['tables'][0] == [['LVIDd', '48'], ['IVSd', '11']]
+    assert segunda['text_lines'] == ['Narrative page'] and not segunda['has_tables']
+
+
+def test_backend_desconocido(tmp_path):
+    with pytest.raises(ValueError):
+        analyze_pdf_content(_pdf(tmp_path / "estudio.pdf"), 'poppler')
+
+
+def test_analisis_en_paralelo_une_las_paginas_en_orden(tmp_path, monkeypatch):
+    pdf = _pdf(tmp_path / "estudio.pdf")
+    secuencial = analizar_pdf(pdf)
+
+    monkeypatch.setattr(pdf_processor, 'PDF_PAGE_WORKERS', 2)
+    monkeypatch.setattr(pdf_processor, 'PDF_PARALLEL_MIN_PAGES', 2)
+    try:
+        paralelo = analizar_pdf(pdf)
+    finally:
+        pdf_processor._descartar_page_pool()
+
+    assert paralelo == secuencial
+    assert [pagina['page_number'] for pagina in paralelo[0]] == [1, 2]
+
+
+def test_imagenes_del_pdf_quedan_en_memoria(tmp_path):
+    from io import BytesIO
+    from PIL import Image
+    from docxtpl import DocxTemplate
+    from patient_data_extraction import process_pdf_images
+
+    jpeg = BytesIO()
+    Image.new('RGB', (40, 30), 'red').save(jpeg, format='JPEG')
+    imagenes = {'page_2_img_1': jpeg.getvalue(), 'page_2_img_2': memoryview(jpeg.getvalue())}
+
+    datos = pdf_processor.pdf_to_docx_data(_pdf(tmp_path / "estudio.pdf"), images=imagenes)
+
+    # los mismos buffers, sin pasar por archivos temporales
+    assert all(datos['images'][nombre] is imagen for nombre, imagen in imagenes.items())
+    contexto = process_pdf_images(datos['images'], DocxTemplate("auto card.docx"), 'card')
+    assert [imagen['key'] for imagen in contexto['image']] == ['image1', 'image2']
+
+
+def _pagina_con_texto(*lineas):
+    contenido = b"BT /F1 12 Tf 72 760 Td"
+    for linea in lineas:
+        contenido += b" (%s) Tj 0 -16 Td" % linea
+    return contenido + b" ET\n"
+
+
+@pytest.mark.parametrize('backend', BACKENDS_PDF)
+def test_paginas_se_leen_hasta_encontrar_el_marcador(tmp_path, backend):
+    paginas = [_pagina_con_texto(b"Patient: Juan Perez"), _pagina_con_texto(b"Stress echo", b"Wall"),
+               _pagina_con_texto(b"Motion Score"), _pagina_con_texto(b"WMS")]
+    pdf = _pdf(tmp_path / "estudio.pdf", paginas)
+
+    lector = PaginasPdf(pdf, backend)
+    assert lector.buscar(['PATIENT']) == 1 and list(lector._lineas) == [0]
+    # el marcador puede quedar partido entre dos páginas
+    assert lector.buscar(['WALL MOTION']) == 3 and len(lector._lineas) == 3
+    assert lector.buscar(['WMS'], max_paginas=3) is None and len(lector._lineas) == 3
+    assert list(lector) == [['Patient: Juan Perez'], ['Stress echo', 'Wall'], ['Motion Score'], ['WMS']]
+
+
+@pytest.mark.parametrize('backend', BACKENDS_PDF)
+def test_triage_busca_tablas_solo_donde_hay_mediciones(tmp_path, monkeypatch, capsys, backend):
+    # la primera página de PAGINAS con otra tabla pero sin ninguna medición ni motilidad
+    sin_mediciones = PAGINAS[0].replace(b"LVIDd", b"Sala").replace(b"IVSd", b"Cama")
+    pdf = _pdf(tmp_path / "estudio.pdf", [PAGINAS[0], sin_mediciones, PAGINAS[1]])
+
+    paginas = analyze_pdf_content(pdf, backend)
+
+    assert [pagina['has_tables'] for pagina in paginas] == [True, False, False]
+    assert "skipped on 2 of 3 pages" in capsys.readouterr().out
+
+    monkeypatch.setattr(pdf_processor, 'PDF_FULL_TABLE_SCAN', True)
+    paginas = analyze_pdf_content(pdf, backend)
+    assert [pagina['has_tables'] for pagina in paginas] == [True, True, False]
+
+
+def test_imagenes_jpeg_sin_recodificar_y_el_resto_decodificadas(tmp_path, monkeypatch):
+    import zlib
+    from io import BytesIO
+    from PIL import Image
+    from docx.shared import Cm
+
+    jpeg = BytesIO()
+    Image.new('RGB', (40, 30), 'red').save(jpeg, format='JPEG')
+    grande = Image.new('RGB', (1200, 600), (0, 0, 255))
+    imagenes = [(b"/Width 40 /Height 30 /ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode", jpeg.getvalue()),
+                (b"/Width 1200 /Height 600 /ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode",
+                 zlib.compress(grande.tobytes()))]
+    pagina = b"q 40 0 0 30 72 600 cm /Im1 Do Q q 200 0 0 100 72 400 cm /Im2 Do Q\n"
+    pdf = _pdf(tmp_path / "estudio.pdf", [PAGINAS[1], pagina], imagenes)
+
+    for backend in BACKENDS_PDF:
+        paginas, extraidas = analizar_pdf(pdf, backend)
+        assert [p['has_images'] for p in paginas] == [False, True]
+        assert extraidas['page_2_img_1'] == jpeg.getvalue()
+        decodificada = Image.open(BytesIO(extraidas['page_2_img_2']))
+        assert decodificada.format == 'PNG' and decodificada.size == (1200, 600)
+        assert decodificada.convert('RGB').getpixel((10, 10)) == (0, 0, 255)
+
+    # con IMAGE_TARGET_DPI no se guardan más grandes que el mayor tamaño insertado
+    monkeypatch.setattr(pdf_processor, 'IMAGE_TARGET_DPI', 50)
+    _, extraidas = analizar_pdf(pdf)
+    ancho, alto = Image.open(BytesIO(extraidas['page_2_img_2'])).size
+    assert ancho < 1200 and alto >= round(Cm(8.22).inches * 50)
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+from report_cache import CacheInformes
+
+
+def _archivo(tmp_path, nombre, data):
+    path = tmp_path / nombre
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_cache_devuelve_el_informe_con_su_nombre(tmp_path):
+    cache = CacheInformes(str(tmp_path / "cache"), max_bytes=1024)
+    subido = _archivo(tmp_path, "estudio.docx", b"estudio")
+    informe = _archivo(tmp_path, "Juan_card_01_01_2025.docx", b"informe")
+    clave = cache.clave(subido)
+
+    assert cache.obtener(clave, str(tmp_path)) is None
+    cache.guardar(clave, informe)
+
+    destino = tmp_path / "destino"
+    destino.mkdir()
+    save_path = cache.obtener(clave, str(destino))
+    assert os.path.basename(save_path) == "Juan_card_01_01_2025.docx"
+    assert open(save_path, "rb").read() == b"informe"
+    assert cache.estadisticas()['hits'] == 1
+
+
+def test_misma_clave_para_el_mismo_contenido(tmp_path):
+    cache = CacheInformes(str(tmp_path / "cache"), max_bytes=1024)
+    a = _archivo(tmp_path, "a.docx", b"mismo contenido")
+    b = _archivo(tmp_path, "b.docx", b"mismo contenido")
+    c = _archivo(tmp_path, "c.docx", b"otro contenido")
+    assert cache.clave(a) == cache.clave(b)
+    assert cache.clave(a) != cache.clave(c)
+
+
+def test_cache_descarta_el_menos_usado(tmp_path):
+    cache = CacheInformes(str(tmp_path / "cache"), max_bytes=10)
+    for nombre in ("uno", "dos"):
+        cache.guardar(nombre, _archivo(tmp_path, f"{nombre}.docx", b"12345"))
+    # usar "uno" lo vuelve el más reciente
+    assert cache.obtener("uno", str(tmp_path))
+    cache.guardar("tres", _archivo(tmp_path, "tres.docx", b"12345"))
+
+    assert cache.obtener("dos", str(tmp_path)) is None
+    assert cache.obtener("uno", str(tmp_path))
+    assert cache.estadisticas()['evictions'] == 1
+
+    # el índice se reconstruye desde el disco
+    reabierto = CacheInformes(str(tmp_path / "cache"), max_bytes=10)
+    assert reabierto.obtener("tres", str(tmp_path))
+
+
+def test_cache_de_informes_generados_en_memoria(tmp_path):
+    cache = CacheInformes(str(tmp_path / "cache"), max_bytes=1024)
+    assert cache.obtener_contenido("clave") is None
+
+    cache.guardar_contenido("clave", "Juan_card_01_01_2025.docx", b"informe")
+
+    assert cache.obtener_contenido("clave") == ("Juan_card_01_01_2025.docx", b"informe")
+    # la misma entrada sirve a los que esperan una ruta
+    assert open(cache.obtener("clave", str(tmp_path)), "rb").read() == b"informe"
+
+
+def test_la_clave_distingue_lo_que_cambia_el_informe(tmp_path, monkeypatch):
+    import image_pipeline
+
+    cache = CacheInformes(str(tmp_path / "cache"), max_bytes=1024)
+    estudio = _archivo(tmp_path, "estudio.docx", b"mismo contenido")
+    carotidas = _archivo(tmp_path, "Carotid 01.docx", b"mismo contenido")
+    pdf = _archivo(tmp_path, "estudio.pdf", b"mismo contenido")
+    clave = cache.clave(estudio)
+
+    # el nombre del archivo elige el template (template_selector) y la extensión el lector
+    assert cache.clave(carotidas) != clave and cache.clave(pdf) != clave
+    assert cache.clave(estudio, parser='lxml') != clave
+    monkeypatch.setattr(image_pipeline, 'IMAGE_TARGET_DPI', 150.0)
+    assert cache.clave(estudio) != clave
+
+
+def test_la_clave_distingue_el_backend_y_modelo_del_llm(tmp_path, monkeypatch):
+    pdf_processor_enhanced = pytest.importorskip("pdf_processor_enhanced")
+
+    cache = CacheInformes(str(tmp_path / "cache"), max_bytes=1024)
+    pdf = _archivo(tmp_path, "estudio.pdf", b"mismo contenido")
+    monkeypatch.setattr(pdf_processor_enhanced, 'LLM_BACKEND', 'stub')
+    clave = cache.clave(pdf)
+
+    monkeypatch.setattr(pdf_processor_enhanced, 'GEMINI_MODEL', 'otro-modelo')
+    assert cache.clave(pdf) != clave
+    monkeypatch.setattr(pdf_processor_enhanced, 'PROMPT_DESCRIPTION', 'otro prompt')
+    assert cache.clave(pdf) != cache.clave(pdf, parser='lxml') != clave
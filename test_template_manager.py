@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+
+from template_manager import TemplateStore, TEMPLATE_FILES, BASE_DIR
+
+
+def _store_temporal(tmpdir):
+    shutil.copy(os.path.join(BASE_DIR, TEMPLATE_FILES['card']), os.path.join(tmpdir, 'card.docx'))
+    return TemplateStore(tmpdir, {'card': 'card.docx'})
+
+
+def test_template_store_entrega_copias_independientes():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = _store_temporal(tmpdir)
+        store.precargar()
+        primera = store.obtener('card')
+        segunda = store.obtener('card')
+
+        assert primera.docx is not segunda.docx
+        primera.docx.add_paragraph('solo en la primera copia')
+        assert len(segunda.docx.paragraphs) == len(store.obtener('card').docx.paragraphs)
+        assert store.estadisticas() == {'hits': 3, 'reloads': 0, 'loads': 1}
+
+
+def test_template_store_recarga_si_el_archivo_cambia():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = _store_temporal(tmpdir)
+        store.obtener('card')
+        path = store.ruta('card')
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        store.obtener('card')
+        store.obtener('card')
+        assert store.estadisticas() == {'hits': 1, 'reloads': 1, 'loads': 1}
+
+
+def test_recargar_un_template_descarta_su_xml_anterior():
+    import template_manager
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = _store_temporal(tmpdir)
+        path = store.ruta('card')
+        store.obtener('card').render({})
+        parcheados = len(template_manager._xml_parcheado[path])
+        compilados = len(template_manager._entornos_jinja[path]._compilados)
+
+        # el template se edita en disco: otro XML de origen
+        from docx import Document
+        editado = Document(path)
+        editado.add_paragraph('párrafo agregado')
+        editado.save(path)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        store.obtener('card').render({})
+
+        # una sola copia por template, no una más por cada recarga
+        assert len(template_manager._xml_parcheado[path]) == parcheados
+        assert len(template_manager._entornos_jinja[path]._compilados) == compilados
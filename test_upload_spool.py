@@ -0,0 +1,59 @@
+import io
+import hashlib
+
+import pytest
+from fastapi import HTTPException
+
+from upload_spool import copiar_subida, tamano_de, CHUNK_SIZE
+from report_cache import report_cache
+
+
+class _Origen(io.BytesIO):
+    def __init__(self, datos):
+        super().__init__(datos)
+        self.leidos = 0
+
+    def read(self, n=-1):
+        chunk = super().read(n)
+        self.leidos += len(chunk)
+        return chunk
+
+
+def test_copia_calcula_el_hash_en_la_misma_pasada(tmp_path):
+    datos = bytes(range(256)) * 10000
+    destino = str(tmp_path / "estudio.docx")
+
+    subida = copiar_subida(io.BytesIO(datos), destino)
+
+    assert subida.tamano == len(datos) and subida.sha256.hexdigest() == hashlib.sha256(datos).hexdigest()
+    assert open(destino, 'rb').read() == datos
+    # la clave del cache es la misma que releyendo el archivo
+    assert report_cache.clave(destino, subida.sha256) == report_cache.clave(destino)
+
+
+def test_archivo_grande_se_corta_apenas_supera_el_limite(tmp_path):
+    origen = _Origen(b"x" * (CHUNK_SIZE * 10))
+    destino = tmp_path / "grande.pdf"
+
+    with pytest.raises(HTTPException) as error:
+        copiar_subida(origen, str(destino), max_bytes=CHUNK_SIZE + 1)
+
+    assert error.value.status_code == 413
+    assert origen.leidos == 2 * CHUNK_SIZE and not destino.exists()
+
+
+def test_tamano_sin_leer_el_archivo():
+    origen = _Origen(b"abc" * 100)
+    assert tamano_de(origen) == 300 and origen.leidos == 0 and origen.tell() == 0
+
+
+def test_generar_informe_rechaza_por_content_length(monkeypatch):
+    from fastapi.testclient import TestClient
+    import main
+
+    monkeypatch.setattr(main, 'MAX_FILE_SIZE', 1000)
+    client = TestClient(main.app)
+    respuesta = client.post("/generar_informe", files={"file": ("estudio.docx", b"x" * 200_000)})
+
+    assert respuesta.status_code == 413
+    assert 'eco_rejected_requests_total{endpoint="/generar_informe",status="413"}' in client.get("/metrics").text
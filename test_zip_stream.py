@@ -0,0 +1,41 @@
+import io
+import os
+import tempfile
+import zipfile
+
+from fastapi.testclient import TestClient
+
+import batch_processor
+from zip_stream import ZipEnStreaming
+
+
+def test_zip_en_streaming_genera_zip_valido():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "informe.docx")
+        contenido = os.urandom(200 * 1024)
+        with open(path, "wb") as f:
+            f.write(contenido)
+
+        zip_stream = ZipEnStreaming()
+        chunks = list(zip_stream.agregar_archivo(path, "informe.docx"))
+        chunks.append(zip_stream.agregar_bytes("errores.txt", "sin errores".encode("utf-8")))
+        chunks.append(zip_stream.cerrar())
+
+    assert len([c for c in chunks if c]) > 2
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as z:
+        assert z.testzip() is None
+        assert z.namelist() == ["informe.docx", "errores.txt"]
+        assert z.read("informe.docx") == contenido
+
+
+def test_lote_sin_ningun_informe_devuelve_500_y_libera_capacidad():
+    from main import app
+
+    client = TestClient(app)
+    response = client.post(
+        "/generar_informes_multiples",
+        files=[("files", ("a.txt", b"x")), ("files", ("b.txt", b"y"))]
+    )
+    assert response.status_code == 500
+    assert "No se pudo procesar ningún archivo" in response.text
+    assert batch_processor.admision.en_curso == 0
@@ -0,0 +1,81 @@
+"""
+Puente entre doc_converter y una instancia de LibreOffice escuchando en un pipe UNO.
+
+Corre como proceso aparte con un intérprete que pueda importar `uno` (en Debian, el python3
+del sistema con python3-uno; en macOS, el python que trae LibreOffice), así el servidor no
+necesita ese módulo. Queda vivo y conectado a su instancia entre una conversión y otra.
+Solo usa la biblioteca estándar y `uno`.
+
+Protocolo, una línea JSON por conversión:
+    stdin:  {"entrada": "/ruta/estudio.doc", "salida": "/ruta/estudio.docx", "timeout": 60}
+    stdout: {"ok": true} o {"error": "..."}
+
+Uso: python3 uno_bridge.py <nombre del pipe>
+"""
+
+import os
+import sys
+import json
+import time
+
+import uno
+from com.sun.star.beans import PropertyValue
+
+
+def _propiedad(nombre, valor):
+    prop = PropertyValue()
+    prop.Name = nombre
+    prop.Value = valor
+    return prop
+
+
+def conectar(nombre_pipe, deadline):
+    '''
+    Devuelve el Desktop de la instancia que escucha en nombre_pipe, reintentando hasta
+    deadline (time.monotonic) mientras la instancia termina de arrancar.
+    '''
+    local_ctx = uno.getComponentContext()
+    resolver = local_ctx.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local_ctx)
+    while True:
+        try:
+            ctx = resolver.resolve(f"uno:pipe,name={nombre_pipe};urp;StarOffice.ComponentContext")
+            return ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def convertir(desktop, entrada, salida):
+    document = desktop.loadComponentFromURL(
+        uno.systemPathToFileUrl(os.path.abspath(entrada)), "_blank", 0,
+        (_propiedad("Hidden", True), _propiedad("ReadOnly", True))
+    )
+    if document is None:
+        raise Exception(f"LibreOffice no pudo abrir {os.path.basename(entrada)}")
+    try:
+        document.storeToURL(uno.systemPathToFileUrl(os.path.abspath(salida)),
+                            (_propiedad("FilterName", "MS Word 2007 XML"),))
+    finally:
+        document.close(True)
+
+
+def main(nombre_pipe):
+    desktop = None
+    for linea in sys.stdin:
+        pedido = json.loads(linea)
+        try:
+            if desktop is None:
+                desktop = conectar(nombre_pipe, time.monotonic() + pedido['timeout'])
+            convertir(desktop, pedido['entrada'], pedido['salida'])
+            respuesta = {'ok': True}
+        except Exception as e:
+            # La próxima conversión vuelve a conectarse
+            desktop = None
+            respuesta = {'error': str(e)}
+        sys.stdout.write(json.dumps(respuesta) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
@@ -0,0 +1,96 @@
+"""
+Guardado de los archivos subidos en bloques, con el límite de tamaño y el hash calculados
+mientras se copian.
+
+El archivo se copia de a CHUNK_SIZE bytes y la copia se corta apenas supera el límite, sin
+leer el resto. El SHA-256 de los bytes sale de la misma pasada y es la base de la clave del
+cache de informes, así no hace falta volver a leer el archivo para calcularla.
+
+Los directorios de trabajo de cada pedido se crean en UPLOAD_TMPDIR. Por defecto es /dev/shm
+si es un tmpfs con espacio suficiente, así el archivo subido y el informe generado no tocan el
+disco; si no, el directorio temporal del sistema.
+"""
+
+import os
+import hashlib
+import tempfile
+from typing import NamedTuple, Optional, BinaryIO
+
+from fastapi import HTTPException
+
+# Tamaño máximo de cada archivo subido
+UPLOAD_MAX_MB = float(os.getenv('UPLOAD_MAX_MB', 50))
+MAX_FILE_SIZE = int(UPLOAD_MAX_MB * 1024 * 1024)
+# Margen para los encabezados multipart al comparar el Content-Length de un pedido de un archivo
+MARGEN_MULTIPART = 64 * 1024
+# tmpfs más chicos que esto (el /dev/shm de 64 MB de Docker) no se usan por defecto
+TMPFS_MIN_BYTES = 1024 * 1024 * 1024
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _directorio_por_defecto() -> Optional[str]:
+    try:
+        stat = os.statvfs('/dev/shm')
+    except (OSError, AttributeError):
+        return None
+    if stat.f_blocks * stat.f_frsize < TMPFS_MIN_BYTES or not os.access('/dev/shm', os.W_OK):
+        return None
+    return '/dev/shm'
+
+
+# Dónde se crean los directorios de trabajo de cada pedido; None usa el temporal del sistema
+UPLOAD_TMPDIR = os.getenv('UPLOAD_TMPDIR') or _directorio_por_defecto()
+
+
+class Subida(NamedTuple):
+    path: str
+    tamano: int
+    # hashlib.sha256 de los bytes del archivo; report_cache.clave lo usa en lugar de releerlo
+    sha256: "hashlib._Hash"
+
+
+def rechazar_por_tamano() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Archivo demasiado grande. Máximo: {UPLOAD_MAX_MB:g}MB")
+
+
+def copiar_subida(origen: BinaryIO, destino: str, max_bytes: int = MAX_FILE_SIZE) -> Subida:
+    '''
+    Copia origen a la ruta destino en bloques, calculando el SHA-256. Si el archivo supera
+    max_bytes deja de leer, borra lo copiado y lanza un 413.
+    '''
+    digest = hashlib.sha256()
+    tamano = 0
+    try:
+        with open(destino, 'wb') as f:
+            for chunk in iter(lambda: origen.read(CHUNK_SIZE), b''):
+                tamano += len(chunk)
+                if tamano > max_bytes:
+                    raise rechazar_por_tamano()
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        try:
+            os.unlink(destino)
+        except OSError:
+            pass
+        raise
+    return Subida(destino, tamano, digest)
+
+
+def tamano_de(origen: BinaryIO) -> int:
+    '''
+    Tamaño de un archivo abierto sin leerlo; deja la posición al principio.
+    '''
+    origen.seek(0, os.SEEK_END)
+    tamano = origen.tell()
+    origen.seek(0)
+    return tamano
+
+
+def directorio_de_trabajo() -> tempfile.TemporaryDirectory:
+    return tempfile.TemporaryDirectory(dir=UPLOAD_TMPDIR)
+
+
+def crear_directorio_de_trabajo() -> str:
+    return tempfile.mkdtemp(dir=UPLOAD_TMPDIR)
@@ -0,0 +1,96 @@
+"""
+ZIP que se genera en streaming: cada archivo agregado produce enseguida los bytes
+que se le envían al cliente, sin escribir el ZIP completo en disco ni en memoria.
+"""
+
+import io
+import json
+import zipfile
+from typing import Iterator, List, Dict, Any
+
+# Tamaño de los bloques leídos de cada archivo agregado
+CHUNK_SIZE = 64 * 1024
+
+
+class _SalidaNoSeekable(io.RawIOBase):
+    '''
+    Destino de escritura que acumula lo que escribe zipfile hasta que se drena.
+    No permite seek, así zipfile usa data descriptors y nunca vuelve atrás.
+    '''
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._posicion = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._posicion += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._posicion
+
+    def flush(self) -> None:
+        pass
+
+    def drenar(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class ZipEnStreaming:
+    '''
+    Uso:
+        zip_stream = ZipEnStreaming()
+        for chunk in zip_stream.agregar_archivo(path, nombre): enviar(chunk)
+        enviar(zip_stream.agregar_bytes("errores.txt", contenido))
+        enviar(zip_stream.cerrar())
+    '''
+
+    def __init__(self, compression: int = zipfile.ZIP_DEFLATED):
+        self._salida = _SalidaNoSeekable()
+        self._zip = zipfile.ZipFile(self._salida, 'w', compression)
+
+    def agregar_archivo(self, path: str, arcname: str) -> Iterator[bytes]:
+        with open(path, 'rb') as origen, self._zip.open(arcname, 'w') as destino:
+            while True:
+                data = origen.read(CHUNK_SIZE)
+                if not data:
+                    break
+                destino.write(data)
+                chunk = self._salida.drenar()
+                if chunk:
+                    yield chunk
+        yield self._salida.drenar()
+
+    def agregar_bytes(self, arcname: str, data: bytes) -> bytes:
+        self._zip.writestr(arcname, data)
+        return self._salida.drenar()
+
+    def cerrar(self) -> bytes:
+        self._zip.close()
+        return self._salida.drenar()
+
+
+def contenido_errores(generados: int, errors: List[str]) -> str:
+    '''
+    Texto de errores.txt: resumen del lote y la lista de errores.
+    '''
+    error_log = "\n".join([f"- {error}" for error in errors])
+    error_content = f"Archivos procesados exitosamente: {generados}\n"
+    error_content += f"Archivos con errores: {len(errors)}\n\n"
+    error_content += "Errores encontrados:\n" + error_log
+    return error_content
+
+
+def contenido_manifest(generados: int, archivos: List[Dict[str, Any]]) -> bytes:
+    '''
+    manifest.json: estado de cada archivo del lote, en el orden en que se subieron.
+    '''
+    errores = len([a for a in archivos if a.get("estado") == "error"])
+    manifest = {"generados": generados, "errores": errores, "archivos": archivos}
+    return json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')